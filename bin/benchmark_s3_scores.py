@@ -0,0 +1,92 @@
+"""
+Benchmarks the blocked saliency 3 scoring (see epilogos.scores.blockScoresS3()) against the previous row by row loop, which
+summed the pair scores of every row with np.add.at
+
+Usage: python bin/benchmark_s3_scores.py [numRows] [numStates] [numCols ...]
+Defaults to 2000 rows of 18 states for 50, 127 and 300 epigenomes
+"""
+import numpy as np
+from sys import argv
+from time import time
+from epilogos.helpers import getEpigenomePairs
+from epilogos.scores import blockScoresS3, klScoreND
+
+
+def main(numRows, numStates, numColsList):
+    """
+    Scores the same random block of states with both methods for each number of epigenomes and prints their rows per second
+
+    Input:
+    numRows -- The number of rows in each benchmarked block
+    numStates -- The number of states in the state model
+    numColsList -- List of the numbers of epigenomes to benchmark
+    """
+    rng = np.random.default_rng(7032016)
+
+    print("numCols\tloop rows/s\tblocked rows/s\tspeedup\tmax abs diff", flush=True)
+    for numCols in numColsList:
+        # Random states, so that no two rows are identical and the blocked scoring cannot skip any of them
+        dataArr = rng.integers(numStates, size=(numRows, numCols), dtype=np.uint8)
+        expFreqArr = expectedS3(dataArr, numStates)
+
+        tLoop = time()
+        loopScoreArr = loopScoresS3(dataArr, numStates, expFreqArr)
+        tLoop = time() - tLoop
+
+        tBlocked = time()
+        blockedScoreArr, _, _ = blockScoresS3(dataArr, numStates, expFreqArr, {})
+        tBlocked = time() - tBlocked
+
+        print("{}\t{:.1f}\t{:.1f}\t{:.1f}x\t{:.2e}".format(numCols, numRows / tLoop, numRows / tBlocked, tLoop / tBlocked,
+                                                          np.abs(loopScoreArr - blockedScoreArr).max()), flush=True)
+
+
+def expectedS3(dataArr, numStates):
+    """
+    Calculates normalized saliency 3 expected frequencies of a block of states (see epilogos.expected.s3Calc())
+
+    Input:
+    dataArr -- 2d numpy array of the states of the block
+    numStates -- The number of states in the state model
+
+    Output:
+    numPairs x numStates x numStates numpy array of the expected frequencies
+    """
+    firstCols, secondCols = getEpigenomePairs(dataArr.shape[1])
+    pairOffsets = np.arange(len(firstCols)) * numStates * numStates
+    expFreqArr = np.bincount((pairOffsets + dataArr[:, firstCols].astype(np.intp) * numStates
+                              + dataArr[:, secondCols]).ravel(), minlength=len(firstCols) * numStates * numStates)
+    return (expFreqArr / expFreqArr.sum()).astype(np.float32).reshape(len(firstCols), numStates, numStates)
+
+
+def loopScoresS3(dataArr, numStates, expFreqArr):
+    """
+    The previous saliency 3 scoring, which looks up the pair scores of one row at a time and sums them with np.add.at
+
+    Input:
+    dataArr -- 2d numpy array of the states of the block
+    numStates -- The number of states in the state model
+    expFreqArr -- numPairs x numStates x numStates numpy array of the expected frequencies
+
+    Output:
+    2d numpy array of the scores of each state in each row of the block
+    """
+    firstCols, secondCols = getEpigenomePairs(dataArr.shape[1])
+    pairRange = np.arange(len(firstCols))
+    scoreArrOnes = klScoreND(np.ones(expFreqArr.shape, dtype=np.float32) / len(pairRange), expFreqArr) / 2
+
+    scoreArr = np.zeros((dataArr.shape[0], numStates), dtype=np.float32)
+    rowScoreArr = np.zeros(numStates, dtype=np.float32)
+    for dataRow in range(dataArr.shape[0]):
+        pairScores = scoreArrOnes[pairRange, dataArr[dataRow, firstCols], dataArr[dataRow, secondCols]]
+        np.add.at(rowScoreArr, dataArr[dataRow, firstCols], pairScores)
+        np.add.at(rowScoreArr, dataArr[dataRow, secondCols], pairScores)
+        scoreArr[dataRow] = rowScoreArr
+        rowScoreArr.fill(0)
+
+    return scoreArr
+
+
+if __name__ == "__main__":
+    main(int(argv[1]) if len(argv) > 1 else 2000, int(argv[2]) if len(argv) > 2 else 18,
+         [int(numCols) for numCols in argv[3:]] if len(argv) > 3 else [50, 127, 300])
@@ -0,0 +1,225 @@
+import numpy as np
+import pandas as pd
+import gzip
+import errno
+from sys import argv
+from pathlib import Path
+from time import time
+from multiprocessing import cpu_count, Pool
+from itertools import repeat
+from contextlib import closing
+from epilogos.helpers import strToBool, binarySuffix, writeBinaryHeader, listInputFiles, atomicWrite
+
+
+def main(inputDirectory, outputDirectory, numProcesses, verbose, metadataFile="null", binSize=200):
+    """
+    Converts every tab separated state matrix in a directory into a binary state matrix, which can be used as epilogos input
+    without decompressing or parsing text. If a metadata file is given, the directory is instead read as per biosample,
+    per chromosome ChromHMM statebyline files, which are assembled into one binary state matrix per chromosome
+
+    Input:
+    inputDirectory -- The path of the directory containing the tab separated state matrices (or statebyline files)
+    outputDirectory -- The path of the directory to write the binary state matrices to
+    numProcesses -- The number of cores to run on
+    verbose -- Boolean which if True, causes much more detailed prints
+    metadataFile -- The path of the biosample metadata file (biosample names in the first column) [default="null"]
+    binSize -- The size of each ChromHMM bin in base pairs (only used with a metadata file) [default=200]
+    """
+    if verbose: tTotal = time()
+
+    inputDirPath = Path(inputDirectory)
+    outputDirPath = Path(outputDirectory)
+
+    if not outputDirPath.exists():
+        outputDirPath.mkdir(parents=True)
+
+    # If user doesn't want to choose number of cores, use as many as available
+    if numProcesses == 0:
+        numProcesses = cpu_count()
+
+    if metadataFile != "null":
+        convertStateByLine(inputDirPath, Path(metadataFile), outputDirPath, numProcesses, binSize, verbose)
+        if verbose: print("Total Time:", time() - tTotal, flush=True)
+        return
+
+    inputFiles = sorted(file for file in listInputFiles(inputDirPath) if file.is_file())
+    if not inputFiles:
+        raise OSError(errno.ENOTEMPTY, "Ensure given directory is not empty:", str(inputDirPath))
+
+    # Each file is converted by a separate process
+    with closing(Pool(min(numProcesses, len(inputFiles)))) as pool:
+        results = pool.starmap(convertFile, zip(inputFiles, repeat(outputDirPath)))
+    pool.join()
+
+    for inputFile, (outputFile, numRows, numCols) in zip(inputFiles, results):
+        if verbose: print("{} -> {} ({} rows x {} epigenomes)".format(inputFile.name, outputFile.name, numRows, numCols),
+                          flush=True)
+        else: print("    {}\t[Done]".format(inputFile.name.split(".")[0]), flush=True)
+
+    if verbose: print("Total Time:", time() - tTotal, flush=True)
+
+
+def convertFile(inputFilePath, outputDirPath, chunkSize=100000):
+    """
+    Converts a single tab separated state matrix into a binary state matrix. The text is parsed in chunks so that the full
+    matrix never has to be held in memory as 64 bit integers, and the matrix is written through a temporary file (see
+    helpers.atomicWrite()) so that an interrupted run never leaves a partial matrix in the output directory
+
+    Input:
+    inputFilePath -- The path of the tab separated state matrix
+    outputDirPath -- The path of the directory to write the binary state matrix to
+    chunkSize -- The number of rows to parse at a time [default=100000]
+
+    Output:
+    outputFilePath -- The path of the binary state matrix
+    numRows -- The number of rows written
+    numCols -- The number of epigenomes written
+    """
+    outputFilePath = outputDirPath / (inputFilePath.name.split(".")[0] + binarySuffix)
+
+    numRows, numCols = 0, 0
+    with atomicWrite(outputFilePath) as tempFilePath, open(tempFilePath, "wb") as f:
+        for chunk in pd.read_table(inputFilePath, header=None, sep="\t", chunksize=chunkSize):
+            stateArr = chunk.iloc[:, 3:].to_numpy(dtype=np.int64) - 1
+
+            if numRows == 0:
+                # The text format carries no epigenome names, so they are named by their column order
+                numCols = stateArr.shape[1]
+                writeBinaryHeader(f, chunk.iloc[0, 0], chunk.iloc[0, 1], chunk.iloc[0, 2] - chunk.iloc[0, 1],
+                                  range(1, numCols + 1))
+
+            if stateArr.min() < 0 or stateArr.max() > np.iinfo(np.uint8).max:
+                raise ValueError("States in {} must be between 1 and {}".format(inputFilePath, np.iinfo(np.uint8).max + 1))
+
+            f.write(np.ascontiguousarray(stateArr, dtype=np.uint8).tobytes())
+            numRows += stateArr.shape[0]
+
+    return outputFilePath, numRows, numCols
+
+
+def convertStateByLine(inputDirPath, metadataPath, outputDirPath, numProcesses, binSize, verbose):
+    """
+    Assembles ChromHMM statebyline files (one per biosample and chromosome, as written with '-printstatebyline') into one
+    binary state matrix per chromosome. This replaces joining the files with bin/preprocess_data_ChromHMM.sh, so that no
+    intermediate text matrices are written. Files are decompressed and parsed in parallel and each parsed biosample is
+    written straight into its column of the output
+
+    Input:
+    inputDirPath -- The path of the directory containing the statebyline files
+    metadataPath -- The path of the biosample metadata file (header line, then biosample names in the first column)
+    outputDirPath -- The path of the directory to write the binary state matrices to
+    numProcesses -- The number of cores to run on
+    binSize -- The size of each bin in base pairs
+    verbose -- Boolean which if True, causes much more detailed prints
+    """
+    # Columns follow the order of the biosamples in the metadata file
+    biosamples = pd.read_table(metadataPath, header=0, sep="\t", usecols=[0], dtype=str).iloc[:, 0].tolist()
+    biosampleOrder = {biosample: i for i, biosample in enumerate(biosamples)}
+
+    inputFiles = sorted(file for file in inputDirPath.glob("*statebyline*") if file.is_file())
+
+    with closing(Pool(numProcesses)) as pool:
+        # The first line of each statebyline file names its biosample and chromosome
+        chrFiles = {}
+        for inputFile, (biosample, chrName) in zip(inputFiles, pool.map(readStateByLineHeader, inputFiles)):
+            if biosample in biosampleOrder:
+                chrFiles.setdefault(chrName, []).append((biosampleOrder[biosample], biosample, inputFile))
+
+        if not chrFiles:
+            raise ValueError("No statebyline files in {} match the biosamples in {}".format(inputDirPath, metadataPath))
+
+        for chrName in sorted(chrFiles):
+            if verbose: print("Assembling {}...".format(chrName), flush=True); tChr = time()
+            chrFiles[chrName].sort()
+            outputFilePath, numRows, numCols = assembleStateByLine(pool, chrName, [file[1] for file in chrFiles[chrName]],
+                                                                   [file[2] for file in chrFiles[chrName]],
+                                                                   outputDirPath, binSize)
+            if verbose: print("    {} ({} rows x {} biosamples)".format(outputFilePath.name, numRows, numCols), flush=True); \
+                print("    Time:", time() - tChr, flush=True)
+            else: print("    {}\t[Done]".format(chrName), flush=True)
+    pool.join()
+
+
+def readStateByLineHeader(inputFilePath):
+    """
+    Reads the biosample and chromosome names from the first line of a statebyline file
+
+    Input:
+    inputFilePath -- The path of the statebyline file
+
+    Output:
+    biosample -- The name of the biosample
+    chrName -- The name of the chromosome
+    """
+    with (gzip.open(inputFilePath, "rt") if inputFilePath.suffix == ".gz" else open(inputFilePath, "r")) as f:
+        biosample, chrName = f.readline().split()[:2]
+    return biosample, chrName
+
+
+def parseStateByLine(inputFilePath):
+    """
+    Parses the zero indexed states of a statebyline file (one state per line following two header lines)
+
+    Input:
+    inputFilePath -- The path of the statebyline file
+
+    Output:
+    1d numpy array of the states of each bin
+    """
+    stateArr = pd.read_table(inputFilePath, header=None, skiprows=2, dtype=np.uint16).iloc[:, 0].to_numpy()
+
+    # Zero states wrap around to the maximum value, so a single check catches states outside of [1, 256]
+    stateArr -= 1
+    if stateArr.size and stateArr.max() > np.iinfo(np.uint8).max:
+        raise ValueError("States in {} must be between 1 and {}".format(inputFilePath, np.iinfo(np.uint8).max + 1))
+
+    return stateArr.astype(np.uint8)
+
+
+def assembleStateByLine(pool, chrName, biosamples, inputFiles, outputDirPath, binSize):
+    """
+    Writes the binary state matrix of a single chromosome from its statebyline files. The matrix is written through a
+    temporary file (see helpers.atomicWrite()), so that an interrupted run never leaves a partial matrix in the output
+    directory
+
+    Input:
+    pool -- The multiprocessing pool used to parse the statebyline files
+    chrName -- The name of the chromosome
+    biosamples -- The names of the biosamples in column order
+    inputFiles -- The paths of the statebyline files in column order
+    outputDirPath -- The path of the directory to write the binary state matrix to
+    binSize -- The size of each bin in base pairs
+
+    Output:
+    outputFilePath -- The path of the binary state matrix
+    numRows -- The number of rows written
+    numCols -- The number of biosamples written
+    """
+    outputFilePath = outputDirPath / ("matrix_" + chrName + binarySuffix)
+    numCols = len(biosamples)
+
+    with atomicWrite(outputFilePath) as tempFilePath:
+        with open(tempFilePath, "wb") as f:
+            offset = writeBinaryHeader(f, chrName, 0, binSize, biosamples)
+
+        # Only the parsed column currently being written is held in memory by this process
+        stateMatrix = None
+        for col, stateArr in enumerate(pool.imap(parseStateByLine, inputFiles)):
+            if stateMatrix is None:
+                numRows = stateArr.shape[0]
+                with open(tempFilePath, "r+b") as f:
+                    f.truncate(offset + numRows * numCols)
+                stateMatrix = np.memmap(tempFilePath, dtype=np.uint8, mode="r+", offset=offset, shape=(numRows, numCols))
+            elif stateArr.shape[0] != numRows:
+                raise ValueError("{} has {} bins but {} has {}".format(inputFiles[col], stateArr.shape[0], inputFiles[0],
+                                                                       numRows))
+            stateMatrix[:, col] = stateArr
+
+        stateMatrix.flush()
+        del stateMatrix
+
+    return outputFilePath, numRows, numCols
+
+
+if __name__ == "__main__":
+    main(argv[1], argv[2], int(argv[3]), strToBool(argv[4]), argv[5], int(argv[6]))
@@ -2,15 +2,21 @@ import numpy as np
 from sys import argv
 from pathlib import Path
 from time import time
-from multiprocessing import cpu_count, Pool
-from itertools import repeat, permutations
-from contextlib import closing
-from epilogos.helpers import strToBool, splitRows, readStates
+from multiprocessing import cpu_count
+from epilogos.helpers import strToBool, readStateBlocks, getNumRows, getNumCols, countStates, printBlockProgress, \
+    getEpigenomePairs, getCountDtype, splitPairs, splitTasks, batchFiles, describeBatch, createSharedStates, \
+    attachSharedStates, parseTasks, parseDependencies, freeSharedStates, stagePool, runTasks
 
+# The maximum number of epigenome pairs counted by a process at once for saliency 3 (see s3Calc())
+pairTileSize = 4096
+# The maximum number of row/pair combinations tallied in a single bincount for saliency 3 (see s3Calc())
+pairChunkMaxSize = 2 ** 22
 
-def main(file1, file2, numStates, saliency, outputDir, fileTag, numProcesses, verbose):
+
+def main(file1, file2, numStates, saliency, outputDir, fileTag, numProcesses, verbose, numSampledPairs=0, pool=None,
+         keepCounts=False):
     """
-    Wrapper function which prepares inputs for the expected frequency calculation
+    Wrapper function which prepares inputs for the expected frequency calculation of a single file (or pair of files)
 
     Input:
     file1 -- The path of the only (single epilogos) or first (paired epilogos) file to read states from
@@ -21,70 +27,169 @@ def main(file1, file2, numStates, saliency, outputDir, fileTag, numProcesses, ve
     fileTag -- A string which helps ensure outputed files are named similarly within an epilogos run
     numProcesses -- The number of cores to run on
     verbose -- Boolean which if True, causes much more detailed prints
+    numSampledPairs -- The number of epigenome pairs sampled for approximate saliency 3 (0 means every pair is used)
+    pool -- The multiprocessing pool to run on (see helpers.createPool()), if None a pool is created for this file
+    keepCounts -- If True, the state counts of each row are kept for the score calculation (single epilogos saliency 1 and 2)
     """
-    if verbose: tTotal = time()
+    mainGenome([(file1, file2)], numStates, saliency, outputDir, fileTag, numProcesses, verbose, numSampledPairs, pool,
+               keepCounts)
 
-    file1Path = Path(file1)
-    file2Path = Path(file2)
-    outputDirPath = Path(outputDir)
 
-    filename = file1Path.name.split(".")[0]
+def mainGenome(filePairs, numStates, saliency, outputDir, fileTag, numProcesses, verbose, numSampledPairs=0, pool=None,
+               keepCounts=False, firstNewCols=None):
+    """
+    Wrapper function which prepares inputs for the expected frequency calculation of many files at once. The rows of all the
+    files are split into small tasks which share one work queue (see helpers.runTasks())
 
-    if not verbose: print("    {}\t".format(filename), end="", flush=True)
+    Input:
+    filePairs -- List of tuples of the paths of the only (single epilogos) or first (paired epilogos) file and of the second
+                 file (paired epilogos, "null" otherwise) to read states from
+    numStates -- The number of states in the state model
+    saliency -- The saliency metric being used in the epilogos run
+    outputDir -- The path of the output directory
+    fileTag -- A string which helps ensure outputed files are named similarly within an epilogos run
+    numProcesses -- The number of cores to run on
+    verbose -- Boolean which if True, causes much more detailed prints
+    numSampledPairs -- The number of epigenome pairs sampled for approximate saliency 3 (0 means every pair is used)
+    pool -- The multiprocessing pool to run on (see helpers.createPool()), if None a pool is created for each batch of files
+    keepCounts -- If True, the state counts of each row are kept for the score calculation (single epilogos saliency 1 and 2)
+    firstNewCols -- List of the first epigenome to count in each file, for counting only appended epigenomes (see
+                    calculateExpected()), if None every epigenome is counted
+    """
+    if verbose: tTotal = time()
+
+    filePairs = [(Path(file1), Path(file2)) for file1, file2 in filePairs]
+    outputDirPath = Path(outputDir)
+    if firstNewCols is None:
+        firstNewCols = [0] * len(filePairs)
 
     # If user doesn't want to choose number of cores, use as many as available
     if numProcesses == 0:
         numProcesses = cpu_count()
 
-    # Determine which rows to assign to each core
-    rowList = splitRows(file1Path, numProcesses)
+    # Files are worked on in batches whose text inputs fit in shared memory together
+    dataFilePathsList = [[file1Path] if str(file2Path) == "null" else [file1Path, file2Path]
+                         for file1Path, file2Path in filePairs]
+    for batch in batchFiles(dataFilePathsList, numStates):
+        batchFilePairs = [filePairs[i] for i in batch]
+        if not verbose: print("    {}\t".format(describeBatch(batchFilePairs)), end="", flush=True)
+
+        calculateExpected(saliency, batchFilePairs, numStates, outputDirPath, fileTag, numProcesses, verbose, numSampledPairs,
+                          pool, keepCounts, [firstNewCols[i] for i in batch])
 
-    calculateExpected(saliency, file1Path, file2Path, rowList, numStates, outputDirPath, fileTag, filename, numProcesses,
-                      verbose)
+        if not verbose: print("\t[Done]", flush=True)
 
-    print("Total Time:", time() - tTotal, flush=True) if verbose else print("\t[Done]", flush=True)
+    if verbose: print("Total Time:", time() - tTotal, flush=True)
+
+
+def _init(sharedStatesInfo_):
+    """
+    Initializes each process by attaching to the shared state matrices (see helpers.runTasks())
+
+    Input:
+    sharedStatesInfo_ -- List of tuples describing the shared state matrices (see helpers.createSharedStates())
+    """
+    attachSharedStates(sharedStatesInfo_)
 
 
-def calculateExpected(saliency, file1Path, file2Path, rowList, numStates, outputDirPath, fileTag, filename, numProcesses,
-                      verbose):
+def calculateExpected(saliency, filePairs, numStates, outputDirPath, fileTag, numProcesses, verbose, numSampledPairs=0,
+                      pool=None, keepCounts=False, firstNewCols=None):
     """
     Function responsible for deploying the processes used to calculate the expected frequencies
 
     Input:
     saliency -- The saliency metric being used in the epilogos run
-    file1Path -- The path of the only (single epilogos) or first (paired epilogos) file to read states from
-    file2Path -- The path of the second file to read states from (paired epilogos)
-    rowList -- A list of tuples which contain the first and last rows for each core to use
+    filePairs -- List of tuples of the paths of the only (single epilogos) or first (paired epilogos) file and of the second
+                 file (paired epilogos) to read states from
     numStates -- The number of states in the state model
     outputDirPath -- The path of the output directory
     fileTag -- A string which helps ensure outputed files are named similarly within an epilogos run
-    filename -- The name of the file for which we are calculating the expected frequencies
     numProcesses -- The number of cores to run on
     verbose -- Boolean which if True, causes much more detailed prints
+    numSampledPairs -- The number of epigenome pairs sampled for approximate saliency 3 (0 means every pair is used)
+    pool -- The multiprocessing pool to run on (see helpers.createPool()), if None a pool is created for these files
+    keepCounts -- If True, the state counts of each row are written to a memory mapped count matrix for each file, from which
+                  scores.calculateScores() scores the file without reading the states again (single epilogos saliency 1 and 2)
+    firstNewCols -- List of the first epigenome to count in each file (single epilogos). If greater than 0, only the
+                    expected frequencies added by the epigenomes from this one on are counted, so that epigenomes appended to
+                    a file can be added to its stored expected frequencies (see expectedUpdate.py). For saliency 2 the state
+                    counts of the earlier epigenomes must already be kept in the count matrix [default=None, all epigenomes]
     """
     if verbose: print("\nNumber of Processes:", numProcesses, flush=True)
 
-    # Start the processes
-    with closing(Pool(numProcesses)) as pool:
-        if saliency == 1:
-            results = pool.starmap(s1Calc, zip(repeat(file1Path), repeat(file2Path), rowList, repeat(numStates),
-                                               repeat(verbose)))
-        elif saliency == 2:
-            results = pool.starmap(s2Calc, zip(repeat(file1Path), repeat(file2Path), rowList, repeat(numStates),
-                                               repeat(verbose)))
-        elif saliency == 3:
-            results = pool.starmap(s3Calc, zip(repeat(file1Path), rowList, repeat(numStates), repeat(verbose)))
-        else:
-            raise ValueError("Please ensure that saliency metric is either 1, 2, or 3")
-    pool.join()
-
-    # Sum all the expected frequency arrays from the seperate processes and normalize by dividing by numRows
-    expFreqArr = np.sum(results, axis=0)
+    if firstNewCols is None:
+        firstNewCols = [0] * len(filePairs)
 
-    storeExpArray(expFreqArr, outputDirPath, fileTag, filename)
+    totalRowsList = [getNumRows(file1Path) for file1Path, _ in filePairs]
+    filenames = [file1Path.name.split(".")[0] for file1Path, _ in filePairs]
 
+    # Shared memory for the parsed states, so that each file is parsed once and viewed by all processes
+    sharedBlocks, sharedStatesInfo = [], []
+    dataFilePathsList = [[file1Path] if str(file2Path) == "null" else [file1Path, file2Path]
+                         for file1Path, file2Path in filePairs]
+    for dataFilePaths, totalRows in zip(dataFilePathsList, totalRowsList):
+        fileSharedBlocks, fileSharedStatesInfo = createSharedStates(dataFilePaths, totalRows, numStates)
+        sharedBlocks += fileSharedBlocks
+        sharedStatesInfo += fileSharedStatesInfo
 
-def s1Calc(file1Path, file2Path, rowsToCalc, numStates, verbose):
+    # Start the processes
+    try:
+        with stagePool(pool, numProcesses) as pool:
+            # The text inputs are parsed by the first tasks, and each task waits only on the parsing of the rows it reads
+            tasks, parseTaskRows = parseTasks(sharedStatesInfo, numStates, numProcesses)
+            dependencies = {}
+
+            if saliency == 1 or saliency == 2:
+                calcFunc = s1Calc if saliency == 1 else s2Calc
+
+                # The count matrices are filled in by the tasks, each writing to a separate set of rows (when only appended
+                # epigenomes are counted, the count matrix of the earlier epigenomes is added to instead)
+                countsPaths = [None] * len(filePairs)
+                if keepCounts:
+                    for fileIndex, ((file1Path, _), totalRows, filename) in enumerate(zip(filePairs, totalRowsList,
+                                                                                          filenames)):
+                        countsPaths[fileIndex] = outputDirPath / "temp_counts_{}_{}.npy".format(fileTag, filename)
+                        if firstNewCols[fileIndex] == 0:
+                            np.lib.format.open_memmap(countsPaths[fileIndex], mode="w+", shape=(totalRows, numStates),
+                                                      dtype=getCountDtype(getNumCols(file1Path)))
+
+                taskList = splitTasks(totalRowsList, numProcesses)
+                calcStart = len(tasks)
+                for fileIndex, rowsToCalc in taskList:
+                    dependencies[len(tasks)] = parseDependencies(parseTaskRows, dataFilePathsList[fileIndex], rowsToCalc)
+                    tasks.append((None, _init, (sharedStatesInfo,), calcFunc, (*filePairs[fileIndex], rowsToCalc, numStates,
+                                                                               verbose, countsPaths[fileIndex],
+                                                                               firstNewCols[fileIndex])))
+                results = runTasks(pool, tasks, numProcesses, verbose, dependencies)[calcStart:]
+            elif saliency == 3:
+                # Saliency 3 is split over tiles of epigenome pairs rather than rows, with each process counting its tiles
+                # over every row directly into the memory mapped expected frequency array
+                for (file1Path, _), totalRows, filename, firstNewCol in zip(filePairs, totalRowsList, filenames, firstNewCols):
+                    expFreqPath = outputDirPath / "temp_exp_freq_{}_{}.npy".format(fileTag, filename)
+                    numPairs = len(getEpigenomePairs(getNumCols(file1Path), numSampledPairs, firstNewCol)[0])
+                    np.lib.format.open_memmap(expFreqPath, mode="w+", dtype=np.int32,
+                                              shape=(numPairs, numStates, numStates))
+                    for pairTile in splitPairs(numPairs, numProcesses, pairTileSize):
+                        dependencies[len(tasks)] = parseDependencies(parseTaskRows, [file1Path], (0, totalRows))
+                        tasks.append((None, _init, (sharedStatesInfo,), s3Calc, (file1Path, totalRows, pairTile, numStates,
+                                                                                 expFreqPath, verbose, numSampledPairs,
+                                                                                 firstNewCol)))
+                runTasks(pool, tasks, numProcesses, verbose, dependencies)
+            else:
+                raise ValueError("Please ensure that saliency metric is either 1, 2, or 3")
+    finally:
+        freeSharedStates(sharedBlocks)
+
+    # Sum the expected frequency arrays from the tasks of each file
+    if saliency != 3:
+        for fileIndex, filename in enumerate(filenames):
+            expFreqArr = np.sum([result for (taskFileIndex, _), result in zip(taskList, results)
+                                 if taskFileIndex == fileIndex], axis=0)
+
+            storeExpArray(expFreqArr, outputDirPath, fileTag, filename)
+
+
+def s1Calc(file1Path, file2Path, rowsToCalc, numStates, verbose, countsPath=None, firstNewCol=0):
     """
     Function responsible for expected frequency calculation over a set of rows for a saliency metric of 1
 
@@ -94,26 +199,35 @@ def s1Calc(file1Path, file2Path, rowsToCalc, numStates, verbose):
     rowsToCalc -- The rows to count expected frequencies from the files
     numStates -- The number of states in the state model
     verbose -- Boolean which if True, causes much more detailed prints
+    countsPath -- The path of the memory mapped count matrix to keep the state counts of each row in (None if not kept)
+    firstNewCol -- The first epigenome to count, earlier epigenomes having been counted already (see calculateExpected())
 
     Output:
     A numpy array containing the counts of each state within the specified rows of the file
     """
-    dataArr = readStates(file1Path=file1Path, file2Path=file2Path, rowsToCalc=rowsToCalc, verbose=verbose)
-
     expFreqArr = np.zeros(numStates, dtype=np.int32)
+    countsArr = np.load(countsPath, mmap_mode="r+", allow_pickle=False) if countsPath is not None else None
 
     if verbose and rowsToCalc[0] == 0: print("Calculating expected frequencies...", flush=True); tExp = time()
 
-    # Simply count all states across out our subset of data
-    uniqueStates, stateCounts = np.unique(dataArr, return_counts=True)
-    for i, state in enumerate(uniqueStates):
-        expFreqArr[state] += stateCounts[i]
+    # Simply count all states across out our subset of data, one block of rows at a time
+    for blockRows, dataArr in readStateBlocks(file1Path=file1Path, file2Path=file2Path, rowsToCalc=rowsToCalc,
+                                              verbose=verbose, numStates=numStates):
+        countArr = countStates(dataArr[:, firstNewCol:], numStates)
+        expFreqArr += countArr.sum(axis=0)
+        if countsArr is not None:
+            if firstNewCol > 0:
+                countArr += countsArr[blockRows[0]:blockRows[1]]
+            countsArr[blockRows[0]:blockRows[1]] = countArr
+
+    if countsArr is not None:
+        countsArr.flush()
     if verbose and rowsToCalc[0] == 0: print("    Time:", time() - tExp, flush=True)
 
     return expFreqArr
 
 
-def s2Calc(file1Path, file2Path, rowsToCalc, numStates, verbose):
+def s2Calc(file1Path, file2Path, rowsToCalc, numStates, verbose, countsPath=None, firstNewCol=0):
     """
     Function responsible for expected frequency calculation over a set of rows for a saliency metric of 2
 
@@ -123,80 +237,94 @@ def s2Calc(file1Path, file2Path, rowsToCalc, numStates, verbose):
     rowsToCalc -- The rows to count expected frequencies from the files
     numStates -- The number of states in the state model
     verbose -- Boolean which if True, causes much more detailed prints
+    countsPath -- The path of the memory mapped count matrix to keep the state counts of each row in (None if not kept)
+    firstNewCol -- The first epigenome to count, earlier epigenomes having been counted already, with their state counts kept
+                   in the count matrix (see calculateExpected())
 
     Output:
     A numpy array containing the counts of each pair of states within the specified rows of the file
     """
-    dataArr = readStates(file1Path=file1Path, file2Path=file2Path, rowsToCalc=rowsToCalc, verbose=verbose)
-
-    multiprocessRows = dataArr.shape[0]
-
-    expFreqArr = np.zeros((numStates, numStates), dtype=np.int32)
+    expFreqArr = np.zeros((numStates, numStates), dtype=np.int64)
+    countsArr = np.load(countsPath, mmap_mode="r+", allow_pickle=False) if countsPath is not None else None
 
-    if verbose and rowsToCalc[0] == 0: print("Calculating expected frequencies...", flush=True); tExp = time(); percentDone = 0
-    printCheckmarks = [int(multiprocessRows * float(i / 10)) for i in range(1, 10)]
+    if verbose and rowsToCalc[0] == 0: print("Calculating expected frequencies...", flush=True); tExp = time()
+    printCheckmarks = [int((rowsToCalc[1] - rowsToCalc[0]) * float(i / 10)) for i in range(1, 10)]
+    percentDone = 0
 
     # SumOverRows: Within a row, how many ways can you choose x and y to be together (will normalize later)
     # Can choose x and y to be together n*m ways if n != m and n(n-1) ways if n == m
     # (where n and m are the number of times that x and y show up respectively)
-    for row in range(multiprocessRows):
-
-        if verbose and rowsToCalc[0] == 0 and row in printCheckmarks: percentDone += 10; \
-            print("    {}% Completed".format(percentDone), flush=True)
-        if not verbose and rowsToCalc[0] == 0 and row in printCheckmarks: print(".", end="", flush=True)
-
-        uniqueStates, stateCounts = np.unique(dataArr[row], return_counts=True)
-        for i, state1 in enumerate(uniqueStates):
-            for j, state2 in enumerate(uniqueStates):
-                if state1 == state2:
-                    expFreqArr[state1, state2] += stateCounts[i] * (stateCounts[i] - 1)
-                else:  # state1 > state2 or state1 < state2
-                    expFreqArr[state1, state2] += stateCounts[i] * stateCounts[j]
-
+    # For a row with state counts c this is c cT - diag(c), so summed over a block of rows it is CT C - diag(sum of C)
+    for blockRows, dataArr in readStateBlocks(file1Path=file1Path, file2Path=file2Path, rowsToCalc=rowsToCalc,
+                                              verbose=verbose, numStates=numStates):
+        if rowsToCalc[0] == 0: percentDone = printBlockProgress(blockRows, printCheckmarks, percentDone, verbose)
+
+        countArr = countStates(dataArr[:, firstNewCol:], numStates)
+        expFreqArr += countArr.T @ countArr - np.diag(countArr.sum(axis=0))
+        # Appending epigenomes with state counts b to a row with state counts a also pairs each of them with the earlier ones,
+        # adding a bT + b aT
+        if firstNewCol > 0:
+            prevCountArr = countsArr[blockRows[0]:blockRows[1]].astype(np.int64)
+            expFreqArr += prevCountArr.T @ countArr + countArr.T @ prevCountArr
+            countArr += prevCountArr
+        if countsArr is not None:
+            countsArr[blockRows[0]:blockRows[1]] = countArr
+
+    if countsArr is not None:
+        countsArr.flush()
     if verbose and rowsToCalc[0] == 0: print("    Time:", time() - tExp, flush=True)
 
     return expFreqArr
 
 
-def s3Calc(file1Path, rowsToCalc, numStates, verbose):
+def s3Calc(file1Path, totalRows, pairTile, numStates, expFreqPath, verbose, numSampledPairs=0, firstNewCol=0):
     """
-    Function responsible for expected frequency calculation over a set of rows for a saliency metric of 2
+    Function responsible for expected frequency calculation over a tile of epigenome pairs for a saliency metric of 3. The
+    expected frequencies are stored once per unordered pair of epigenomes (see getEpigenomePairs()), so there are
+    numCols * (numCols - 1) / 2 * numStates * numStates of them rather than numCols * numCols * numStates * numStates. For
+    approximate saliency 3 only the sampled pairs are counted
 
     Input:
     file1Path -- The path of the only file to read states from
-    rowsToCalc -- The first and last rows to count expected frequencies from the file
+    totalRows -- The number of rows in the file
+    pairTile -- The first and last epigenome pairs to count expected frequencies for
     numStates -- The number of states in the state model
+    expFreqPath -- The path of the memory mapped expected frequency array to write the counts of the tile to
     verbose -- Boolean which if True, causes much more detailed prints
-
-    Output:
-    A numpy array containing the counts of each grouping of states and epigenomes within the specified rows of the file
+    numSampledPairs -- The number of epigenome pairs sampled for approximate saliency 3 (0 means every pair is used)
+    firstNewCol -- If greater than 0, only the pairs which include an epigenome from this one on are counted (see
+                   helpers.getEpigenomePairs())
     """
-    dataArr = readStates(file1Path=file1Path, rowsToCalc=rowsToCalc, verbose=verbose)
+    firstCols, secondCols = getEpigenomePairs(getNumCols(file1Path), numSampledPairs, firstNewCol)
+    firstCols, secondCols = firstCols[pairTile[0]:pairTile[1]], secondCols[pairTile[0]:pairTile[1]]
+    numTilePairs = pairTile[1] - pairTile[0]
 
-    multiprocessRows, numCols = dataArr.shape
+    # Each pair/state/state combination is given a unique index so that a single bincount can tally all of them
+    pairOffsets = np.arange(numTilePairs) * numStates * numStates
+    expFreqArr = np.zeros(numTilePairs * numStates * numStates, dtype=np.int64)
 
-    # Gives us everyway to combine the column numbers in numpy indexing form
-    basePermutationArr = np.array(list(permutations(range(numCols), 2))).T
-
-    expFreqArr = np.zeros((numCols, numCols, numStates, numStates), dtype=np.int32)
-
-    if verbose and rowsToCalc[0] == 0: print("Calculating expected frequencies...", flush=True); tExp = time(); percentDone = 0
-    printCheckmarks = [int(multiprocessRows * float(i / 10)) for i in range(1, 10)]
+    if verbose and pairTile[0] == 0: print("Calculating expected frequencies...", flush=True); tExp = time()
+    printCheckmarks = [int(totalRows * float(i / 10)) for i in range(1, 10)]
+    percentDone = 0
 
     # We tally a one for all the state/column combinations we observe
-    # (e.g. for state 18 in column 2 and state 15 in column 6 we would add one to index [5, 1, 17, 14])
-    for row in range(multiprocessRows):
+    # (e.g. for state 18 in column 2 and state 15 in column 6 we would add one to index [pair(2, 6), 17, 14])
+    chunkSize = max(pairChunkMaxSize // numTilePairs, 1)
+    for blockRows, dataArr in readStateBlocks(file1Path=file1Path, rowsToCalc=(0, totalRows), verbose=False,
+                                              numStates=numStates):
+        if pairTile[0] == 0: percentDone = printBlockProgress(blockRows, printCheckmarks, percentDone, verbose)
 
-        if verbose and rowsToCalc[0] == 0 and row in printCheckmarks: percentDone += 10; \
-            print("    {}% Completed".format(percentDone), flush=True)
-        if not verbose and rowsToCalc[0] == 0 and row in printCheckmarks: print(".", end="", flush=True)
+        for chunkStart in range(0, dataArr.shape[0], chunkSize):
+            chunkArr = dataArr[chunkStart:chunkStart+chunkSize]
+            expFreqArr += np.bincount((pairOffsets + chunkArr[:, firstCols].astype(np.intp) * numStates
+                                       + chunkArr[:, secondCols]).ravel(), minlength=expFreqArr.shape[0])
 
-        expFreqArr[basePermutationArr[0], basePermutationArr[1], dataArr[row, basePermutationArr[0]],
-                   dataArr[row, basePermutationArr[1]]] += 1
+    # Each tile writes to a separate part of the array, so there are no race conditions
+    tileArr = np.load(expFreqPath, mmap_mode="r+", allow_pickle=False)
+    tileArr[pairTile[0]:pairTile[1]] = expFreqArr.reshape(numTilePairs, numStates, numStates)
+    tileArr.flush()
 
-    if verbose and rowsToCalc[0] == 0: print("    Time:", time() - tExp, flush=True)
-
-    return expFreqArr
+    if verbose and pairTile[0] == 0: print("    Time:", time() - tExp, flush=True)
 
 
 def storeExpArray(expFreqArr, outputDirPath, fileTag, filename):
@@ -216,4 +344,5 @@ def storeExpArray(expFreqArr, outputDirPath, fileTag, filename):
 
 
 if __name__ == "__main__":
-    main(argv[1], argv[2], int(argv[3]), int(argv[4]), argv[5], argv[6], int(argv[7]), strToBool(argv[8]))
\ No newline at end of file
+    main(argv[1], argv[2], int(argv[3]), int(argv[4]), argv[5], argv[6], int(argv[7]), strToBool(argv[8]), int(argv[9]),
+         keepCounts=strToBool(argv[10]) if len(argv) > 10 else False)
\ No newline at end of file
@@ -0,0 +1,148 @@
+import hashlib
+import json
+from os import environ, utime
+from pathlib import Path
+from time import time
+from epilogos.helpers import blocks, atomicWrite
+
+# Bump whenever a change to the expected frequency calculation means that previously cached counts should not be reused
+cacheVersion = 1
+
+# Cached counts which have not been used for cacheMaxAge days are evicted, after which the least recently used counts are
+# evicted until the cache is at most cacheMaxSize GB (overridden by the EPILOGOS_CACHE_MAX_DAYS and EPILOGOS_CACHE_MAX_GB
+# environment variables)
+cacheMaxAge = 30
+cacheMaxSize = 64
+
+
+def getCacheDir():
+    """
+    Finds the directory of the expected frequency cache. This is EPILOGOS_CACHE_DIR if it is set, and otherwise epilogos/
+    within XDG_CACHE_HOME (~/.cache by default)
+
+    Output:
+    The path of the cache directory
+    """
+    if "EPILOGOS_CACHE_DIR" in environ:
+        return Path(environ["EPILOGOS_CACHE_DIR"])
+    return Path(environ.get("XDG_CACHE_HOME", Path.home() / ".cache")) / "epilogos"
+
+
+def getFileDigest(dataFilePath, cacheDirPath):
+    """
+    Hashes the contents of a data file. Digests are kept in the cache directory along with the size and modification time of
+    the file they were calculated from, so that each version of a file is only read once
+
+    Input:
+    dataFilePath -- The path of the data file
+    cacheDirPath -- The path of the cache directory
+
+    Output:
+    The hex digest of the contents of the file
+    """
+    fileStat = dataFilePath.stat()
+    digestPath = cacheDirPath / "digests" / "{}.json".format(hashlib.sha256(str(dataFilePath.resolve()).encode()).hexdigest())
+
+    # The stored digest is only valid for the exact version of the file it was calculated from
+    try:
+        with open(digestPath) as f:
+            digestInfo = json.load(f)
+        if digestInfo["fileSize"] == fileStat.st_size and digestInfo["fileMtime"] == fileStat.st_mtime_ns:
+            return digestInfo["digest"]
+    except (OSError, ValueError, KeyError):
+        pass
+
+    fileHash = hashlib.sha256()
+    with open(dataFilePath, "rb") as f:
+        for bl in blocks(f, 2 ** 20):
+            fileHash.update(bl)
+    digest = fileHash.hexdigest()
+
+    # Storing the digest only saves rehashing the file, so failing to write it is not an error
+    try:
+        digestPath.parent.mkdir(parents=True, exist_ok=True)
+        with atomicWrite(digestPath) as tempDigestPath, open(tempDigestPath, "w") as f:
+            json.dump({"path": str(dataFilePath.resolve()), "fileSize": fileStat.st_size, "fileMtime": fileStat.st_mtime_ns,
+                       "digest": digest}, f)
+    except OSError:
+        pass
+
+    return digest
+
+
+def getCachePath(filePairs, mode, saliency, numStates, numSampledPairs, cacheDirPath):
+    """
+    Finds where the expected frequency counts of a set of input files are cached. The counts are addressed by the contents of
+    the input files (rather than their names or locations) along with everything else which changes the counts
+
+    Input:
+    filePairs -- List of tuples of the paths of the only (single epilogos) or first (paired epilogos) file and of the second
+                 file (paired epilogos, "null" otherwise)
+    mode -- 'single' or 'paired'
+    saliency -- The saliency metric being used in the epilogos run
+    numStates -- The number of states in the state model
+    numSampledPairs -- The number of epigenome pairs sampled for approximate saliency 3 (0 means every pair is used)
+    cacheDirPath -- The path of the cache directory
+
+    Output:
+    The path of the cached counts (which may not exist yet)
+    """
+    fileDigests = sorted([getFileDigest(Path(file1), cacheDirPath),
+                          "null" if str(file2) == "null" else getFileDigest(Path(file2), cacheDirPath)]
+                         for file1, file2 in filePairs)
+    cacheKey = {"version": cacheVersion, "mode": mode, "saliency": saliency, "numStates": numStates,
+                "numSampledPairs": numSampledPairs, "files": fileDigests}
+
+    return cacheDirPath / "expected" / "{}.npy".format(hashlib.sha256(json.dumps(cacheKey, sort_keys=True).encode())
+                                                       .hexdigest())
+
+
+def touchCache(cachePath):
+    """
+    Marks cached counts as used, so that they are the last to be evicted
+
+    Input:
+    cachePath -- The path of the cached counts
+    """
+    try:
+        utime(cachePath)
+    except OSError:
+        pass
+
+
+def evictCache(cacheDirPath, maxAge=None, maxSize=None):
+    """
+    Evicts cached counts (and stored digests) which have not been used for maxAge days, then evicts the least recently used
+    counts until the cache is at most maxSize GB
+
+    Input:
+    cacheDirPath -- The path of the cache directory
+    maxAge -- The maximum number of days since cached counts were last used [default=EPILOGOS_CACHE_MAX_DAYS or cacheMaxAge]
+    maxSize -- The maximum size of the cache in GB [default=EPILOGOS_CACHE_MAX_GB or cacheMaxSize]
+    """
+    maxAge = float(environ.get("EPILOGOS_CACHE_MAX_DAYS", cacheMaxAge)) if maxAge is None else maxAge
+    maxSize = float(environ.get("EPILOGOS_CACHE_MAX_GB", cacheMaxSize)) if maxSize is None else maxSize
+    oldestUse = time() - maxAge * 24 * 60 * 60
+
+    cachedFiles = []
+    for cachedFile in list((cacheDirPath / "expected").glob("*")) + list((cacheDirPath / "digests").glob("*")):
+        try:
+            fileStat = cachedFile.stat()
+            if fileStat.st_mtime < oldestUse:
+                cachedFile.unlink()
+            elif cachedFile.suffix == ".npy":
+                cachedFiles.append((fileStat.st_mtime, fileStat.st_size, cachedFile))
+        except OSError:
+            pass
+
+    # Least recently used first
+    cachedFiles.sort()
+    cacheSize = sum(fileSize for _, fileSize, _ in cachedFiles)
+    for _, fileSize, cachedFile in cachedFiles:
+        if cacheSize <= maxSize * 2 ** 30:
+            break
+        try:
+            cachedFile.unlink()
+            cacheSize -= fileSize
+        except OSError:
+            pass
@@ -3,10 +3,13 @@ import numpy as np
 from os import remove
 from pathlib import Path
 from time import time
-from epilogos.helpers import strToBool
+from epilogos.helpers import strToBool, atomicWrite
 
+# The maximum number of expected frequencies summed at once when combining the temporary arrays
+combinationChunkSize = 2 ** 24
 
-def main(outputDirectory, storedExpInput, fileTag, verbose):
+
+def main(outputDirectory, storedExpInput, fileTag, verbose, cacheFile="null"):
     """
     Combines all the temporary expected frequency numpy arrays into one expected frequency array
 
@@ -15,33 +18,96 @@ def main(outputDirectory, storedExpInput, fileTag, verbose):
     storedExpInput -- The path of the expected frequency array which is being created
     fileTag -- A string which helps ensure outputed files are named similarly within an epilogos run
     verbose -- Boolean which if True, causes much more detailed prints
+    cacheFile -- The path to cache the combined (unnormalized) counts at for later runs on the same input files (see
+                 expectedCache.getCachePath()), "null" if they are not cached
     """
     if verbose: tTotal = time()
 
     outputDirPath = Path(outputDirectory)
     storedExpPath = Path(storedExpInput)
 
-    # Loop over all the expected value arrays and add them up
-    expFreqFileCount = 0
-    expFreqArr = np.zeros((1, 1))
-    for file in outputDirPath.glob("temp_exp_freq_{}_*.npy".format(fileTag)):
-        if expFreqFileCount == 0:
-            expFreqArr = np.load(file, allow_pickle=False)
-        else:
-            expFreqArr += np.load(file, allow_pickle=False)
-        expFreqFileCount += 1
+    # The saliency 3 arrays can be too large to hold several of in memory, so every file is memory mapped
+    expFreqArrs = [np.load(file, mmap_mode="r", allow_pickle=False)
+                   for file in outputDirPath.glob("temp_exp_freq_{}_*.npy".format(fileTag))]
+
+    combineCounts(expFreqArrs, storedExpPath, Path(cacheFile))
+    del expFreqArrs
 
     # Clean up temp files
     for file in outputDirPath.glob("temp_exp_freq_*.npy"):
         remove(file)
 
-    # normalize expected frequency array
-    expFreqArr = (expFreqArr / np.sum(expFreqArr)).astype(np.float32)
+    print("Total Time:", time() - tTotal) if verbose else print("    [Done]")
 
-    np.save(storedExpPath, expFreqArr, allow_pickle=False)
+
+def mainCached(cacheFile, storedExpInput, verbose):
+    """
+    Creates the expected frequency array from counts cached by an earlier run on the same input files
+
+    Input:
+    cacheFile -- The path of the cached counts (see expectedCache.getCachePath())
+    storedExpInput -- The path of the expected frequency array which is being created
+    verbose -- Boolean which if True, causes much more detailed prints
+    """
+    if verbose: tTotal = time()
+
+    combineCounts([np.load(cacheFile, mmap_mode="r", allow_pickle=False)], Path(storedExpInput))
 
     print("Total Time:", time() - tTotal) if verbose else print("    [Done]")
 
 
+def combineCounts(expFreqArrs, storedExpPath, cachePath=Path("null")):
+    """
+    Adds up expected frequency counts and normalizes them into the stored expected frequency array, optionally caching the
+    added up counts along the way
+
+    Input:
+    expFreqArrs -- List of the numpy arrays of counts to add up (e.g. memory mapped temporary arrays)
+    storedExpPath -- The path of the expected frequency array which is being created
+    cachePath -- The path to cache the added up counts at, "null" if they are not cached [default=Path("null")]
+    """
+    # The normalizing total is the sum over all the expected value arrays
+    expFreqTotal = sum(expFreqArr.sum(dtype=np.int64) for expFreqArr in expFreqArrs)
+
+    # The counts are cached through a temporary file (see helpers.atomicWrite()), so an interrupted run never leaves partial
+    # counts in the cache. Caching is best effort, so if the counts cannot be cached they are only normalized
+    if str(cachePath) != "null":
+        try:
+            cachePath.parent.mkdir(parents=True, exist_ok=True)
+            with atomicWrite(cachePath) as tempCachePath:
+                cacheArr = np.lib.format.open_memmap(tempCachePath, mode="w+", dtype=np.int64, shape=expFreqArrs[0].shape)
+                normalizeCounts(expFreqArrs, expFreqTotal, storedExpPath, cacheArr)
+                cacheArr.flush()
+                del cacheArr
+            return
+        except OSError as err:
+            print("WARNING: Could not cache the background frequencies:", err, flush=True)
+
+    normalizeCounts(expFreqArrs, expFreqTotal, storedExpPath)
+
+
+def normalizeCounts(expFreqArrs, expFreqTotal, storedExpPath, cacheArr=None):
+    """
+    Adds up expected frequency counts a chunk at a time, writing them normalized straight into the stored expected frequency
+    array and optionally unnormalized into a cache array
+
+    Input:
+    expFreqArrs -- List of the numpy arrays of counts to add up (e.g. memory mapped temporary arrays)
+    expFreqTotal -- The total of all the counts, which the counts are normalized by
+    storedExpPath -- The path of the expected frequency array which is being created
+    cacheArr -- The memory mapped array to write the added up counts to, None if they are not cached [default=None]
+    """
+    storedExpArr = np.lib.format.open_memmap(storedExpPath, mode="w+", dtype=np.float32, shape=expFreqArrs[0].shape)
+    chunkSize = max(combinationChunkSize // storedExpArr[0].size, 1)
+    for chunkStart in range(0, storedExpArr.shape[0], chunkSize):
+        chunk = slice(chunkStart, chunkStart + chunkSize)
+        expFreqChunk = np.sum([expFreqArr[chunk] for expFreqArr in expFreqArrs], axis=0, dtype=np.int64)
+        storedExpArr[chunk] = (expFreqChunk / expFreqTotal).astype(np.float32)
+        if cacheArr is not None:
+            cacheArr[chunk] = expFreqChunk
+    storedExpArr.flush()
+    del storedExpArr
+
+
 if __name__ == "__main__":
-    main(argv[1], argv[2], argv[3], strToBool(argv[4]))
\ No newline at end of file
+    main(argv[1], argv[2], argv[3], strToBool(argv[4]), argv[5] if len(argv) > 5 else "null")
@@ -0,0 +1,211 @@
+import hashlib
+import json
+import numpy as np
+from sys import argv
+from os import remove, replace
+from pathlib import Path
+from time import time
+from multiprocessing import cpu_count
+from epilogos.helpers import strToBool, getNumStates, getNumRows, getNumCols, getCountDtype, getEpigenomePairs, \
+    listInputFiles, readStateBlocks, atomicWrite
+from epilogos.expected import mainGenome as expected
+from epilogos.expectedCombination import combineCounts
+
+# Bump whenever the layout of the stored counts changes, so that older stores are recalculated rather than updated
+storeVersion = 1
+
+
+def main(inputDirectory, stateInfo, saliency, outputDirectory, numProcesses, update, verbose):
+    """
+    Calculates the expected frequencies of a directory of state matrices while keeping the raw counts of each file, so that
+    when files are added or epigenomes are appended to the files, the expected frequencies can be updated by counting only
+    what was added
+
+    The counts are stored in expectedCounts_{fileTag}/ within the output directory along with a manifest of the files (and
+    number of epigenomes) they cover, and the expected frequency array is written to exp_freq_{fileTag}.npy
+
+    Input:
+    inputDirectory -- The path of the directory containing the state matrices
+    stateInfo -- State model info file
+    saliency -- The saliency metric to calculate the expected frequencies for
+    outputDirectory -- The path of the directory to store the counts and the expected frequency array in
+    numProcesses -- The number of cores to run on
+    update -- If True, the stored counts are updated rather than calculated from scratch
+    verbose -- Boolean which if True, causes much more detailed prints
+    """
+    if verbose: tTotal = time()
+
+    inputDirPath = Path(inputDirectory)
+    outputDirPath = Path(outputDirectory)
+    numStates = getNumStates(stateInfo)
+
+    # If user doesn't want to choose number of cores, use as many as available
+    if numProcesses == 0:
+        numProcesses = cpu_count()
+
+    fileTag = "{}_s{}".format(inputDirPath.name, saliency)
+    countsDirPath = outputDirPath / "expectedCounts_{}".format(fileTag)
+    manifestPath = countsDirPath / "manifest.json"
+
+    storedFiles = {}
+    if update:
+        if not manifestPath.exists():
+            raise FileNotFoundError("No stored counts found at {}. Please run without --update first".format(countsDirPath))
+        with open(manifestPath) as f:
+            manifest = json.load(f)
+        if (manifest["version"], manifest["saliency"], manifest["numStates"]) != (storeVersion, saliency, numStates):
+            raise ValueError("The counts stored at {} were calculated with a different saliency or state model. Please run "
+                             "without --update to recalculate them".format(countsDirPath))
+        storedFiles = manifest["files"]
+    countsDirPath.mkdir(parents=True, exist_ok=True)
+
+    # Files which are unchanged keep their counts, files which only had epigenomes appended have just those counted, and
+    # anything else (new files, or files changed in any other way) is counted from scratch
+    # Epigenomes only count as appended if the states of the earlier epigenomes are unchanged, which is checked against a
+    # digest of them stored in the manifest
+    inputFiles = {file.name.split(".")[0]: file for file in listInputFiles(inputDirPath)}
+    filesToCount, firstNewCols, fileInfo = [], [], {}
+    for filename, file in sorted(inputFiles.items()):
+        fileStat = file.stat()
+        storedInfo = storedFiles.get(filename)
+        if storedInfo is not None and not all(path.exists() for path in getCountsPaths(countsDirPath, filename, saliency)):
+            storedInfo = None
+        if storedInfo is not None and (storedInfo["fileSize"], storedInfo["fileMtime"]) == (fileStat.st_size,
+                                                                                           fileStat.st_mtime_ns):
+            fileInfo[filename] = storedInfo
+            if verbose: print("{}: unchanged".format(filename), flush=True)
+            continue
+
+        numRows, numCols = getNumRows(file), getNumCols(file)
+        appended = storedInfo is not None and "statesDigest" in storedInfo and storedInfo["numRows"] == numRows and \
+            storedInfo["numCols"] < numCols
+        if appended:
+            storedDigest, statesDigest = getStatesDigests(file, numRows, numStates, (storedInfo["numCols"], numCols))
+            appended = storedDigest == storedInfo["statesDigest"]
+        else:
+            statesDigest, = getStatesDigests(file, numRows, numStates, (numCols,))
+        firstNewCols.append(storedInfo["numCols"] if appended else 0)
+        filesToCount.append(file)
+        fileInfo[filename] = {"path": str(file.resolve()), "fileSize": fileStat.st_size, "fileMtime": fileStat.st_mtime_ns,
+                              "numRows": numRows, "numCols": numCols, "statesDigest": statesDigest}
+        if verbose: print("{}: counting epigenomes {} to {}".format(filename, firstNewCols[-1] + 1, numCols), flush=True)
+
+    if not fileInfo:
+        raise FileNotFoundError("No state matrices found in {}".format(inputDirPath))
+
+    if filesToCount:
+        # The row state counts of files with appended epigenomes are copied to where the calculation adds to them, widening
+        # them if the appended epigenomes no longer fit in their dtype
+        for file, firstNewCol in zip(filesToCount, firstNewCols):
+            filename = file.name.split(".")[0]
+            if saliency == 2 and firstNewCol > 0:
+                np.save(countsDirPath / "temp_counts_{}_{}.npy".format(fileTag, filename),
+                        np.load(getCountsPaths(countsDirPath, filename, saliency)[1], allow_pickle=False)
+                        .astype(getCountDtype(fileInfo[filename]["numCols"])), allow_pickle=False)
+
+        expected([(file, "null") for file in filesToCount], numStates, saliency, countsDirPath, fileTag, numProcesses,
+                 verbose, keepCounts=saliency == 2, firstNewCols=firstNewCols)
+
+        for file, firstNewCol in zip(filesToCount, firstNewCols):
+            filename = file.name.split(".")[0]
+            countsPaths = getCountsPaths(countsDirPath, filename, saliency)
+            tempExpFreqPath = countsDirPath / "temp_exp_freq_{}_{}.npy".format(fileTag, filename)
+
+            countArr = np.load(tempExpFreqPath, allow_pickle=False).astype(np.int64)
+            if firstNewCol > 0:
+                countArr = mergeCounts(np.load(countsPaths[0], allow_pickle=False), countArr, saliency, firstNewCol,
+                                       fileInfo[filename]["numCols"])
+            with atomicWrite(countsPaths[0]) as tempCountsPath, open(tempCountsPath, "wb") as f:
+                np.save(f, countArr, allow_pickle=False)
+            remove(tempExpFreqPath)
+
+            if saliency == 2:
+                replace(countsDirPath / "temp_counts_{}_{}.npy".format(fileTag, filename), countsPaths[1])
+
+    # Counts of files which are no longer in the input directory are dropped
+    for filename in set(storedFiles) - set(fileInfo):
+        for path in getCountsPaths(countsDirPath, filename, saliency):
+            if path.exists():
+                remove(path)
+
+    # The manifest is only written once all the counts it describes are in place
+    with atomicWrite(manifestPath) as tempManifestPath, open(tempManifestPath, "w") as f:
+        json.dump({"version": storeVersion, "saliency": saliency, "numStates": numStates, "files": fileInfo}, f, indent=4)
+
+    storedExpPath = outputDirPath / "exp_freq_{}.npy".format(fileTag)
+    combineCounts([np.load(getCountsPaths(countsDirPath, filename, saliency)[0], mmap_mode="r", allow_pickle=False)
+                   for filename in sorted(fileInfo)], storedExpPath)
+
+    print("    {} of {} files counted\t[Done]".format(len(filesToCount), len(fileInfo)), flush=True)
+    print("    Expected frequencies written to:", storedExpPath, flush=True)
+    if verbose: print("Total Time:", time() - tTotal, flush=True)
+
+
+def getStatesDigests(file, numRows, numStates, colCounts):
+    """
+    Hashes the states of the first epigenomes of a file. The states are hashed as zero indexed uint16 values, so that text
+    and binary versions of the same states have the same digest
+
+    Input:
+    file -- The path of the file
+    numRows -- The number of rows of the file
+    numStates -- The number of states in the state model
+    colCounts -- Tuple of the numbers of epigenomes to hash the states of (each is hashed separately in the same pass)
+
+    Output:
+    List of the hex digests of the states of the first colCounts epigenomes
+    """
+    stateHashes = [hashlib.sha256() for _ in colCounts]
+    for _, dataArr in readStateBlocks(file1Path=file, rowsToCalc=(0, numRows), verbose=False, numStates=numStates):
+        for stateHash, numCols in zip(stateHashes, colCounts):
+            stateHash.update(np.ascontiguousarray(dataArr[:, :numCols], dtype=np.uint16).tobytes())
+    return [stateHash.hexdigest() for stateHash in stateHashes]
+
+
+def getCountsPaths(countsDirPath, filename, saliency):
+    """
+    Lists the paths of the stored counts of a file
+
+    Input:
+    countsDirPath -- The path of the directory the counts are stored in
+    filename -- The name of the file the counts were calculated from
+    saliency -- The saliency metric the counts were calculated for
+
+    Output:
+    A list of the path of the raw expected frequency counts, followed by the path of the state counts of each row for
+    saliency 2 (needed to pair the states of appended epigenomes with those of the earlier ones)
+    """
+    countsPaths = [countsDirPath / "{}.npy".format(filename)]
+    if saliency == 2:
+        countsPaths.append(countsDirPath / "{}.rowCounts.npy".format(filename))
+    return countsPaths
+
+
+def mergeCounts(storedArr, addedArr, saliency, firstNewCol, numCols):
+    """
+    Adds the counts of appended epigenomes to the stored counts of a file
+
+    Input:
+    storedArr -- Numpy array of the stored counts of the first firstNewCol epigenomes
+    addedArr -- Numpy array of the counts added by the epigenomes from firstNewCol on (see expected.calculateExpected())
+    saliency -- The saliency metric the counts were calculated for
+    firstNewCol -- The first appended epigenome
+    numCols -- The number of epigenomes including the appended ones
+
+    Output:
+    Numpy array of the counts of all numCols epigenomes
+    """
+    if saliency != 3:
+        return storedArr + addedArr
+
+    # The pairs of the earlier epigenomes keep their relative order among all the pairs (see helpers.getEpigenomePairs()), so
+    # the stored and added counts interleave into the larger array
+    newPairs = getEpigenomePairs(numCols)[1] >= firstNewCol
+    mergedArr = np.zeros((len(newPairs), *storedArr.shape[1:]), dtype=np.int64)
+    mergedArr[~newPairs] = storedArr
+    mergedArr[newPairs] = addedArr
+    return mergedArr
+
+
+if __name__ == "__main__":
+    main(argv[1], argv[2], int(argv[3]), argv[4], int(argv[5]), strToBool(argv[6]), strToBool(argv[7]))
@@ -9,7 +9,7 @@ from epilogos.pairwiseVisual import mergeAdjacent, findSign
 from epilogos.helpers import strToBool, getStateNames
 
 
-def main(outputDir, stateInfo, fileTag, expFreqPath, verbose):
+def main(outputDir, stateInfo, fileTag, expFreqPath, verbose, fileData=None):
     """
     Finds the top scoring regions across all epilogos score files and puts them into a txt file
 
@@ -19,6 +19,8 @@ def main(outputDir, stateInfo, fileTag, expFreqPath, verbose):
     fileTag -- A string which helps ensure outputed files are named similarly within an epilogos run
     expFreqPath -- The location of the stored expected frequency array
     verbose -- Boolean which if True, causes much more detailed prints
+    fileData -- List of the score files already read in by readScoreFile() (e.g. while the scores were being calculated in a
+                local run), if None the score files are read in here
     """
     outputDirPath = Path(outputDir)
 
@@ -26,7 +28,7 @@ def main(outputDir, stateInfo, fileTag, expFreqPath, verbose):
 
     if verbose: print("\nReading in score files...", flush=True); tRead = time()
     else: print("    Reading in files\t", end="", flush=True)
-    locationArr, scoreArr, maxScoreArr = readInData(outputDirPath)
+    locationArr, scoreArr, maxScoreArr = readInData(outputDirPath, fileData)
     if verbose: print("    Time:", time() - tRead, flush=True)
     else: print("\t[Done]", flush=True)
 
@@ -41,22 +43,24 @@ def main(outputDir, stateInfo, fileTag, expFreqPath, verbose):
     remove(Path(expFreqPath))
 
 
-def readInData(outputDirPath):
+def readInData(outputDirPath, fileData=None):
     """
     Reads all the epilogos score files in and combines them into a numpy array ordered by location
 
     Input:
     outputDirPath -- Path to the epilogos output directory (this contains the score files)
+    fileData -- List of the score files already read in by readScoreFile(), if None the score files are read in here
 
     Output:
     locationArr -- Numpy array containing the genomic locations for all the scores
-    scoreArr.sum(axis=1) -- Numpy array containing sums of the KL-Scores for each genomic bin
+    scoreArr -- Numpy array containing sums of the KL-Scores for each genomic bin
     maxScoreArr -- Numpy array containing the state which had the highest KL-score in each bin
     """
-    results = map(unpackNPZ, outputDirPath.glob("temp_scores_*.npz"))
+    if fileData is None:
+        fileData = map(readScoreFile, outputDirPath.glob("temp_scores_*.npz"))
 
-    # Split up read results into tuples of chromosomes, scores, and locations
-    dataChunks = list(zip(*results))
+    # Split up read results into tuples of chromosomes, scores, locations, and max scoring states
+    dataChunks = list(zip(*fileData))
 
     # Figuring out chromosome order
     rawChrNamesInts = []
@@ -73,22 +77,36 @@ def readInData(outputDirPath):
         chrOrder[i] = "chr" + str(chrOrder[i])
 
     # Sorting the dataframes by chromosomal location
-    # Creating array of scores and locations ordered by chromosome based on the read in chunks
-    index = dataChunks[0].index(chrOrder[0])
-    scoreArr = dataChunks[1][index]
-    locationArr = dataChunks[2][index]
-    for chrName in chrOrder[1:]:
-        index = dataChunks[0].index(chrName)
-        scoreArr = np.concatenate((scoreArr, dataChunks[1][index]))
-        locationArr = np.concatenate((locationArr, dataChunks[2][index]))
+    # Creating arrays of scores, locations, and max scoring states ordered by chromosome based on the read in chunks
+    chrIndices = [dataChunks[0].index(chrName) for chrName in chrOrder]
+    scoreArr = np.concatenate([dataChunks[1][index] for index in chrIndices])
+    locationArr = np.concatenate([dataChunks[2][index] for index in chrIndices])
+    maxScoreArr = np.concatenate([dataChunks[3][index] for index in chrIndices])
 
     # Cleaning up the temp files after we've read them
     for file in outputDirPath.glob("temp_scores_*.npz"):
         remove(file)
 
-    maxScoreArr = np.abs(np.argmax(np.abs(np.flip(scoreArr, axis=1)), axis=1) - scoreArr.shape[1]).astype(int)
+    return locationArr, scoreArr, maxScoreArr
+
+
+def readScoreFile(file):
+    """
+    Reads in a temporary score file and reduces it to what is needed to find the greatest hits. Local runs call this on each
+    file as soon as it is written (see scores.mainGenome()), so that the reading overlaps with the scoring of later files
+
+    Input:
+    file -- The .npz file to read in
 
-    return locationArr, scoreArr.sum(axis=1), maxScoreArr
+    Output:
+    chrName -- The name of the chromosome which the scores are of
+    scoreArr.sum(axis=1) -- Numpy array containing sums of the KL-Scores for each bin
+    locationArr -- Numpy array containing the genomic locations for all the scores
+    maxScoreArr -- Numpy array containing the state which had the highest KL-score in each bin
+    """
+    chrName, scoreArr, locationArr = unpackNPZ(file)
+    maxScoreArr = np.abs(np.argmax(np.abs(np.flip(scoreArr, axis=1)), axis=1) - scoreArr.shape[1]).astype(int)
+    return chrName, scoreArr.sum(axis=1), locationArr, maxScoreArr
 
 
 def unpackNPZ(file):
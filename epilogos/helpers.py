@@ -1,10 +1,61 @@
 import gzip
+import json
+import zlib
+from os import replace, getpid
+from contextlib import contextmanager, closing
+from itertools import repeat
+from collections import deque
+from queue import SimpleQueue
 from time import time
+from uuid import uuid4
+from math import ceil
+from multiprocessing import get_context, get_all_start_methods, shared_memory
 import pandas as pd
 import numpy as np
 from pathlib import Path
 
 
+# Binary state matrices begin with this magic string, followed by a little endian uint32 giving the length of a json header
+binaryMagic = b"EPILOGOS"
+binarySuffix = ".states.bin"
+
+# Row indices of text inputs are stored next to the input file and record a byte offset every rowIndexInterval rows
+rowIndexSuffix = ".rowIndex.npz"
+rowIndexInterval = 10000
+
+# Parsed state matrices shared between processes, keyed by the path of the file they were parsed from
+# Each value is a tuple of the SharedMemory object (which must be kept alive) and a numpy view of it
+sharedStateArrs = {}
+
+# Other shared memory blocks this process has created or attached to (see createSharedArray()), keyed by block name
+sharedArrayBlocks = {}
+
+# Identifies the initializer and arguments this pool process last ran (see poolStarmap())
+poolContextId = None
+
+# Seed of the epigenome pairs sampled for approximate saliency 3 (see getEpigenomePairs())
+pairSampleSeed = 7032016
+
+# Seed of the null (shuffled) rows of paired epilogos, each chunk of permutationChunkRows rows of a file being shuffled by its
+# own child of the seed for each permutation (see permuteRows())
+nullSeed = 7032016
+permutationChunkRows = 1000
+
+# The null distances of paired epilogos are compressed into weighted bins of the distances sharing their sign, exponent, and
+# first fitPrecision bits of mantissa before being fit, and each trial fit is done on a sample of the bins drawn by its own
+# child of fitSeed (see pairwiseVisual.fitDistances())
+fitSeed = 7032016
+fitPrecision = 10
+
+# Rows are handed out to processes in tasks of between rowIndexInterval and taskMaxRows rows, aiming for at least
+# tasksPerProcess tasks per process over all the files of a stage (see splitTasks())
+taskMaxRows = 50000
+tasksPerProcess = 4
+
+# The maximum size in bytes of the text inputs parsed into shared memory at once (see batchFiles())
+sharedStatesMaxSize = 2 ** 33
+
+
 def getNumStates(stateFile):
     """
     Input:
@@ -76,36 +127,905 @@ def blocks(file, size=65536):
         yield b
 
 
-def splitRows(dataFilePath, numProcesses):
+def isBinaryStates(dataFilePath):
+    """
+    Determines whether a data file is a binary state matrix created by 'epilogos convert'
+
+    Input:
+    dataFilePath -- the path of the data file
+
+    Output:
+    True if the file is a binary state matrix, False if it is a tab separated text file
+    """
+    return Path(dataFilePath).name.endswith(binarySuffix)
+
+
+def writeBinaryHeader(file, chrName, binStart, binSize, columns, dtype=np.uint8):
+    """
+    Writes the header of a binary state matrix. The state data is expected to be written directly after the header as a
+    C-ordered array of zero indexed states with shape (numRows, len(columns))
+
+    Input:
+    file -- a file object opened in binary write mode
+    chrName -- the name of the chromosome which the state matrix covers
+    binStart -- the start coordinate of the first bin
+    binSize -- the size of each bin in base pairs
+    columns -- the names of the epigenomes in the state matrix
+    dtype -- the numpy dtype the states are stored in [default=np.uint8]
+
+    Output:
+    The byte offset at which the state data begins
+    """
+    header = json.dumps({"chrName": str(chrName), "binStart": int(binStart), "binSize": int(binSize),
+                         "columns": [str(column) for column in columns], "dtype": np.dtype(dtype).name}).encode()
+
+    # Pad the header with spaces so that the state data is 64 byte aligned
+    offset = len(binaryMagic) + 4 + len(header)
+    header += b" " * (-offset % 64)
+
+    file.write(binaryMagic)
+    file.write(np.uint32(len(header)).tobytes())
+    file.write(header)
+
+    return offset + (-offset % 64)
+
+
+def readBinaryHeader(dataFilePath):
+    """
+    Reads the header of a binary state matrix
+
+    Input:
+    dataFilePath -- the path of the binary state matrix
+
+    Output:
+    Dictionary containing the chromosome name ('chrName'), the first bin start ('binStart'), the bin size ('binSize'), the
+    epigenome names ('columns'), the state dtype ('dtype'), the byte offset of the state data ('offset'), and the shape of
+    the state data ('numRows' and 'numCols')
+    """
+    with open(dataFilePath, "rb") as f:
+        if f.read(len(binaryMagic)) != binaryMagic:
+            raise ValueError("Not an epilogos binary state matrix: {}".format(dataFilePath))
+        headerLength = int(np.frombuffer(f.read(4), dtype=np.uint32)[0])
+        header = json.loads(f.read(headerLength).decode())
+
+    header["offset"] = len(binaryMagic) + 4 + headerLength
+    header["numCols"] = len(header["columns"])
+    header["numRows"] = (Path(dataFilePath).stat().st_size - header["offset"]) \
+        // (header["numCols"] * np.dtype(header["dtype"]).itemsize)
+
+    return header
+
+
+def readBinaryStates(dataFilePath, rowsToCalc=None):
+    """
+    Memory maps the states of a binary state matrix
+
+    Input:
+    dataFilePath -- the path of the binary state matrix
+    rowsToCalc -- the first and last rows to map, None maps all rows [default=None]
+
+    Output:
+    Read-only 2d numpy memmap of the zero indexed states over the relevant rows
+    """
+    header = readBinaryHeader(dataFilePath)
+    stateArr = np.memmap(dataFilePath, dtype=header["dtype"], mode="r", offset=header["offset"],
+                         shape=(header["numRows"], header["numCols"]))
+    return stateArr if rowsToCalc is None else stateArr[rowsToCalc[0]:rowsToCalc[1]]
+
+
+def getLocationInfo(dataFilePath):
+    """
+    Finds the genomic location information of a data file
+
+    Input:
+    dataFilePath -- the path of the data file
+
+    Output:
+    chrName -- the name of the chromosome which the data file covers
+    binStart -- the start coordinate of the first bin
+    binSize -- the size of each bin in base pairs
+    """
+    if isBinaryStates(dataFilePath):
+        header = readBinaryHeader(dataFilePath)
+        return header["chrName"], header["binStart"], header["binSize"]
+
+    firstRow = pd.read_table(dataFilePath, nrows=1, header=None, sep="\t").iloc[0]
+    return firstRow[0], int(firstRow[1]), int(firstRow[2]) - int(firstRow[1])
+
+
+def getNumCols(dataFilePath):
+    """
+    Finds the number of epigenomes (state columns) in a data file
+
+    Input:
+    dataFilePath -- the path of the data file
+
+    Output:
+    The number of epigenomes in the data file
+    """
+    if isBinaryStates(dataFilePath):
+        return readBinaryHeader(dataFilePath)["numCols"]
+
+    # The first 3 columns of text data files are the locations
+    return pd.read_table(dataFilePath, nrows=1, header=None, sep="\t").shape[1] - 3
+
+
+def isRowIndex(dataFilePath):
+    """
+    Determines whether a file is a row index sidecar created by epilogos
+
+    Input:
+    dataFilePath -- the path of the file
+
+    Output:
+    True if the file is a row index, False otherwise
+    """
+    return Path(dataFilePath).name.endswith(rowIndexSuffix)
+
+
+def listInputFiles(inputDirPath):
+    """
+    Lists the data files in an input directory, ignoring any row index sidecars epilogos has created there
+
+    Input:
+    inputDirPath -- the path of the input directory
+
+    Output:
+    Generator of the paths of all data files in the directory
+    """
+    return (file for file in inputDirPath.glob("*") if not isRowIndex(file))
+
+
+def isBgzf(dataFilePath):
+    """
+    Determines whether a file is block gzipped (BGZF, as created by bgzip). BGZF files are made of independently compressed
+    blocks, so decompression can start at any block boundary
+
+    Input:
+    dataFilePath -- the path of the file
+
+    Output:
+    True if the file is BGZF compressed, False otherwise
+    """
+    with open(dataFilePath, "rb") as f:
+        header = f.read(16)
+    # gzip magic with the FEXTRA flag set, followed by the 'BC' extra subfield
+    return len(header) == 16 and header[:4] == b"\x1f\x8b\x08\x04" and header[12:14] == b"BC"
+
+
+def bgzfBlocks(file):
+    """
+    Helper which decompresses a BGZF file one block at a time
+
+    Input:
+    file -- the BGZF file opened in binary mode
+
+    Output:
+    Tuples of the compressed offset of each block and the decompressed block
+    """
+    while True:
+        blockOffset = file.tell()
+        header = file.read(18)
+        if len(header) < 18: break
+        # BSIZE (total block size - 1) is stored in the 'BC' subfield of the gzip extra field
+        blockSize = int(np.frombuffer(header[16:18], dtype=np.uint16)[0]) + 1
+        # The compressed data is followed by an 8 byte footer (CRC32 and ISIZE)
+        yield blockOffset, zlib.decompress(file.read(blockSize - 18)[:-8], -15)
+
+
+def buildRowIndex(dataFilePath, interval=rowIndexInterval):
+    """
+    Counts the rows of a text data file and records where every interval-th row begins
+
+    Input:
+    dataFilePath -- the path of the tab separated (optionally gzipped) data file
+    interval -- the number of rows between recorded offsets [default=rowIndexInterval]
+
+    Output:
+    Dictionary containing the compression of the file ('kind' of 'text', 'gzip', or 'bgzf'), the number of rows
+    ('totalRows'), the rows between offsets ('interval'), and the offsets of rows 0, interval, 2*interval, ... ('rowOffsets').
+    Offsets are byte offsets for text, uncompressed byte offsets for gzip and virtual offsets
+    (block offset << 16 | offset within block) for BGZF
+    """
+    if isBgzf(dataFilePath):
+        kind = "bgzf"
+    elif dataFilePath.name.endswith("gz"):
+        kind = "gzip"
+    else:
+        kind = "text"
+
+    rowOffsets = [0]
+    totalRows = 0
+    position = 0
+    with (gzip.open(dataFilePath, "rb") if kind == "gzip" else open(dataFilePath, "rb")) as f:
+        for blockOffset, bl in (bgzfBlocks(f) if kind == "bgzf" else ((None, bl) for bl in blocks(f))):
+            newlines = np.flatnonzero(np.frombuffer(bl, dtype=np.uint8) == ord("\n"))
+            # Row totalRows + i + 1 starts right after the i-th newline in this block
+            rowStarts = np.arange(totalRows + 1, totalRows + 1 + len(newlines))
+            checkpoints = newlines[rowStarts % interval == 0] + 1
+            if kind == "bgzf":
+                rowOffsets.extend(((blockOffset << 16) + checkpoints).tolist())
+            else:
+                rowOffsets.extend((position + checkpoints).tolist())
+            totalRows += len(newlines)
+            position += len(bl)
+
+    return {"kind": kind, "totalRows": totalRows, "interval": interval, "rowOffsets": np.array(rowOffsets, dtype=np.int64)}
+
+
+@contextmanager
+def atomicWrite(filePath):
+    """
+    Context manager for writing a file through a temporary file in the same directory, which replaces the file once the
+    with block completes, so that an interrupted or concurrent run never reads a partially written file. If the with block
+    raises, the temporary file is removed and the file is left as it was
+
+    Input:
+    filePath -- The path of the file being written
+
+    Output:
+    The path of the temporary file to write to
+    """
+    tempFilePath = filePath.parent / "{}.{}.tmp".format(filePath.name, getpid())
+    try:
+        yield tempFilePath
+        replace(tempFilePath, filePath)
+    finally:
+        if tempFilePath.exists():
+            tempFilePath.unlink()
+
+
+def getRowIndex(dataFilePath, build=True):
+    """
+    Loads the row index of a text data file from its sidecar, building and storing the sidecar if it is missing or stale.
+    If the sidecar cannot be written (e.g. read-only input directory), the index is just returned
+
+    Input:
+    dataFilePath -- the path of the tab separated (optionally gzipped) data file
+    build -- If False, return None rather than building a missing or stale index [default=True]
+
+    Output:
+    The row index dictionary (see buildRowIndex())
+    """
+    indexPath = dataFilePath.parent / (dataFilePath.name + rowIndexSuffix)
+    fileStat = dataFilePath.stat()
+
+    # The sidecar is only valid for the exact version of the file it was built from
+    if indexPath.exists():
+        try:
+            with np.load(indexPath, allow_pickle=False) as npzFile:
+                if npzFile["fileSize"] == fileStat.st_size and npzFile["fileMtime"] == fileStat.st_mtime_ns:
+                    return {"kind": str(npzFile["kind"]), "totalRows": int(npzFile["totalRows"]),
+                            "interval": int(npzFile["interval"]), "rowOffsets": npzFile["rowOffsets"]}
+        except (OSError, ValueError, KeyError):
+            pass
+
+    if not build:
+        return None
+
+    rowIndex = buildRowIndex(dataFilePath)
+
+    # The index only saves rereading the file, so failing to write it (e.g. to a read only directory) is not an error
+    try:
+        with atomicWrite(indexPath) as tempIndexPath, open(tempIndexPath, "wb") as f:
+            np.savez(f, kind=np.array(rowIndex["kind"]), totalRows=np.array(rowIndex["totalRows"]),
+                     interval=np.array(rowIndex["interval"]), rowOffsets=rowIndex["rowOffsets"],
+                     fileSize=np.array(fileStat.st_size), fileMtime=np.array(fileStat.st_mtime_ns))
+    except OSError:
+        pass
+
+    return rowIndex
+
+
+@contextmanager
+def openAtRow(dataFilePath, rowIndex, row):
     """
-    Determines what rows to assign to each core
+    Opens a text data file positioned at the closest indexed row at or before the requested row
 
     Input:
-    dataFilePath -- the data file which we want to chunk up and send to seperate cores
-    numProcesses -- the number of cores which we want to work over
+    dataFilePath -- the path of the tab separated (optionally gzipped) data file
+    rowIndex -- the row index of the file (see getRowIndex())
+    row -- the row we would like to read from
 
     Output:
-    A list of tuples which contain the first and last rows for each core to use
+    skipRows -- the number of rows remaining between the file position and the requested row
+    file -- the binary file object positioned at the indexed row
     """
-    # Calculate the number of rows in the input file
-    if dataFilePath.name.endswith("gz"):
+    checkpoint = min(row // rowIndex["interval"], len(rowIndex["rowOffsets"]) - 1)
+    offset = int(rowIndex["rowOffsets"][checkpoint])
+    skipRows = row - checkpoint * rowIndex["interval"]
+
+    if rowIndex["kind"] == "bgzf":
+        # Start decompressing at the block containing the row and skip to the row within the block
+        with open(dataFilePath, "rb") as raw:
+            raw.seek(offset >> 16)
+            with gzip.GzipFile(fileobj=raw, mode="rb") as f:
+                f.read(offset & 0xFFFF)
+                yield skipRows, f
+    elif rowIndex["kind"] == "gzip":
+        # Seeking still decompresses up to the offset, but skips the far more expensive tokenizing of the skipped rows
         with gzip.open(dataFilePath, "rb") as f:
-            totalRows = sum(bl.count(b'\n') for bl in blocks(f))
+            f.seek(offset)
+            yield skipRows, f
     else:
         with open(dataFilePath, "rb") as f:
-            totalRows = sum(bl.count(b'\n') for bl in blocks(f))
+            f.seek(offset)
+            yield skipRows, f
+
+
+def getNumRows(dataFilePath):
+    """
+    Determines the number of rows in a data file. For text files the rows are counted while building the row index, which
+    lets the processes seek straight to their rows
+
+    Input:
+    dataFilePath -- The path to the data file
+
+    Output:
+    The number of rows in the data file
+    """
+    if isBinaryStates(dataFilePath):
+        return readBinaryHeader(dataFilePath)["numRows"]
+    else:
+        return getRowIndex(dataFilePath)["totalRows"]
+
+
+def describeBatch(filePairs):
+    """
+    Names a batch of files for progress updates (see batchFiles())
+
+    Input:
+    filePairs -- List of tuples whose first element is the path of the only or first file of each pair
+
+    Output:
+    The name of the file if there is only one, otherwise the number of files
+    """
+    if len(filePairs) == 1:
+        return Path(filePairs[0][0]).name.split(".")[0]
+    return "{} files".format(len(filePairs))
+
+
+def splitTasks(totalRowsList, numProcesses):
+    """
+    Splits the rows of one or more files into small tasks. All the tasks of a stage are handed out from a single queue (see
+    runTasks()), so processes which finish early keep picking up the remaining tasks of any file rather than waiting on the
+    slowest process or on small files
+
+    Input:
+    totalRowsList -- List of the number of rows in each file
+    numProcesses -- The number of processes the tasks are run on
+
+    Output:
+    A list of tuples (file index, (first row, last row)) for each task
+    """
+    taskRows = min(max(ceil(sum(totalRowsList) / (numProcesses * tasksPerProcess)), rowIndexInterval), taskMaxRows)
+
+    return [(fileIndex, (taskStart, min(taskStart + taskRows, totalRows))) for fileIndex, totalRows in enumerate(totalRowsList)
+            for taskStart in range(0, totalRows, taskRows)]
+
+
+def batchFiles(dataFilePathsList, numStates, maxSize=sharedStatesMaxSize):
+    """
+    Groups consecutive files into batches which are worked on together, such that the text inputs of a batch fit within
+    maxSize bytes once parsed into shared memory (see createSharedStates()). Binary state matrices are memory mapped rather
+    than parsed, so they do not count towards the size of a batch
+
+    Input:
+    dataFilePathsList -- List of the tuples of the paths of the data files used together (e.g. the two files of paired
+                         epilogos)
+    numStates -- The number of states in the state model
+    maxSize -- The maximum size in bytes of the parsed text inputs of a batch [default=sharedStatesMaxSize]
+
+    Output:
+    List of batches, each of which is a list of indices into dataFilePathsList
+    """
+    itemSize = np.dtype(getStateDtype(numStates)).itemsize
+
+    batches = []
+    batchSize = 0
+    for i, dataFilePaths in enumerate(dataFilePathsList):
+        size = sum(getNumRows(dataFilePath) * getNumCols(dataFilePath) * itemSize for dataFilePath in dataFilePaths
+                   if not isBinaryStates(dataFilePath))
+        if not batches or batchSize + size > maxSize:
+            batches.append([])
+            batchSize = 0
+        batches[-1].append(i)
+        batchSize += size
+
+    return batches
+
+
+def getEpigenomePairs(numCols, numSampledPairs=0, firstNewCol=0):
+    """
+    Lists every unordered pair of epigenomes. Saliency 3 expected frequencies are stored once per unordered pair, as the
+    frequency of states (a, b) in epigenomes (i, j) is the same as that of states (b, a) in epigenomes (j, i)
+
+    For approximate saliency 3, only a fixed random subset of the pairs is used. The subset is drawn with a fixed seed so that
+    the expected frequency and score calculations always agree on it, and it stays in the same order as the full list
+
+    Input:
+    numCols -- The number of epigenomes
+    numSampledPairs -- The number of pairs to sample (0 or at least the number of pairs means every pair is used)
+    firstNewCol -- If greater than 0, only the pairs which include an epigenome from this one on are listed (i.e. the pairs
+                   added by appending epigenomes to the first firstNewCol, see expectedUpdate.py) [default=0]
+
+    Output:
+    firstCols -- 1d numpy array of the first epigenome of each pair
+    secondCols -- 1d numpy array of the second epigenome of each pair (always greater than the first)
+    """
+    firstCols, secondCols = np.triu_indices(numCols, 1)
+    if 0 < numSampledPairs < len(firstCols):
+        sampleIndices = np.sort(np.random.RandomState(pairSampleSeed).choice(len(firstCols), numSampledPairs, replace=False))
+        firstCols, secondCols = firstCols[sampleIndices], secondCols[sampleIndices]
+    if firstNewCol > 0:
+        newPairs = secondCols >= firstNewCol
+        firstCols, secondCols = firstCols[newPairs], secondCols[newPairs]
+    return firstCols, secondCols
+
+
+def splitPairs(numPairs, numProcesses, maxTileSize):
+    """
+    Splits the epigenome pairs into tiles, with at least one tile per core
+
+    Input:
+    numPairs -- The number of epigenome pairs
+    numProcesses -- The number of cores which we want to work over
+    maxTileSize -- The maximum number of pairs in a tile
+
+    Output:
+    A list of tuples which contain the first and last pairs of each tile
+    """
+    tileSize = max(min(maxTileSize, -(-numPairs // numProcesses)), 1)
+    return [(tileStart, min(tileStart + tileSize, numPairs)) for tileStart in range(0, numPairs, tileSize)]
+
+
+def getStateDtype(numStates):
+    """
+    Finds the smallest unsigned integer type which can hold the zero indexed states of a state model
+
+    Input:
+    numStates -- The number of states in the state model
+
+    Output:
+    np.uint8 or np.uint16
+    """
+    return np.uint8 if numStates <= np.iinfo(np.uint8).max + 1 else np.uint16
+
+
+def getCountDtype(numCols):
+    """
+    Finds the smallest unsigned integer type which can hold the count of a state across the epigenomes of a row
+
+    Input:
+    numCols -- The number of epigenomes in a row
+
+    Output:
+    np.uint16 or np.uint32
+    """
+    return np.uint16 if numCols <= np.iinfo(np.uint16).max else np.uint32
+
+
+def createSharedStates(dataFilePaths, totalRows, numStates):
+    """
+    Allocates shared memory blocks to hold the parsed states of text data files, so that each file is parsed only once and
+    every process can view it without copying. Binary state matrices are skipped as they are memory mapped instead
+
+    Input:
+    dataFilePaths -- The paths of the data files to share
+    totalRows -- The number of rows in the data files
+    numStates -- The number of states in the state model
 
-    # Split the rows up according to the number of cores we have available
-    # Row list contain tuples of the first and last rows to be assigned to each core
-    rowList = []
-    for i in range(numProcesses):
-        rowsToCalc = (i * totalRows // numProcesses, (i+1) * totalRows // numProcesses)
-        rowList.append(rowsToCalc)
+    Output:
+    sharedBlocks -- List of the SharedMemory blocks (to be released with freeSharedStates())
+    sharedStatesInfo -- List of tuples (path, block name, shape, dtype) to be passed to attachSharedStates() in each process
+    """
+    sharedBlocks = []
+    sharedStatesInfo = []
+
+    dtype = np.dtype(getStateDtype(numStates))
+    for dataFilePath in dataFilePaths:
+        if isBinaryStates(dataFilePath):
+            continue
+        shape = (totalRows, getNumCols(dataFilePath))
+        sharedBlock = shared_memory.SharedMemory(create=True, size=max(shape[0] * shape[1] * dtype.itemsize, 1))
+        sharedBlocks.append(sharedBlock)
+        sharedStatesInfo.append((str(dataFilePath), sharedBlock.name, shape, dtype.name))
+
+    return sharedBlocks, sharedStatesInfo
+
+
+def attachSharedStates(sharedStatesInfo):
+    """
+    Attaches to the shared state matrices created by createSharedStates(), after which readStateRows() returns views of
+    the shared matrices rather than parsing the files. Meant to be called from the pool initializers (see poolStarmap())
+
+    Input:
+    sharedStatesInfo -- List of tuples (path, block name, shape, dtype) created by createSharedStates()
+    """
+    sharedStateArrs.clear()
+    for dataFilePath, name, shape, dtype in sharedStatesInfo:
+        sharedBlock = shared_memory.SharedMemory(name=name)
+        sharedStateArrs[dataFilePath] = (sharedBlock, np.ndarray(shape, dtype=dtype, buffer=sharedBlock.buf))
+
+
+def parseSharedStates(sharedStatesFileInfo, rowsToCalc, numStates):
+    """
+    Parses the relevant rows of a text data file into its shared state matrix. Each task parses a separate set of rows
+
+    Input:
+    sharedStatesFileInfo -- Tuple (path, block name, shape, dtype) describing the shared state matrix of the data file (see
+                            createSharedStates())
+    rowsToCalc -- The first and last rows to parse
+    numStates -- The number of states in the state model
+    """
+    dataFilePath, name, shape, dtype = sharedStatesFileInfo
+    sharedArrayView((name, shape, dtype))[rowsToCalc[0]:rowsToCalc[1]] = parseStateRows(Path(dataFilePath), rowsToCalc,
+                                                                                         numStates)
+
+
+def parseTasks(sharedStatesInfo, numStates, numProcesses):
+    """
+    Splits the parsing of text data files into their shared state matrices into tasks (see runTasks()). The parsing tasks
+    need no initialization, so processes can pick them up in between the tasks of any file
+
+    Input:
+    sharedStatesInfo -- List of tuples describing the shared state matrices (see createSharedStates())
+    numStates -- The number of states in the state model
+    numProcesses -- The number of processes the tasks are run on
+
+    Output:
+    tasks -- List of the parsing tasks
+    parseTaskRows -- Dictionary of the lists of tuples (task index, (first row, last row)) of the parsing tasks of each data
+                     file, keyed by the path of the data file (see parseDependencies())
+    """
+    tasks = []
+    parseTaskRows = {}
+    for taskIndex, (fileIndex, rowsToCalc) in enumerate(splitTasks([shape[0] for _, _, shape, _ in sharedStatesInfo],
+                                                                   numProcesses)):
+        tasks.append((None, None, (), parseSharedStates, (sharedStatesInfo[fileIndex], rowsToCalc, numStates)))
+        parseTaskRows.setdefault(sharedStatesInfo[fileIndex][0], []).append((taskIndex, rowsToCalc))
+
+    return tasks, parseTaskRows
+
+
+def parseDependencies(parseTaskRows, dataFilePaths, rowsToCalc):
+    """
+    Finds the parsing tasks which a task has to wait on before reading rows of data files from shared memory
+
+    Input:
+    parseTaskRows -- Dictionary of the rows of the parsing tasks of each data file (see parseTasks())
+    dataFilePaths -- The paths of the data files read by the task
+    rowsToCalc -- The first and last rows read by the task
+
+    Output:
+    List of the indices of the parsing tasks of the rows (empty for binary state matrices, which are not parsed)
+    """
+    return [taskIndex for dataFilePath in dataFilePaths for taskIndex, (parseStart, parseEnd)
+            in parseTaskRows.get(str(dataFilePath), []) if parseStart < rowsToCalc[1] and rowsToCalc[0] < parseEnd]
+
+
+def freeSharedStates(sharedBlocks):
+    """
+    Releases the shared memory blocks created by createSharedStates() or createSharedArray()
+
+    Input:
+    sharedBlocks -- List of the SharedMemory blocks
+    """
+    for sharedBlock in sharedBlocks:
+        sharedArrayBlocks.pop(sharedBlock.name, None)
+        sharedBlock.close()
+        sharedBlock.unlink()
+
+
+def createSharedArray(shape, dtype):
+    """
+    Allocates a zeroed numpy array in shared memory. Processes find the array by the name of its block, so it can be passed
+    to processes started with any method (unlike multiprocessing.RawArray, which can only be inherited by forked processes)
+
+    Input:
+    shape -- The shape of the array
+    dtype -- The numpy dtype of the array
+
+    Output:
+    sharedBlock -- The SharedMemory block (to be released with freeSharedStates())
+    sharedArrayInfo -- Tuple (block name, shape, dtype) to be passed to sharedArrayView() in each process
+    """
+    dtype = np.dtype(dtype)
+    sharedBlock = shared_memory.SharedMemory(create=True, size=max(int(np.prod(shape)) * dtype.itemsize, 1))
+    sharedArrayBlocks[sharedBlock.name] = sharedBlock
+    np.ndarray(shape, dtype=dtype, buffer=sharedBlock.buf).fill(0)
+
+    return sharedBlock, (sharedBlock.name, tuple(shape), dtype.name)
+
+
+def sharedArrayView(sharedArrayInfo):
+    """
+    Views an array created by createSharedArray(), attaching to its shared memory block the first time it is used by a process
+
+    Input:
+    sharedArrayInfo -- Tuple (block name, shape, dtype) created by createSharedArray()
+
+    Output:
+    Numpy array backed by the shared memory block
+    """
+    name, shape, dtype = sharedArrayInfo
+    if name not in sharedArrayBlocks:
+        sharedArrayBlocks[name] = shared_memory.SharedMemory(name=name)
+    return np.ndarray(shape, dtype=dtype, buffer=sharedArrayBlocks[name].buf)
+
+
+def createPool(numProcesses):
+    """
+    Creates a pool of processes which can be reused by every stage of an epilogos run. Processes are started with the
+    forkserver method where available (spawn otherwise), so they do not each inherit a copy of the parent process. Anything
+    a stage needs in its processes is set up by poolStarmap() instead of by the pool
+
+    Input:
+    numProcesses -- The number of processes in the pool
+
+    Output:
+    The multiprocessing pool
+    """
+    if "forkserver" in get_all_start_methods():
+        context = get_context("forkserver")
+        # Processes are forked from a server which has already imported numpy and pandas
+        context.set_forkserver_preload(["epilogos.helpers"])
+    else:
+        context = get_context("spawn")
+
+    return context.Pool(numProcesses)
+
+
+@contextmanager
+def stagePool(pool, numProcesses):
+    """
+    Context manager for the pool used by a stage. This is the pool given by the caller if there is one (e.g. the pool shared
+    by all the stages of a local run), otherwise it is a new pool which is closed and joined once the stage is done
+
+    Input:
+    pool -- The pool given to the stage (None if the stage should create its own)
+    numProcesses -- The number of processes in a new pool
+
+    Output:
+    The pool to use
+    """
+    if pool is not None:
+        yield pool
+        return
+
+    with closing(createPool(numProcesses)) as newPool:
+        yield newPool
+    newPool.join()
+
+
+def poolStarmap(pool, func, argsIterable, initializer=None, initargs=()):
+    """
+    Equivalent of pool.starmap() for pools which are shared between stages. Rather than when the pool is created, each
+    process runs initializer(*initargs) before the first task it receives from this call. Shared memory attached for
+    earlier calls is released first, so long lived processes only hold on to the shared memory of the current stage
+
+    Input:
+    pool -- The multiprocessing pool (see createPool())
+    func -- The function to run
+    argsIterable -- Iterable of the argument tuples of each task
+    initializer -- Function which sets up the process for func (e.g. by setting global variables)
+    initargs -- Tuple of the arguments of initializer
+
+    Output:
+    List of the results of each task
+    """
+    contextId = uuid4().hex
+    return pool.starmap(_runInContext, zip(repeat(contextId), repeat(initializer), repeat(initargs), repeat(func),
+                                           argsIterable))
+
+
+def _runInContext(contextId, initializer, initargs, func, args):
+    """
+    Runs a task submitted by poolStarmap(), initializing the process first if it has not yet run a task of the same call
+
+    Input:
+    contextId -- Identifies the poolStarmap() call
+    initializer -- Function which sets up the process for func
+    initargs -- Tuple of the arguments of initializer
+    func -- The function to run
+    args -- Tuple of the arguments of func
+
+    Output:
+    The result of func
+    """
+    global poolContextId
+
+    if poolContextId != contextId:
+        sharedStateArrs.clear()
+        for sharedBlock in sharedArrayBlocks.values():
+            sharedBlock.close()
+        sharedArrayBlocks.clear()
+
+        if initializer is not None:
+            initializer(*initargs)
+        poolContextId = contextId
+
+    return func(*args)
+
+
+def runTasks(pool, tasks, numProcesses, verbose, dependencies=None, callbacks=None):
+    """
+    Runs the tasks of a stage, which may span several files, through a single work queue. Tasks are handed out as processes
+    become free, so that all processes are kept busy until the last task is done. Like poolStarmap(), each process runs the
+    initializer of a task before its first task with the same context (e.g. the first task of each file), while tasks without
+    an initializer run in whatever context the process is in
+
+    Tasks may wait on other tasks (e.g. the writing of a file's scores on the tasks scoring it). Only a couple of tasks per
+    process are queued in the pool at a time, and tasks go to the front of the queue as soon as everything they wait on is
+    done, so the later steps of a file overlap with the earlier steps of the next files
+
+    Input:
+    pool -- The multiprocessing pool (see createPool())
+    tasks -- List of tuples (context, initializer, initargs, func, args) describing each task, where the context is any
+             hashable value shared by the tasks which use the same initialization
+    numProcesses -- The number of processes in the pool
+    verbose -- If True, a histogram of the time taken by each task is printed
+    dependencies -- Dictionary of the lists of the indices of the tasks which each task waits on, keyed by task index
+    callbacks -- Dictionary of functions which are called in this process on the result of their task as soon as it is done,
+                 keyed by task index. The result of the task is replaced by what the function returns
+
+    Output:
+    List of the results of each task, in the order of the tasks
+    """
+    dependencies = {} if dependencies is None else dependencies
+    callbacks = {} if callbacks is None else callbacks
 
-    return rowList
+    contextIds = {}
+    for context, _, _, _, _ in tasks:
+        contextIds.setdefault(context, uuid4().hex)
 
+    # The tasks waiting on each task, and the number of tasks each task is still waiting on
+    dependents = [[] for _ in tasks]
+    numWaiting = [0] * len(tasks)
+    for taskIndex, waitsOn in dependencies.items():
+        for waitIndex in waitsOn:
+            dependents[waitIndex].append(taskIndex)
+        numWaiting[taskIndex] = len(waitsOn)
+    readyTasks = deque(taskIndex for taskIndex in range(len(tasks)) if numWaiting[taskIndex] == 0)
 
-def readStates(file1Path=Path("null"), file2Path=Path("null"), rowsToCalc=(0, 0), expBool=True, verbose=True, groupSize=-1):
+    results = [None] * len(tasks)
+    taskTimes = np.zeros(len(tasks))
+    doneQueue = SimpleQueue()
+    numQueued = 0
+    for _ in range(len(tasks)):
+        while readyTasks and numQueued < 2 * numProcesses:
+            taskIndex = readyTasks.popleft()
+            context, initializer, initargs, func, args = tasks[taskIndex]
+            pool.apply_async(_runTask, ((taskIndex, contextIds[context], initializer, initargs, func, args),),
+                             callback=doneQueue.put, error_callback=doneQueue.put)
+            numQueued += 1
+
+        done = doneQueue.get()
+        if isinstance(done, BaseException):
+            raise done
+        taskIndex, results[taskIndex], taskTimes[taskIndex] = done
+        numQueued -= 1
+
+        if taskIndex in callbacks:
+            results[taskIndex] = callbacks[taskIndex](results[taskIndex])
+
+        # Tasks which were only waiting on this one jump the queue (keeping their order)
+        for dependentIndex in reversed(dependents[taskIndex]):
+            numWaiting[dependentIndex] -= 1
+            if numWaiting[dependentIndex] == 0:
+                readyTasks.appendleft(dependentIndex)
+
+    if verbose: printTaskTimes(taskTimes)
+
+    return results
+
+
+def _runTask(task):
+    """
+    Runs and times a single task submitted by runTasks()
+
+    Input:
+    task -- Tuple (task index, context id, initializer, initargs, func, args)
+
+    Output:
+    taskIndex -- The index of the task
+    result -- The result of the task
+    taskTime -- The time taken by the task in seconds
+    """
+    taskIndex, contextId, initializer, initargs, func, args = task
+    tTask = time()
+    if initializer is None:
+        result = func(*args)
+    else:
+        result = _runInContext(contextId, initializer, initargs, func, args)
+    return taskIndex, result, time() - tTask
+
+
+def printTaskTimes(taskTimes):
+    """
+    Prints a histogram of the time taken by each task of a stage, with bins doubling in width
+
+    Input:
+    taskTimes -- Numpy array of the time taken by each task in seconds
+    """
+    if taskTimes.size == 0:
+        return
+
+    print("Task times: {} tasks, mean {:.3f}s, max {:.3f}s".format(taskTimes.size, taskTimes.mean(), taskTimes.max()),
+          flush=True)
+    minExponent = int(np.floor(np.log2(max(taskTimes.min(), 1e-3))))
+    maxExponent = max(int(np.ceil(np.log2(max(taskTimes.max(), 1e-3)))), minExponent + 1)
+    binEdges = 2.0 ** np.arange(minExponent, maxExponent + 1)
+    binCounts, _ = np.histogram(np.clip(taskTimes, binEdges[0], binEdges[-1]), bins=binEdges)
+    for binStart, binEnd, binCount in zip(binEdges[:-1], binEdges[1:], binCounts):
+        print("    {:.3f}s - {:.3f}s\t{}\t{}".format(binStart, binEnd, binCount,
+                                                    "#" * int(np.ceil(40 * binCount / binCounts.max()))), flush=True)
+
+
+def readStateRows(dataFilePath, rowsToCalc, numStates):
+    """
+    Reads the zero indexed states of the relevant rows of a single data file. If the file has been parsed into shared
+    memory, a view of the shared state matrix is returned instead
+
+    Input:
+    dataFilePath -- The path to the data file (either tab separated text or a binary state matrix)
+    rowsToCalc -- The first and last rows to read from the file
+    numStates -- The number of states in the state model
+
+    Output:
+    2d numpy array of the state info for each epigenome in the data file over the relevant rows
+    """
+    if str(dataFilePath) in sharedStateArrs:
+        return sharedStateArrs[str(dataFilePath)][1][rowsToCalc[0]:rowsToCalc[1]]
+
+    return parseStateRows(dataFilePath, rowsToCalc, numStates)
+
+
+def parseStateRows(dataFilePath, rowsToCalc, numStates):
+    """
+    Parses the zero indexed states of the relevant rows of a single data file into the smallest unsigned integer type
+    which fits the state model (see getStateDtype())
+
+    Input:
+    dataFilePath -- The path to the data file (either tab separated text or a binary state matrix)
+    rowsToCalc -- The first and last rows to read from the file
+    numStates -- The number of states in the state model
+
+    Output:
+    2d numpy array of the state info for each epigenome in the data file over the relevant rows
+    """
+    # Binary state matrices are already zero indexed and compact, so the memory map can be used directly
+    if isBinaryStates(dataFilePath):
+        return readBinaryStates(dataFilePath, rowsToCalc)
+
+    # Dont want to read in locations
+    cols = range(3, getNumCols(dataFilePath) + 3)
+
+    if rowsToCalc[1] <= rowsToCalc[0]:
+        return np.zeros((0, len(cols)), dtype=getStateDtype(numStates))
+
+    # Read using pd.read_table and convert to numpy array for faster calculation (faster than np.genfromtext())
+    # States are parsed as uint16 (rather than the default int64) and validated before being narrowed
+    # If getNumRows() has indexed the file, seek to the rows rather than tokenizing every row before them
+    rowIndex = getRowIndex(dataFilePath, build=False)
+    if rowIndex is None:
+        stateArr = pd.read_table(dataFilePath, usecols=cols, skiprows=rowsToCalc[0], nrows=rowsToCalc[1]-rowsToCalc[0],
+                                 header=None, sep="\t", dtype=np.uint16).to_numpy()
+    else:
+        with openAtRow(dataFilePath, rowIndex, rowsToCalc[0]) as (skipRows, f):
+            stateArr = pd.read_table(f, usecols=cols, skiprows=skipRows, nrows=rowsToCalc[1]-rowsToCalc[0], header=None,
+                                     sep="\t", dtype=np.uint16).to_numpy()
+
+    # Zero states wrap around to the maximum value, so a single check catches states outside of [1, numStates]
+    stateArr -= 1
+    if stateArr.size and stateArr.max() >= numStates:
+        raise ValueError("States in {} must be between 1 and {}".format(dataFilePath, numStates))
+
+    return stateArr.astype(getStateDtype(numStates), copy=False)
+
+
+def readStates(file1Path=Path("null"), file2Path=Path("null"), rowsToCalc=(0, 0), expBool=True, verbose=True, groupSize=-1,
+               numStates=np.iinfo(np.uint16).max + 1, numPermutations=1):
     """
     Reads the states from the relevant rows of the inputed data file(s)
 
@@ -116,6 +1036,9 @@ def readStates(file1Path=Path("null"), file2Path=Path("null"), rowsToCalc=(0, 0)
     expBool -- Tells us if we are calculating the expected frequencies or the scores [default=True]
     verbose -- If True, we print out updates [default=True]
     groupSize -- When returning null output, return 2 evenly sized groups of this size
+    numStates -- The number of states in the state model, which determines the dtype of the state arrays [default=65536]
+    numPermutations -- The number of times the states are shuffled between the files for the null (paired epilogos scores)
+                       [default=1]
 
     Output:
         Single Epilogos:
@@ -125,6 +1048,7 @@ def readStates(file1Path=Path("null"), file2Path=Path("null"), rowsToCalc=(0, 0)
         Paired Epilogos Scores:
             file1Arr -- 2d numpy array of the state info for each epigenome in the first data file over the relevant rows
             file2Arr -- 2d numpy array of the state info for each epigenome in the second data file over the relevant rows
+            Followed by, for each of the numPermutations shuffles:
             shuffledCombinedArr[:, :file1Arr.shape[1]] -- 2d numpy array of the state info shuffled between first and second
                                                           data files, with the same width as file1Arr
             shuffledCombinedArr[:, file1Arr.shape[1]:] -- 2d numpy array of the state info shuffled between first and second
@@ -132,11 +1056,7 @@ def readStates(file1Path=Path("null"), file2Path=Path("null"), rowsToCalc=(0, 0)
     """
     # Read in the data from file 1
     if verbose and rowsToCalc[0] == 0: print("Reading data from file 1...", flush=True); tRead1 = time()
-    # Dont want to read in locations
-    cols = range(3, pd.read_table(file1Path, nrows=1, header=None, sep="\t").shape[1])
-    # Read using pd.read_table and convert to numpy array for faster calculation (faster than np.genfromtext())
-    file1Arr = pd.read_table(file1Path, usecols=cols, skiprows=rowsToCalc[0],
-                             nrows=rowsToCalc[1]-rowsToCalc[0], header=None, sep="\t").to_numpy(dtype=int) - 1
+    file1Arr = readStateRows(file1Path, rowsToCalc, numStates)
     if verbose and rowsToCalc[0] == 0: print("    Time: ", time() - tRead1, flush=True)
 
     # If we are doing single group epilogos, just return the data array, otherwise, we continute to the second file
@@ -145,11 +1065,7 @@ def readStates(file1Path=Path("null"), file2Path=Path("null"), rowsToCalc=(0, 0)
 
     # Read in the data from file 2
     if verbose and rowsToCalc[0] == 0: print("Reading data from file 2...", flush=True); tRead2 = time()
-    # Dont want to read in locations
-    cols = range(3, pd.read_table(file2Path, nrows=1, header=None, sep="\t").shape[1])
-    # Read using pd.read_table and convert to numpy array for faster calculation (faster than np.genfromtext())
-    file2Arr = pd.read_table(file2Path, usecols=cols, skiprows=rowsToCalc[0],
-                             nrows=rowsToCalc[1]-rowsToCalc[0], header=None, sep="\t").to_numpy(dtype=int) - 1
+    file2Arr = readStateRows(file2Path, rowsToCalc, numStates)
     if verbose and rowsToCalc[0] == 0: print("    Time: ", time() - tRead2, flush=True)
 
     # Combining the arrays for per row shuffling
@@ -162,16 +1078,147 @@ def readStates(file1Path=Path("null"), file2Path=Path("null"), rowsToCalc=(0, 0)
     if expBool:
         return combinedArr
 
-    # Row independent vectorized shuffling of the 2 arrays
+    # Row independent shuffling of the 2 arrays, once per permutation (the last permutation is done in place on the combined
+    # array, which is not needed unshuffled after that)
     if verbose and rowsToCalc[0] == 0: print("Shuffling input matrices...", flush=True); tShuffle = time()
-    randomIndices = np.argsort(np.random.rand(*combinedArr.shape), axis=1)
-    shuffledCombinedArr = np.take_along_axis(combinedArr, randomIndices, axis=1)
+    fileKey = zlib.crc32(Path(file1Path).name.split(".")[0].encode())
+    nullArrs = []
+    for permutation in range(numPermutations):
+        shuffledCombinedArr = combinedArr if permutation == numPermutations - 1 else combinedArr.copy()
+        permuteRows(shuffledCombinedArr, rowsToCalc[0], fileKey, permutation)
+
+        # shuffledCombinedArr is split by size of the original arrays
+        if groupSize == -1:
+            nullArrs += [shuffledCombinedArr[:, :file1Arr.shape[1]], shuffledCombinedArr[:, file1Arr.shape[1]:]]
+        else:
+            nullArrs += [shuffledCombinedArr[:, :groupSize], shuffledCombinedArr[:, groupSize:2*groupSize]]
     if verbose and rowsToCalc[0] == 0: print("    Time:", time() - tShuffle, flush=True)
 
     # In the case of calculating the scores for pairwise epilogos,
     # we need the original file 1 and file 2 arrays as well as their shuffled counterparts
-    # shuffledCombinedArr is split by size of the original arrays
-    if groupSize == -1:
-        return file1Arr, file2Arr, shuffledCombinedArr[:, :file1Arr.shape[1]], shuffledCombinedArr[:, file1Arr.shape[1]:]
-    else:
-        return file1Arr, file2Arr, shuffledCombinedArr[:, :groupSize], shuffledCombinedArr[:, groupSize:2*groupSize]
\ No newline at end of file
+    return (file1Arr, file2Arr, *nullArrs)
+
+
+def permuteRows(dataArr, firstRow, fileKey, permutation=0, seed=nullSeed, chunkRows=permutationChunkRows):
+    """
+    Shuffles the states within each row of a 2d array in place. Each chunk of chunkRows rows of a file is shuffled by its own
+    generator, seeded by a child of the seed keyed by the file and the chunk (and the permutation after the first, so that
+    asking for more permutations leaves the first unchanged), so that the shuffle of a row does not depend on how the rows of
+    the file are split between tasks, blocks, and processes
+
+    Input:
+    dataArr -- 2d numpy array of states
+    firstRow -- The row of the file which the first row of dataArr is
+    fileKey -- Integer identifying the file which the rows are from
+    permutation -- Index of the permutation, each of which shuffles the rows independently [default=0]
+    seed -- The seed all the generators are derived from [default=nullSeed]
+    chunkRows -- The number of rows shuffled by each generator [default=permutationChunkRows]
+
+    Output:
+    dataArr, with the states of each row shuffled
+    """
+    lastRow = firstRow + dataArr.shape[0]
+    for chunkStart in range(firstRow - firstRow % chunkRows, lastRow, chunkRows):
+        spawnKey = (fileKey, chunkStart // chunkRows) + ((permutation,) if permutation > 0 else ())
+        rng = np.random.default_rng(np.random.SeedSequence(seed, spawn_key=spawnKey))
+        # The rows of a chunk are shuffled one after the other, so drawing shuffles for the rows of the chunk before dataArr
+        # leaves the generator where it would be at firstRow
+        if chunkStart < firstRow:
+            rng.permuted(np.empty((firstRow - chunkStart, dataArr.shape[1]), dtype=dataArr.dtype), axis=1)
+        chunkArr = dataArr[max(chunkStart, firstRow) - firstRow:min(chunkStart + chunkRows, lastRow) - firstRow]
+        rng.permuted(chunkArr, axis=1, out=chunkArr)
+
+    return dataArr
+
+
+def countStates(dataArr, numStates, chunkSize=64):
+    """
+    Counts the number of times each state appears in each row of a 2d array of states. States are offset by their row so
+    that a single bincount tallies every row at once. This is done over chunks of columns to limit the size of the offset
+    array
+
+    Input:
+    dataArr -- 2d numpy array of states
+    numStates -- The number of states in the state model
+    chunkSize -- The number of columns to count at a time [default=64]
+
+    Output:
+    2d numpy array with the count of each state (columns) in each row (rows)
+    """
+    numRows = dataArr.shape[0]
+    rowOffsets = (np.arange(numRows) * numStates)[:, np.newaxis]
+
+    countArr = np.zeros(numRows * numStates, dtype=np.int64)
+    for col in range(0, dataArr.shape[1], chunkSize):
+        countArr += np.bincount((dataArr[:, col:col+chunkSize] + rowOffsets).ravel(), minlength=numRows * numStates)
+
+    return countArr.reshape(numRows, numStates)
+
+
+def printBlockProgress(blockRows, printCheckmarks, percentDone, verbose):
+    """
+    Prints an update for each progress checkmark passed within a block of rows
+
+    Input:
+    blockRows -- The first and last rows of the block
+    printCheckmarks -- The rows at which progress is reported
+    percentDone -- The percent completed before the block
+    verbose -- If True, percentages are printed, otherwise dots are printed
+
+    Output:
+    The percent completed after the block
+    """
+    for checkmark in printCheckmarks:
+        if blockRows[0] <= checkmark < blockRows[1]:
+            percentDone += 10
+            if verbose: print("    {}% Completed".format(percentDone), flush=True)
+            else: print(".", end="", flush=True)
+    return percentDone
+
+
+def readStateBlocks(file1Path=Path("null"), file2Path=Path("null"), rowsToCalc=(0, 0), expBool=True, verbose=True,
+                    groupSize=-1, numStates=np.iinfo(np.uint16).max + 1, blockSize=50000, numPermutations=1):
+    """
+    Generator which reads the states from the relevant rows of the inputed data file(s) in fixed size blocks of rows, so that
+    the memory used by a process depends on the block size rather than the number of rows it is responsible for
+
+    Input:
+    file1Path -- The path to the first file to read from (used in both single and paired epilogos) [default=Path("null")]
+    file2Path -- The path to the second file to read from (used only in paired epilogos) [default=Path("null")]
+    rowsToCalc -- The first and last rows to read from the files [default=(0, 0)]
+    expBool -- Tells us if we are calculating the expected frequencies or the scores [default=True]
+    verbose -- If True, we print out updates [default=True]
+    groupSize -- When returning null output, return 2 evenly sized groups of this size
+    numStates -- The number of states in the state model, which determines the dtype of the state arrays [default=65536]
+    blockSize -- The maximum number of rows in each block [default=50000]
+    numPermutations -- The number of times the states are shuffled for the null (paired epilogos scores) [default=1]
+
+    Output:
+    blockRows -- The first and last rows of the block
+    The output of readStates() over the rows of the block
+    """
+    for blockStart in range(rowsToCalc[0], rowsToCalc[1], blockSize):
+        blockRows = (blockStart, min(blockStart + blockSize, rowsToCalc[1]))
+        yield blockRows, readStates(file1Path=file1Path, file2Path=file2Path, rowsToCalc=blockRows, expBool=expBool,
+                                    verbose=verbose, groupSize=groupSize, numStates=numStates, numPermutations=numPermutations)
+
+
+def readCountBlocks(countsPath, rowsToCalc, blockSize=50000):
+    """
+    Generator which reads the state counts kept by the expected frequency calculation (see expected.calculateExpected()) from
+    the relevant rows of a memory mapped count matrix in fixed size blocks of rows, in place of readStateBlocks()
+
+    Input:
+    countsPath -- The path to the memory mapped count matrix
+    rowsToCalc -- The first and last rows to read
+    blockSize -- The maximum number of rows in each block [default=50000]
+
+    Output:
+    blockRows -- The first and last rows of the block
+    2d numpy array with the count of each state (columns) in each row (rows) of the block
+    """
+    countsArr = np.load(countsPath, mmap_mode="r", allow_pickle=False)
+    for blockStart in range(rowsToCalc[0], rowsToCalc[1], blockSize):
+        blockRows = (blockStart, min(blockStart + blockSize, rowsToCalc[1]))
+        # Counts are stored as small unsigned integers, so they are widened before any arithmetic is done on them
+        yield blockRows, countsArr[blockRows[0]:blockRows[1]].astype(np.int64)
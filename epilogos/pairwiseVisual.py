@@ -4,20 +4,21 @@ import matplotlib.pyplot as plt
 from pathlib import Path
 import pandas as pd
 import scipy.stats as st
+from scipy import optimize
 import warnings
 from time import time
 import gzip
-from multiprocessing import cpu_count, Pool
-from contextlib import closing
+from multiprocessing import cpu_count
 from itertools import repeat
 from os import remove
 import pyranges as pr
 from statsmodels.stats.multitest import multipletests
-from epilogos.helpers import strToBool, getStateNames, getStateColorsRGB, getNumStates
+from epilogos.helpers import strToBool, getStateNames, getStateColorsRGB, createSharedArray, sharedArrayView, \
+    freeSharedStates, stagePool, poolStarmap, fitSeed, fitPrecision
 
 
 def main(group1Name, group2Name, stateInfo, outputDir, fileTag, numProcesses, diagnosticBool, numTrials, samplingSize,
-         expFreqPath, verbose):
+         expFreqPath, verbose, pool=None):
     """
     Takes in the scores for the 2 paired groups and finds the distance between them. Then fits a gennorm distribution to the
     distances between the null scores and uses this to calculate the pvalues of the distances. These pvalues are written out,
@@ -36,6 +37,7 @@ def main(group1Name, group2Name, stateInfo, outputDir, fileTag, numProcesses, di
     samplingSize -- The amount of null data to fit
     expFreqPath -- The location of the stored expected frequency array
     verbose -- Boolean which if True, causes much more detailed prints
+    pool -- The multiprocessing pool to run on (see helpers.createPool()), if None a pool is created for each step
     """
     tTotal = time()
 
@@ -45,7 +47,6 @@ def main(group1Name, group2Name, stateInfo, outputDir, fileTag, numProcesses, di
     # Plotting setting
     plt.rcParams['agg.path.chunksize'] = 10000
 
-    numStates = getNumStates(stateInfo)
     stateColorList = getStateColorsRGB(stateInfo)
     stateNameList = getStateNames(stateInfo)
 
@@ -56,14 +57,14 @@ def main(group1Name, group2Name, stateInfo, outputDir, fileTag, numProcesses, di
     # Fitting a gennorm distribution to the distances
     if verbose: print("\nFitting gennorm distribution to distances...", flush=True); tFit = time()
     else: print("    Fitting distances\t", end="", flush=True)
-    params, distanceArrNull, nonQuiescentIdx = fitDistances(outputDirPath, numProcesses, numTrials, samplingSize)
+    params, distanceArrNull, nonQuiescentIdx = fitDistances(outputDirPath, numProcesses, numTrials, samplingSize, pool)
     if verbose: print("    Time:", time() - tFit, flush=True)
     else: print("\t[Done]", flush=True)
 
     # Read in observation files
     if verbose: print("Reading in observation files...", flush=True); tRead = time()
     else: print("    Reading in files\t", end="", flush=True)
-    locationArr, distanceArrReal, maxDiffArr, chrDict = readInData(outputDirPath, numProcesses, numStates)
+    locationArr, distanceArrReal, maxDiffArr, chrDict = readInData(outputDirPath)
     if verbose: print("    Time:", time() - tRead, flush=True)
     else: print("\t[Done]", flush=True)
 
@@ -119,7 +120,7 @@ def main(group1Name, group2Name, stateInfo, outputDir, fileTag, numProcesses, di
     if verbose: print("Creating Individual Chromosome Manhattan Plots", flush=True); tCManhattan = time()
     else: print("    Chromosome Manhattan\t", end="", flush=True)
     createChromosomeManhattan(group1Name, group2Name, locationArr, chrDict, distanceArrReal, maxDiffArr, params,
-                              stateColorList, outputDirPath, fileTag, numProcesses, mhPvals)
+                              stateColorList, outputDirPath, fileTag, numProcesses, mhPvals, pool)
     if verbose: print("    Time:", time() - tCManhattan, flush=True)
     else: print("\t[Done]", flush=True)
 
@@ -137,29 +138,30 @@ def main(group1Name, group2Name, stateInfo, outputDir, fileTag, numProcesses, di
     if verbose: print("Total Time:", time() - tTotal, flush=True)
 
 
-def fitDistances(outputDirPath, numProcesses, numTrials, samplingSize):
+def fitDistances(outputDirPath, numProcesses, numTrials, samplingSize, pool=None):
     """
     Filters out quiescent bins and deploys the processes which fits the null distances. Then calculates the median fit based
-    on the negative loglikelihood function
+    on the negative loglikelihood function. The null distances are compressed into weighted bins once (see binDistances()), so
+    that the fits and their likelihoods do not depend on the size of the genome
 
     Input:
     outputDirPath -- Path to the epilogos output directory (this contains the score files)
     numProcesses -- The number of cores to run on
     numTrials -- The number of fits to do
     samplingSize -- The amount of data to fit each time
+    pool -- The multiprocessing pool to run on (see helpers.createPool()), if None a pool is created
 
     Output:
     (fitDF.iloc[medianIndex, 0], fitDF.iloc[medianIndex, 1], fitDF.iloc[medianIndex, 2]) -- Tuple with beta, loc, and scale
                                                                                             params of the median fit
-    distanceArrNull -- Numpy array of the null distances
+    distanceArrNull -- 2d numpy array of the null distances of each bin (columns) for each permutation (rows)
     nonQuiescentIdx -- indices of non-quiescent bins (specifically used for distance arrays)
     """
     # Filtering out quiescent values (When there are exactly zero differences between both score arrays)
 
-    with closing(Pool(numProcesses)) as pool:
-        results = pool.starmap(readNull, zip(outputDirPath.glob("temp_nullDistances_*.npz"),
-                                             outputDirPath.glob("temp_quiescence_*.npz")))
-    pool.join()
+    with stagePool(pool, numProcesses) as readPool:
+        results = poolStarmap(readPool, readNull, zip(outputDirPath.glob("temp_nullDistances_*.npz"),
+                                                      outputDirPath.glob("temp_quiescence_*.npz")))
 
     # Figuring out chromosome order
     chromosomes = list(zip(*list(zip(*results))[0]))[0]
@@ -182,7 +184,7 @@ def fitDistances(outputDirPath, numProcesses, numTrials, samplingSize):
     distanceArrNull = nullChunks[1][index]
     for chrName in chrOrder[1:]:
         index = nullChunks[0].index(chrName)
-        distanceArrNull = np.concatenate((distanceArrNull, nullChunks[1][index]))
+        distanceArrNull = np.concatenate((distanceArrNull, nullChunks[1][index]), axis=1)
 
     # Creating quiescence array ordered by chromosome based on the read in chunks
     quiescenceChunks = list(zip(*list(zip(*results))[1]))
@@ -194,10 +196,13 @@ def fitDistances(outputDirPath, numProcesses, numTrials, samplingSize):
 
     nonQuiescentIdx = np.where(quiescenceArr == False)[0]
 
-    with closing(Pool(numProcesses)) as pool:
-        results = pool.starmap(fitOnSample, zip(repeat(distanceArrNull[nonQuiescentIdx], numTrials),
-                                                repeat(samplingSize, numTrials)))
-    pool.join()
+    # The null distances of every permutation are pooled for the fit
+    valueArr, weightArr = binDistances(distanceArrNull[:, nonQuiescentIdx].ravel())
+
+    with stagePool(pool, numProcesses) as fitPool:
+        results = poolStarmap(fitPool, fitOnSample, zip(repeat(valueArr, numTrials), repeat(weightArr, numTrials),
+                                                        repeat(samplingSize, numTrials),
+                                                        np.random.SeedSequence(fitSeed).spawn(numTrials)))
 
     # Creating dataframe of all params and nnlf so that we can figure out median
     index = [i for i in range(numTrials)]
@@ -227,7 +232,7 @@ def readNull(nullFile, quiescenceFile):
 
     Output:
     (npzFile['chrName'][0], npzFile['nullDistances']) -- Tuple with the chromosome name and the null signed squared euclidean
-                                                         distances
+                                                         distances of each permutation
     (npzFileQuiescence['chrName'][0], npzFileQuiescence['quiescenceArr']) -- Tuple with chromosome name and the T/F value of
                                                                              quiescence for each bin
     """
@@ -238,45 +243,115 @@ def readNull(nullFile, quiescenceFile):
                                                                        npzFileQuiescence['quiescenceArr'])
 
 
-def fitOnSample(distanceArrNull, samplingSize):
+def binDistances(distanceArr, precision=fitPrecision):
+    """
+    Compresses distances into weighted bins. Each bin holds the float32 distances which share their sign, exponent, and first
+    precision bits of mantissa, so that the bins have the same relative width at every scale (resolving the sharp peak of the
+    null distances as well as their tails), and is represented by the mean of the distances within it
+
+    Input:
+    distanceArr -- Numpy array containing the distances
+    precision -- The number of bits of mantissa shared by the distances of a bin [default=fitPrecision]
+
+    Output:
+    valueArr -- Numpy array containing the mean distance of each (non-empty) bin
+    weightArr -- Numpy array containing the number of distances in each bin
+    """
+    distanceArr = np.asarray(distanceArr, dtype=np.float32)
+    numMantissaBits = np.finfo(np.float32).nmant
+
+    binIdx = distanceArr.view(np.uint32) >> (numMantissaBits - precision)
+    weightArr = np.bincount(binIdx, minlength=2 ** (32 - numMantissaBits + precision))
+    sumArr = np.bincount(binIdx, weights=distanceArr, minlength=2 ** (32 - numMantissaBits + precision))
+
+    nonEmpty = weightArr > 0
+    return sumArr[nonEmpty] / weightArr[nonEmpty], weightArr[nonEmpty]
+
+
+def fitOnSample(valueArr, weightArr, samplingSize, seed):
     """
-    Fits a sample of the null distances
+    Fits a sample of the binned null distances
 
     Input:
-    distanceArrNull -- Numpy array containing the distances to sample for the fit
-    samplingSize -- The size of the sample to fit
+    valueArr -- Numpy array containing the value of each bin of distances (see binDistances())
+    weightArr -- Numpy array containing the number of distances in each bin
+    samplingSize -- The number of distances to sample for the fit
+    seed -- The seed of the sample (a numpy SeedSequence)
 
     Output:
     params -- The fit parameters obtained
-    nnlf -- The negative loglikelihood function obtained by the fit
+    nnlf -- The negative loglikelihood function obtained by the fit (over all the distances)
     """
-    if len(distanceArrNull) <= samplingSize:
-        sampleData = distanceArrNull
+    # Sampling the distances without replacement is sampling how many of the distances of each bin are drawn
+    if weightArr.sum() <= samplingSize:
+        sampleWeightArr = weightArr
     else:
-        np.random.seed()  # On linux, multiprocessing inherits the master seed and doesn't generate fully random numbers
-        sampleData = pd.Series(np.random.choice(distanceArrNull, size=samplingSize, replace=False))
+        sampleWeightArr = np.random.default_rng(seed).multivariate_hypergeometric(weightArr, samplingSize,
+                                                                                 method="marginals")
 
     # ignore warnings
     with warnings.catch_warnings():
         warnings.simplefilter("ignore")
 
         # Fit the data
-        params = st.gennorm.fit(sampleData)
+        params = weightedGennormFit(valueArr, sampleWeightArr)
 
         # Calculate SSE and MLE
-        nnlf = st.gennorm.nnlf(params, pd.Series(distanceArrNull))
+        nnlf = weightedGennormNnlf(params, valueArr, weightArr)
 
     return params, nnlf
 
 
-def readInData(outputDirPath, numProcesses, numStates):
+def weightedGennormFit(valueArr, weightArr):
     """
-    Reads all the epilogos score files in and combines them into a numpy array ordered by location
+    Finds the maximum likelihood gennorm fit of weighted values. This mirrors scipy's generic fit (a Nelder-Mead search from
+    a beta of 1 with the location and scale matching the mean and variance) with each value counted weight times
 
     Input:
-    outputDirPath -- Path to the epilogos output directory (this contains the score files)
-    numProcesses -- The number of cores used to read in score files
-    numStates -- The number of states in the state model
+    valueArr -- Numpy array containing the values to fit
+    weightArr -- Numpy array containing the weight of each value
+
+    Output:
+    Tuple with the beta, loc, and scale of the fit
+    """
+    nonZero = weightArr > 0
+    valueArr, weightArr = valueArr[nonZero], weightArr[nonZero]
+
+    mean = np.average(valueArr, weights=weightArr)
+    std = np.sqrt(np.average(np.square(valueArr - mean), weights=weightArr))
+    # A gennorm with a beta of 1 has a variance of twice the square of its scale
+    startParams = (1.0, mean, std / np.sqrt(2) if std > 0 else 1.0)
+
+    return tuple(optimize.fmin(weightedGennormNnlf, startParams, args=(valueArr, weightArr), disp=False))
+
+
+def weightedGennormNnlf(params, valueArr, weightArr):
+    """
+    Calculates the negative loglikelihood of a gennorm fit over weighted values
+
+    Input:
+    params -- Tuple with the beta, loc, and scale of the fit
+    valueArr -- Numpy array containing the values
+    weightArr -- Numpy array containing the weight of each value
+
+    Output:
+    The negative loglikelihood of the values (infinite if the parameters are invalid)
+    """
+    beta, loc, scale = params
+    if beta <= 0 or scale <= 0:
+        return np.inf
+
+    logPdfArr = st.gennorm.logpdf(valueArr, beta, loc=loc, scale=scale)
+    nnlf = -np.sum(weightArr * logPdfArr)
+    return nnlf if np.isfinite(nnlf) else np.inf
+
+
+def readInData(outputDirPath):
+    """
+    Reads all the temporary distance files written while scoring in and combines them into numpy arrays ordered by location
+
+    Input:
+    outputDirPath -- Path to the epilogos output directory (this contains the distance files)
 
     Output:
     locationArr -- Numpy array containing the genomic locations for all the scores
@@ -284,23 +359,14 @@ def readInData(outputDirPath, numProcesses, numStates):
     maxDiffArr -- Numpy array containing the state which had the absolute distance in each bin
     chrDict -- Dictionary containing mappings between number values and chromosome names (helps locationArr use less memory)
     """
-    # For keeping the data arrays organized correctly
-    realNames = ["chr", "binStart", "binEnd"] + ["s{}".format(i) for i in range(1, numStates + 1)]
-
-    # Data frame to dump inputed data into
-    diffDF = pd.DataFrame(columns=realNames)
-
-    # Multiprocess the reading
-    with closing(Pool(numProcesses)) as pool:
-        results = pool.starmap(readTableMulti, zip(outputDirPath.glob("pairwiseDelta_*.txt.gz"), repeat(realNames)))
-    pool.join()
-
-    # Concatenating all chunks to the real differences dataframe
-    for diffDFChunk in results:
-        diffDF = pd.concat((diffDF, diffDFChunk), axis=0, ignore_index=True)
+    distanceChunks = []
+    for file in outputDirPath.glob("temp_distances_*.npz"):
+        with np.load(file) as npzFile:
+            distanceChunks.append({key: npzFile[key] for key in ("chrName", "binStart", "binSize", "distanceArr",
+                                                                 "maxDiffArr")})
+    chromosomes = [distanceChunk["chrName"][0] for distanceChunk in distanceChunks]
 
     # Figuring out chromosome order
-    chromosomes = diffDF['chr'].unique()
     rawChrNamesInts = []
     rawChrNamesStrs = []
     for chromosome in chromosomes:
@@ -314,54 +380,41 @@ def readInData(outputDirPath, numProcesses, numStates):
     for i in range(len(chrOrder)):
         chrOrder[i] = "chr" + str(chrOrder[i])
 
-    # Sorting the dataframes by chromosomal location
-    diffDF["chr"] = pd.Categorical(diffDF["chr"], categories=chrOrder, ordered=True)
-    diffDF.sort_values(by=["chr", "binStart", "binEnd"], inplace=True)
-
     # Creating a dictionary to make location array take less memory
     chrNumbers = [i for i in range(1, len(chrOrder) + 1)]
     chrDict    = dict(zip(chrNumbers, chrOrder))
 
-    # Convert dataframes to np arrays for easier manipulation
-    locationArr = diffDF.iloc[:, 0:3].replace({"chr": dict(zip(chrOrder, chrNumbers))}).to_numpy(dtype=np.int32)
-    diffArr     = diffDF.iloc[:, 3:].to_numpy(dtype=np.float32)
+    # Filling arrays ordered by chromosome from the distance files
+    numRows = sum(distanceChunk["distanceArr"].shape[0] for distanceChunk in distanceChunks)
+    locationArr = np.empty((numRows, 3), dtype=np.int32)
+    distanceArrReal = np.empty(numRows, dtype=np.float32)
+    maxDiffArr = np.empty(numRows, dtype=np.int32)
+    rowStart = 0
+    for chrNumber, chrName in zip(chrNumbers, chrOrder):
+        distanceChunk = distanceChunks[chromosomes.index(chrName)]
+        rowEnd = rowStart + distanceChunk["distanceArr"].shape[0]
+        binStart, binSize = distanceChunk["binStart"][0], distanceChunk["binSize"][0]
+        locationArr[rowStart:rowEnd, 0] = chrNumber
+        locationArr[rowStart:rowEnd, 1] = binStart + binSize * np.arange(rowEnd - rowStart)
+        locationArr[rowStart:rowEnd, 2] = locationArr[rowStart:rowEnd, 1] + binSize
+        distanceArrReal[rowStart:rowEnd] = distanceChunk["distanceArr"]
+        maxDiffArr[rowStart:rowEnd] = distanceChunk["maxDiffArr"]
+        rowStart = rowEnd
 
     # Cleaning up the temp files after we've read them
     for file in outputDirPath.glob("temp_*.npz"):
         remove(file)
 
-    # Calculate the signed squared euclidean distance array for the real data
-    distanceArrReal = np.sum(np.square(diffArr), axis=1) * np.sign(np.sum(diffArr, axis=1))
-
-    # Calculate the maximum contributing state for each bin
-    # In the case of a tie, the higher number state wins (e.g. last state wins if all states are 0)
-    maxDiffArr = np.abs(np.argmax(np.abs(np.flip(diffArr, axis=1)), axis=1) - diffArr.shape[1]).astype(np.int32)
-
     return locationArr, distanceArrReal, maxDiffArr, chrDict
 
 
-def readTableMulti(realFile, realNames):
-    """
-    Reads in the real and null scores
-
-    Input:
-    realFile -- The path to the file containing the real scores
-
-    Output:
-    diffDFChunk -- Pandas dataframe containing the real scores
-    """
-    diffDFChunk = pd.read_table(Path(realFile), header=None, sep="\t", names=realNames)
-
-    return diffDFChunk
-
-
 def createDiagnosticFigures(distanceArrReal, distanceArrNull, nonQuiescentIdx, beta, loc, scale, outputDirPath, fileTag):
     """
     Generate diagnostic plots of the gennorm fit on the null data and comparisons between the null and real data
 
     Input:
     distanceArrReal -- Numpy array containing the real distances
-    distanceArrNull -- Numpy array containing the null distances
+    distanceArrNull -- 2d numpy array containing the null distances of each bin (columns) for each permutation (rows)
     nonQuiescentIdx -- indices of non-quiescent bins (specifically used for distance arrays)
     beta -- gennorm fit parameter
     loc -- gennorm fit parameter
@@ -374,7 +427,7 @@ def createDiagnosticFigures(distanceArrReal, distanceArrNull, nonQuiescentIdx, b
         diagnosticDirPath.mkdir(parents=True)
 
     dataReal = pd.Series(distanceArrReal[nonQuiescentIdx])
-    dataNull = pd.Series(distanceArrNull[nonQuiescentIdx])
+    dataNull = pd.Series(distanceArrNull[:, nonQuiescentIdx].ravel())
 
     # Fit on data (range=(min, max))
     y, x = np.histogram(dataNull, bins=400, range=(np.amin(distanceArrNull), np.amax(distanceArrNull)), density=True)
@@ -434,7 +487,7 @@ def createDiagnosticFigures(distanceArrReal, distanceArrNull, nonQuiescentIdx, b
 
     # Real vs Null distance scatter plot
     fig = plt.figure(figsize=(12, 12))
-    plt.scatter(distanceArrReal, distanceArrNull, color='r', rasterized=True)
+    plt.scatter(distanceArrReal, distanceArrNull[0], color='r', rasterized=True)
     plt.xlim(-rangeLim, rangeLim)
     plt.ylim(-rangeLim, rangeLim)
     plt.xlabel("Real Distances")
@@ -751,47 +804,47 @@ def createGenomeManhattan(group1Name, group2Name, locationArr, chrDict, distance
     plt.close(fig)
 
 
-def _initChromosomeManhattan(group1Name_, group2Name_, locationArr_, distanceArrReal_, maxDiffArr_, params, mhPvals_,
-                             stateColorList_, manhattanDirPath_):
+def _initChromosomeManhattan(group1Name_, group2Name_, sharedLocationArr_, sharedDistanceArrReal_, sharedMaxDiffArr_, params,
+                             sharedMhPvals_, stateColorList_, manhattanDirPath_):
     """
-    Initializes global variables for multiprocessing in the single epilogos case
+    Initializes global variables for multiprocessing in the single epilogos case (see helpers.poolStarmap())
 
     Input:
     group1Name_ -- The name of the first epilogos group
     group2Name_ -- The name of the second epilogos group
-    locationArr_ -- Numpy array containing the genomic locations of all the bins
-    distanceArrReal_ -- Numpy array containing the real distances
-    maxDiffArr_ -- Numpy array containing the states which had the largest difference between the two groups in each bin
+    sharedLocationArr_ -- Shared array containing the genomic locations of all the bins (see helpers.createSharedArray())
+    sharedDistanceArrReal_ -- Shared array containing the real distances
+    sharedMaxDiffArr_ -- Shared array containing the states which had the largest difference between the two groups in each bin
     params -- gennorm fit parameters
-    mhPvals_ -- Multiple hypothesis corrected pvals using the Benjamini-Hochberg procedure
+    sharedMhPvals_ -- Shared array of the multiple hypothesis corrected pvals using the Benjamini-Hochberg procedure
     stateColorList_ -- Numpy array containing the colors of each of the states in the state model
     manhattanDirPath_ -- The path to directory to put manhattan plots
     """
     global group1Name
     global group2Name
-    global locationArr
-    global distanceArrReal
-    global maxDiffArr
+    global sharedLocationArr
+    global sharedDistanceArrReal
+    global sharedMaxDiffArr
     global beta
     global loc
     global scale
-    global mhPvals
+    global sharedMhPvals
     global stateColorList
     global manhattanDirPath
 
     group1Name = group1Name_
     group2Name = group2Name_
-    locationArr = locationArr_
-    distanceArrReal = distanceArrReal_
-    maxDiffArr = maxDiffArr_
+    sharedLocationArr = sharedLocationArr_
+    sharedDistanceArrReal = sharedDistanceArrReal_
+    sharedMaxDiffArr = sharedMaxDiffArr_
     beta, loc, scale = params[:-2], params[-2], params[-1]
-    mhPvals = mhPvals_
+    sharedMhPvals = sharedMhPvals_
     stateColorList = stateColorList_
     manhattanDirPath = manhattanDirPath_
 
 
 def createChromosomeManhattan(group1Name, group2Name, locationArr, chrDict, distanceArrReal, maxDiffArr, params,
-                              stateColorList, outputDirPath, fileTag, numProcesses, mhPvals):
+                              stateColorList, outputDirPath, fileTag, numProcesses, mhPvals, pool=None):
     """
     Creates a manhattan plot based on the distances between the two groups for the each chromosome
 
@@ -808,6 +861,7 @@ def createChromosomeManhattan(group1Name, group2Name, locationArr, chrDict, dist
     fileTag -- A string which helps ensure outputed files are named similarly within an epilogos run
     numProcesses -- The number of cores to run on
     mhPvals -- Multiple hypothesis corrected pvals using the Benjamini-Hochberg procedure
+    pool -- The multiprocessing pool to run on (see helpers.createPool()), if None a pool is created
     """
     manhattanDirPath = outputDirPath / "manhattanPlots_{}".format(fileTag)
     if not manhattanDirPath.exists():
@@ -823,13 +877,22 @@ def createChromosomeManhattan(group1Name, group2Name, locationArr, chrDict, dist
 
     chrOrder = list(map(lambda x: x.split("chr")[-1], [chrDict[x] for x in locationArr[:, 0][xticks]]))
 
-    # Multiprocess the reading
-    with closing(Pool(numProcesses, initializer=_initChromosomeManhattan, initargs=(group1Name, group2Name, locationArr,
-                                                                                    distanceArrReal, maxDiffArr, params,
-                                                                                    mhPvals, stateColorList,
-                                                                                    manhattanDirPath))) as pool:
-        pool.starmap(graphChromosomeManhattan, zip(chrOrder, startEnd))
-    pool.join()
+    # Genome wide arrays are shared rather than sent to the processes with every chromosome
+    sharedBlocks = []
+    sharedArrs = []
+    for arr in (locationArr, distanceArrReal, maxDiffArr, mhPvals):
+        sharedBlock, sharedArrInfo = createSharedArray(arr.shape, arr.dtype)
+        sharedArrayView(sharedArrInfo)[:] = arr
+        sharedBlocks.append(sharedBlock)
+        sharedArrs.append(sharedArrInfo)
+
+    # Multiprocess the plotting
+    try:
+        with stagePool(pool, numProcesses) as pool:
+            poolStarmap(pool, graphChromosomeManhattan, zip(chrOrder, startEnd), _initChromosomeManhattan,
+                        (group1Name, group2Name, *sharedArrs[:3], params, sharedArrs[3], stateColorList, manhattanDirPath))
+    finally:
+        freeSharedStates(sharedBlocks)
 
 
 def graphChromosomeManhattan(chromosome, startEnd):
@@ -843,6 +906,11 @@ def graphChromosomeManhattan(chromosome, startEnd):
 
     Also see global variables from _initChromosomeManhattan above
     """
+    locationArr = sharedArrayView(sharedLocationArr)
+    distanceArrReal = sharedArrayView(sharedDistanceArrReal)
+    maxDiffArr = sharedArrayView(sharedMaxDiffArr)
+    mhPvals = sharedArrayView(sharedMhPvals)
+
     fig = plt.figure(figsize=(16, 9))
     ax = fig.add_subplot(111)
     ax.set_facecolor("#FFFFFF")
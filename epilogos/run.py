@@ -1,21 +1,28 @@
 import sys
 from pathlib import Path
 from time import sleep
-from os import remove
+from os import remove, link
+from shutil import copyfile
 import subprocess
 from pathlib import PurePath
 import errno
 import click
-
-from epilogos.expected import main as expected
-from epilogos.expectedCombination import main as expectedCombination
-from epilogos.scores import main as scores
-from epilogos.greatestHits import main as greatestHits
+import numpy as np
+from multiprocessing import cpu_count
+
+from epilogos.expected import mainGenome as expected
+from epilogos.expectedCombination import main as expectedCombination, mainCached as expectedFromCache
+from epilogos.expectedCache import getCacheDir, getCachePath, touchCache, evictCache
+from epilogos.scores import mainGenome as scores
+from epilogos.greatestHits import main as greatestHits, readScoreFile
 from epilogos.pairwiseVisual import main as pairwiseVisual
-from epilogos.helpers import getNumStates
+from epilogos.convert import main as convert
+from epilogos.validate import main as validate
+from epilogos.expectedUpdate import main as expectedUpdate
+from epilogos.helpers import getNumStates, getNumCols, getEpigenomePairs, listInputFiles, createPool
 
 
-@click.command(context_settings=dict(help_option_names=['-h', '--help']))
+@click.group(context_settings=dict(help_option_names=['-h', '--help']), invoke_without_command=True)
 @click.option("-m", "--mode", "mode", type=click.Choice(["single", "paired"]), default=["single"], show_default=True,
               multiple=True, help="single for single group epilogos and paired for 2 group epilogos")
 @click.option("-l", "--local", "commandLineBool", is_flag=True, multiple=True,
@@ -53,13 +60,37 @@ from epilogos.helpers import getNumStates
 @click.option("-p", "--partition", "partition", type=str, multiple=True,
               help="Request a specific partition for the SLURM resource allocation. If not specified, uses the default " +
                    "partition as designated by the system administrator")
-def main(mode, commandLineBool, inputDirectory, inputDirectory1, inputDirectory2, outputDirectory, stateInfo, saliency,
-         numProcesses, exitBool, diagnosticBool, numTrials, samplingSize, quiescentState, groupSize, version, partition):
+@click.option("-r", "--sampled-pairs", "numSampledPairs", type=int, default=[0], show_default=True, multiple=True,
+              help="If greater than 0, saliency 3 is approximated using this many randomly sampled epigenome pairs, and a " +
+                   "standard error is reported for each bin alongside the scores")
+@click.option("-k", "--keep-counts", "keepCountsBool", is_flag=True, multiple=True,
+              help="If flag is enabled, the state counts of each bin are kept on disk while calculating the background " +
+                   "frequencies and the scores are calculated from them, so that the input files are only read once " +
+                   "(single epilogos with a saliency of 1 or 2 only)")
+@click.option("--no-cache", "noCacheBool", is_flag=True, multiple=True,
+              help="If flag is enabled, the background frequencies are neither read from nor stored in the cache of earlier " +
+                   "runs (see EPILOGOS_CACHE_DIR)")
+@click.option("--background", "backgroundFile", type=str, multiple=True,
+              help="Path to an expected frequency array (e.g. of a reference panel, see 'epilogos expected') to score the " +
+                   "input files against, in place of calculating the background frequencies from the input files")
+@click.option("--num-permutations", "numPermutations", type=int, default=[1], show_default=True, multiple=True,
+              help="In pairwise epilogos, the number of times the states of each bin are shuffled between the groups to " +
+                   "build the null distribution which the distances are fit on")
+@click.option("--no-delta-text", "noDeltaTextBool", is_flag=True, multiple=True,
+              help="If flag is enabled, the differences between the scores of the two groups are not written out to " +
+                   "pairwiseDelta_*.txt.gz files (paired epilogos only)")
+@click.pass_context
+def main(ctx, mode, commandLineBool, inputDirectory, inputDirectory1, inputDirectory2, outputDirectory, stateInfo, saliency,
+         numProcesses, exitBool, diagnosticBool, numTrials, samplingSize, quiescentState, groupSize, version, partition,
+         numSampledPairs, keepCountsBool, noCacheBool, backgroundFile, numPermutations, noDeltaTextBool):
     """
     Information-theoretic navigation of multi-tissue functional genomic annotations
 
     Written by Jacob Quon and Wouter Meuleman
     """
+    # Subcommands (e.g. 'epilogos convert') handle their own arguments
+    if ctx.invoked_subcommand is not None:
+        return
 
     print("""\n
                     d8b 888
@@ -86,12 +117,18 @@ def main(mode, commandLineBool, inputDirectory, inputDirectory1, inputDirectory2
 
     # Make sure all flags are submitted as expected
     checkFlags(mode, commandLineBool, inputDirectory, inputDirectory1, inputDirectory2, outputDirectory, stateInfo, saliency,
-               numProcesses, exitBool, diagnosticBool, numTrials, samplingSize, quiescentState, groupSize, partition)
+               numProcesses, exitBool, diagnosticBool, numTrials, samplingSize, quiescentState, groupSize, partition,
+               numSampledPairs, keepCountsBool, noCacheBool, backgroundFile, numPermutations, noDeltaTextBool)
 
     # Pull info out of the flags
-    mode, outputDirectory, stateInfo, saliency, numProcesses, numTrials, samplingSize, groupSize = \
-        mode[0], outputDirectory[0], stateInfo[0], saliency[0], numProcesses[0], numTrials[0], samplingSize[0], groupSize[0]
+    mode, outputDirectory, stateInfo, saliency, numProcesses, numTrials, samplingSize, groupSize, numSampledPairs = \
+        mode[0], outputDirectory[0], stateInfo[0], saliency[0], numProcesses[0], numTrials[0], samplingSize[0], groupSize[0], \
+        numSampledPairs[0]
+    numPermutations = numPermutations[0]
     diagnosticBool = True if diagnosticBool else False
+    keepCountsBool = True if keepCountsBool else False
+    noCacheBool = True if noCacheBool else False
+    noDeltaTextBool = True if noDeltaTextBool else False
     verbose = False if commandLineBool else True
     numStates = getNumStates(stateInfo)
     # Quiescent value is user input - 1 because states are read in to be -1 from their values
@@ -114,10 +151,13 @@ def main(mode, commandLineBool, inputDirectory, inputDirectory1, inputDirectory2
     outputDirPath = Path(outputDirectory)
     if not PurePath(outputDirPath).is_absolute():
         outputDirPath = Path.cwd() / outputDirPath
+    backgroundPath = Path(backgroundFile[0]) if backgroundFile else Path("null")
+    if backgroundFile and not PurePath(backgroundPath).is_absolute():
+        backgroundPath = Path.cwd() / backgroundPath
 
     # Make sure argments are valid
     checkArguments(mode, saliency, inputDirPath, inputDirPath2, outputDirPath, numProcesses, numStates, quiescentState,
-                   groupSize)
+                   groupSize, numSampledPairs, keepCountsBool, numPermutations)
 
     # Informing user of their inputs
     print()
@@ -128,6 +168,14 @@ def main(mode, commandLineBool, inputDirectory, inputDirectory1, inputDirectory2
         print("Input Directory 2 =", inputDirPath2)
     print("State Model =", numStates)
     print("Saliency level =", saliency)
+    if numSampledPairs > 0:
+        print("Sampled Epigenome Pairs =", numSampledPairs)
+    if keepCountsBool:
+        print("Keep State Counts = True")
+    if noCacheBool:
+        print("Background Frequency Cache = Disabled")
+    if backgroundFile:
+        print("Background Frequencies =", backgroundPath)
     print("Output Directory =", outputDirPath)
     if numProcesses == 0:
         print("Number of Cores = All available", flush=True)
@@ -137,10 +185,17 @@ def main(mode, commandLineBool, inputDirectory, inputDirectory1, inputDirectory2
         print("Quiescent State = No quiescent filtering")
     elif mode == "paired":
         print("Quiescent State =", quiescentState + 1)
+    if numPermutations > 1:
+        print("Null Permutations =", numPermutations)
+    if noDeltaTextBool:
+        print("Score Difference Text Files = Disabled")
 
     # For making sure all files are consistently named
     if mode == "single":
         fileTag = "{}_s{}".format(inputDirPath.name, saliency)
+        # Approximate saliency 3 outputs are kept apart from exact ones
+        if numSampledPairs > 0:
+            fileTag += "_p{}".format(numSampledPairs)
     else:
         fileTag = "{}_{}_s{}".format(inputDirPath.name, inputDirPath2.name, saliency)
 
@@ -175,95 +230,126 @@ def main(mode, commandLineBool, inputDirectory, inputDirectory1, inputDirectory2
             pythonFilesDir = (Path.cwd() / Path(__file__)).parents[1] / "epilogos/"
             print("Path generated from current working directory. May cause errors")
 
-    # Calculate the expected frequency for each file in the input directory
-    expJobIDArr = []
-    print("\nSTEP 1: Per data file background frequency calculation", flush=True)
-    for file in inputDirPath.glob("*"):
+    # Pair each file with its matching file in the second directory (paired epilogos)
+    filePairs = []
+    for file in listInputFiles(inputDirPath):
         if mode == "single":
-            if commandLineBool:
-                # epilogos.expected.expected(file, "null", numStates, saliency, outputDirPath, fileTag, numProcesses, verbose)
-                expected(file, "null", numStates, saliency, outputDirPath, fileTag, numProcesses, verbose)
-            else:
-                computeExpectedPy = pythonFilesDir / "expected.py"
-                pythonCommand = "python {} {} null {} {} {} {} {} {}".format(computeExpectedPy, file, numStates, saliency,
-                                                                             outputDirPath, fileTag, numProcesses, verbose)
-                expJobIDArr.append(submitSlurmJob("_" + file.name.split(".")[0], "exp_calc", fileTag, outputDirPath,
-                                                  pythonCommand, saliency, partition, memory, ""))
+            filePairs.append((file, "null"))
+        elif not list(inputDirPath2.glob(file.name)):
+            raise FileNotFoundError("File not found: {}".format(str(inputDirPath2 / file.name)) +
+                                    "Please ensure corresponding files within input directories directories 1 and 2 have" +
+                                    " the same name")
         else:
-            # Find matching file in other directory
-            if not list(inputDirPath2.glob(file.name)):
-                raise FileNotFoundError("File not found: {}".format(str(inputDirPath2 / file.name)) +
-                                        "Please ensure corresponding files within input directories directories 1 and 2 have" +
-                                        " the same name")
-            else:
-                file2 = next(inputDirPath2.glob(file.name))
+            filePairs.append((file, next(inputDirPath2.glob(file.name))))
+
+    # A supplied background must match the expected frequency array which would have been calculated from the input files
+    if backgroundFile:
+        checkBackground(backgroundPath, saliency, numStates, numSampledPairs, getNumCols(filePairs[0][0]))
+
+    # Background frequencies are cached by the contents of the input files, so a rerun on the same inputs (e.g. with different
+    # scoring or visualization options) can skip steps 1 and 2
+    cachePath = Path("null")
+    if not noCacheBool and not backgroundFile:
+        cacheDirPath = getCacheDir()
+        cachePath = getCachePath(filePairs, mode, saliency, numStates, numSampledPairs, cacheDirPath)
+    cacheHitBool = cachePath.exists()
+    if cacheHitBool:
+        touchCache(cachePath)
+        # There are no state counts to keep if the input files are not read while calculating the background frequencies
+        keepCountsBool = False
+
+    # When running locally, one pool of processes is started up front and reused by every step, and each step works through
+    # the rows of all the files from a single queue of tasks
+    pool = createPool(numProcesses if numProcesses else cpu_count()) if commandLineBool else None
 
-            if commandLineBool:
-                # epilogos.expected.expected(file, file2, numStates, saliency, outputDirPath, fileTag, numProcesses, verbose)
-                expected(file, file2, numStates, saliency, outputDirPath, fileTag, numProcesses, verbose)
+    # Calculate the expected frequency for each file in the input directory
+    expJobIDArr = []
+    print("\nSTEP 1: Per data file background frequency calculation", flush=True)
+    if backgroundFile:
+        print("    Using background frequencies:", backgroundPath, flush=True)
+    elif cacheHitBool:
+        print("    Using cached background frequencies:", cachePath, flush=True)
+    elif commandLineBool:
+        # epilogos.expected.mainGenome(filePairs, numStates, saliency, outputDirPath, fileTag, numProcesses, verbose)
+        expected(filePairs, numStates, saliency, outputDirPath, fileTag, numProcesses, verbose, numSampledPairs, pool,
+                 keepCountsBool)
+    else:
+        computeExpectedPy = pythonFilesDir / "expected.py"
+        for file, file2 in filePairs:
+            if mode == "single":
+                pythonCommand = "python {} {} null {} {} {} {} {} {} {} {}".format(computeExpectedPy, file, numStates,
+                                                                                   saliency, outputDirPath, fileTag,
+                                                                                   numProcesses, verbose, numSampledPairs,
+                                                                                   keepCountsBool)
             else:
-                computeExpectedPy = pythonFilesDir / "expected.py"
-                pythonCommand = "python {} {} {} {} {} {} {} {} {}".format(computeExpectedPy, file, file2, numStates,
-                                                                           saliency, outputDirPath, fileTag, numProcesses,
-                                                                           verbose)
-                expJobIDArr.append(submitSlurmJob("_" + file.name.split(".")[0], "exp_calc", fileTag, outputDirPath,
-                                                  pythonCommand, saliency, partition, memory, ""))
+                pythonCommand = "python {} {} {} {} {} {} {} {} {} 0".format(computeExpectedPy, file, file2, numStates,
+                                                                             saliency, outputDirPath, fileTag, numProcesses,
+                                                                             verbose)
+            expJobIDArr.append(submitSlurmJob("_" + file.name.split(".")[0], "exp_calc", fileTag, outputDirPath,
+                                              pythonCommand, saliency, partition, memory, ""))
 
-    if not commandLineBool:
+    if not commandLineBool and expJobIDArr:
         # Create a string for slurm dependency to work and to print more nicely
         expJobIDStr = str(expJobIDArr).strip('[]').replace(" ", "")
         print("    JobIDs:", expJobIDStr, flush=True)
 
     # Combining all the different chromosome expected frequency arrays into one
     print("\nSTEP 2: Background frequency combination", flush=True)
-    if commandLineBool:
-        expectedCombination(outputDirPath, storedExpPath, fileTag, verbose)
+    combinationJobID = ""
+    if backgroundFile:
+        # The expected frequency array is removed at the end of the run, so the background is linked into the output directory
+        # (or copied if it is on another file system) rather than used in place
+        if storedExpPath.exists():
+            remove(storedExpPath)
+        try:
+            link(backgroundPath, storedExpPath)
+        except OSError:
+            copyfile(backgroundPath, storedExpPath)
+        print("    [Done]", flush=True)
+    elif cacheHitBool:
+        expectedFromCache(cachePath, storedExpPath, verbose)
+    elif commandLineBool:
+        expectedCombination(outputDirPath, storedExpPath, fileTag, verbose, cachePath)
     else:
         computeExpectedCombinationPy = pythonFilesDir / "expectedCombination.py"
-        pythonCommand = "python {} {} {} {} {}".format(computeExpectedCombinationPy, outputDirPath, storedExpPath, fileTag,
-                                                       verbose)
+        pythonCommand = "python {} {} {} {} {} {}".format(computeExpectedCombinationPy, outputDirPath, storedExpPath, fileTag,
+                                                          verbose, cachePath)
         combinationJobID = submitSlurmJob("", "exp_comb", fileTag, outputDirPath, pythonCommand, saliency, partition,
                                           "--ntasks=1 --mem=8000", "--dependency=afterok:{}".format(expJobIDStr))
         print("    JobID:", combinationJobID, flush=True)
 
+    # Evicting only once the cached background frequencies have been used (or stored when running locally)
+    if not noCacheBool and not backgroundFile:
+        evictCache(cacheDirPath)
+
     scoreJobIDArr = []
     # Calculate the observed frequencies and scores
     print("\nSTEP 3: Score calculation", flush=True)
-    for file in inputDirPath.glob("*"):
-        if mode == "single":
-            if commandLineBool:
-                scores(file, "null", numStates, saliency, outputDirPath, storedExpPath, fileTag, numProcesses,
-                       quiescentState, groupSize, verbose)
-            else:
-                computeScorePy = pythonFilesDir / "scores.py"
-                pythonCommand = "python {} {} null {} {} {} {} {} {} {} {} {}".format(computeScorePy, file, numStates,
-                                                                                      saliency, outputDirPath, storedExpPath,
-                                                                                      fileTag, numProcesses, quiescentState,
-                                                                                      groupSize, verbose)
-                scoreJobIDArr.append(submitSlurmJob("_" + file.name.split(".")[0], "score", fileTag, outputDirPath,
-                                                    pythonCommand, saliency, partition, memory,
-                                                    "--dependency=afterok:{}".format(combinationJobID)))
-        else:
-            # Find matching file in other directory
-            if not list(inputDirPath2.glob(file.name)):
-                raise FileNotFoundError("File not found: {}".format(str(inputDirPath2 / file.name)) +
-                                        "Please ensure corresponding files within input directories directories 1 and 2 have" +
-                                        " the same name")
-            else:
-                file2 = next(inputDirPath2.glob(file.name))
-
-            if commandLineBool:
-                scores(file, file2, numStates, saliency, outputDirPath, storedExpPath, fileTag, numProcesses,
-                       quiescentState, groupSize, verbose)
+    if commandLineBool:
+        # In single mode, the scores of each file are read in for greatest hits as soon as they are written
+        scoreFileData = scores(filePairs, numStates, saliency, outputDirPath, storedExpPath, fileTag, numProcesses,
+                               quiescentState, groupSize, verbose, pool, readScoreFile if mode == "single" else None,
+                               keepCountsBool, numPermutations, not noDeltaTextBool)
+    else:
+        computeScorePy = pythonFilesDir / "scores.py"
+        scoreDependency = "--dependency=afterok:{}".format(combinationJobID) if combinationJobID else ""
+        for file, file2 in filePairs:
+            if mode == "single":
+                pythonCommand = "python {} {} null {} {} {} {} {} {} {} {} {} {}".format(computeScorePy, file, numStates,
+                                                                                         saliency, outputDirPath,
+                                                                                         storedExpPath, fileTag, numProcesses,
+                                                                                         quiescentState, groupSize, verbose,
+                                                                                         keepCountsBool)
             else:
-                computeScorePy = pythonFilesDir / "scores.py"
-                pythonCommand = "python {} {} {} {} {} {} {} {} {} {} {} {}".format(computeScorePy, file, file2, numStates,
-                                                                                    saliency, outputDirPath, storedExpPath,
-                                                                                    fileTag, numProcesses, quiescentState,
-                                                                                    groupSize, verbose)
-                scoreJobIDArr.append(submitSlurmJob("_" + file.name.split(".")[0], "score", fileTag, outputDirPath,
-                                                    pythonCommand, saliency, partition, memory,
-                                                    "--dependency=afterok:{}".format(combinationJobID)))
+                pythonCommand = "python {} {} {} {} {} {} {} {} {} {} {} {} False {} {}".format(computeScorePy, file, file2,
+                                                                                               numStates, saliency,
+                                                                                               outputDirPath, storedExpPath,
+                                                                                               fileTag, numProcesses,
+                                                                                               quiescentState, groupSize,
+                                                                                               verbose, numPermutations,
+                                                                                               not noDeltaTextBool)
+            scoreJobIDArr.append(submitSlurmJob("_" + file.name.split(".")[0], "score", fileTag, outputDirPath,
+                                                pythonCommand, saliency, partition, memory, scoreDependency))
 
     if not commandLineBool:
         # Create a string for slurm dependency to work
@@ -274,7 +360,7 @@ def main(mode, commandLineBool, inputDirectory, inputDirectory1, inputDirectory2
         # Create a greatest hits text file
         print("\nSTEP 4: Finding greatest hits", flush=True)
         if commandLineBool:
-            greatestHits(outputDirPath, stateInfo, fileTag, storedExpPath, verbose)
+            greatestHits(outputDirPath, stateInfo, fileTag, storedExpPath, verbose, scoreFileData)
         else:
             computeGreatestHitsPy = pythonFilesDir / "greatestHits.py"
             pythonCommand = "python {} {} {} {} {} {}".format(computeGreatestHitsPy, outputDirPath, stateInfo, fileTag,
@@ -287,7 +373,7 @@ def main(mode, commandLineBool, inputDirectory, inputDirectory1, inputDirectory2
         print("\nSTEP 4: Generating p-values and figures", flush=True)
         if commandLineBool:
             pairwiseVisual(inputDirPath.name, inputDirPath2.name, stateInfo, outputDirPath, fileTag, numProcesses,
-                           diagnosticBool, numTrials, samplingSize, storedExpPath, verbose)
+                           diagnosticBool, numTrials, samplingSize, storedExpPath, verbose, pool)
         else:
             computeVisualPy = pythonFilesDir / "pairwiseVisual.py"
             pythonCommand = "python {} {} {} {} {} {} {} {} {} {} {} {}".format(computeVisualPy, inputDirPath.name,
@@ -299,8 +385,13 @@ def main(mode, commandLineBool, inputDirectory, inputDirectory1, inputDirectory2
                                           "--dependency=afterok:{}".format(scoreJobIDStr))
             print("    JobID:", summaryJobID, flush=True)
 
+    if pool is not None:
+        pool.close()
+        pool.join()
+
     if not commandLineBool:
-        allJobIDs = "{},{},{},{}".format(expJobIDStr, combinationJobID, scoreJobIDStr, summaryJobID)
+        allJobIDs = ",".join(str(jobIDs) for jobIDs in (expJobIDStr if expJobIDArr else "", combinationJobID, scoreJobIDStr,
+                                                        summaryJobID) if jobIDs)
         print("\nAll JobIDs:\n    ", allJobIDs, flush=True)
 
     # If the user wants to exit upon job completion rather than submission
@@ -309,8 +400,80 @@ def main(mode, commandLineBool, inputDirectory, inputDirectory1, inputDirectory2
         checkExit(mode, allJobIDs, expJobIDArr, scoreJobIDArr, outputDirPath, saliency)
 
 
+@main.command("convert", context_settings=dict(help_option_names=['-h', '--help']))
+@click.option("-i", "--input-directory", "inputDirectory", type=str, required=True,
+              help="Path to directory that contains the tab separated state matrices to convert")
+@click.option("-o", "--output-directory", "outputDirectory", type=str, required=True,
+              help="Path to directory to write the binary state matrices to (can then be used as an epilogos input directory)")
+@click.option("-m", "--metadata", "metadataFile", type=str, default="null",
+              help="Biosample metadata file. If given, the input directory is read as per biosample, per chromosome " +
+                   "ChromHMM statebyline files (biosample names in the first column give the column order)")
+@click.option("--bin-size", "binSize", type=int, default=200, show_default=True,
+              help="The size of each ChromHMM bin in base pairs (only used with -m)")
+@click.option("-c", "--num-cores", "numProcesses", type=int, default=0,
+              help="The number of cores to run on [default: 0 = Uses all cores]")
+@click.option("-v", "--verbose", "verbose", is_flag=True, help="If flag is enabled, prints more detailed progress updates")
+def convertCommand(inputDirectory, outputDirectory, metadataFile, binSize, numProcesses, verbose):
+    """
+    Convert tab separated state matrices (or ChromHMM statebyline files) into binary state matrices.
+
+    Binary state matrices store each chromosome's states once as unsigned 8 bit integers alongside a small header, so that
+    epilogos can memory map the rows it needs rather than decompressing and parsing text on every run.
+    """
+    print("\nConverting state matrices", flush=True)
+    convert(inputDirectory, outputDirectory, numProcesses, verbose, metadataFile, binSize)
+
+
+@main.command("expected", context_settings=dict(help_option_names=['-h', '--help']))
+@click.option("-i", "--input-directory", "inputDirectory", type=str, required=True,
+              help="Path to directory that contains files to read from (all files in this directory will be read in)")
+@click.option("-n", "--state-info", "stateInfo", type=str, required=True, help="State model info file")
+@click.option("-s", "--saliency", "saliency", type=click.IntRange(1, 3), default=1, show_default=True,
+              help="Desired saliency level (1, 2, or 3)")
+@click.option("-o", "--output-directory", "outputDirectory", type=str, required=True,
+              help="Path to directory to store the counts and expected frequencies in")
+@click.option("-u", "--update", "update", is_flag=True,
+              help="If flag is enabled, the stored counts are updated by counting only the files and epigenomes which were " +
+                   "added since they were calculated")
+@click.option("-c", "--num-cores", "numProcesses", type=int, default=0,
+              help="The number of cores to run on [default: 0 = Uses all cores]")
+@click.option("-v", "--verbose", "verbose", is_flag=True, help="If flag is enabled, prints more detailed progress updates")
+def expectedCommand(inputDirectory, stateInfo, saliency, outputDirectory, numProcesses, update, verbose):
+    """
+    Calculate (or update) the expected frequencies of a directory of state matrices.
+
+    The raw counts of each file are kept, so that once files are added or epigenomes are appended to the files, running with
+    --update counts only what was added rather than the whole directory again.
+    """
+    print("\n{} expected frequencies".format("Updating" if update else "Calculating"), flush=True)
+    expectedUpdate(inputDirectory, stateInfo, saliency, outputDirectory, numProcesses, update, verbose)
+
+
+@main.command("validate-s3", context_settings=dict(help_option_names=['-h', '--help']))
+@click.option("-i", "--input-file", "inputFile", type=str, required=True,
+              help="State matrix to validate on (a small chromosome keeps exact saliency 3 quick)")
+@click.option("-n", "--state-info", "stateInfo", type=str, required=True, help="State model info file")
+@click.option("-r", "--sampled-pairs", "numSampledPairs", type=int, required=True,
+              help="The number of epigenome pairs sampled for approximate saliency 3")
+@click.option("-o", "--output-directory", "outputDirectory", type=str, required=True,
+              help="Path to directory to write the validation report to")
+@click.option("-c", "--num-cores", "numProcesses", type=int, default=0,
+              help="The number of cores to run on [default: 0 = Uses all cores]")
+@click.option("-v", "--verbose", "verbose", is_flag=True, help="If flag is enabled, prints more detailed progress updates")
+def validateCommand(inputFile, stateInfo, numSampledPairs, outputDirectory, numProcesses, verbose):
+    """
+    Measure the error of approximate saliency 3 against exact saliency 3.
+
+    Both are run on the input file, and the error of the approximate scores is reported along with how often the bin totals
+    fall within two of the reported standard errors of the exact totals.
+    """
+    print("\nValidating approximate saliency 3", flush=True)
+    validate(inputFile, stateInfo, numSampledPairs, outputDirectory, numProcesses, verbose)
+
+
 def checkFlags(mode, commandLineBool, inputDirectory, inputDirectory1, inputDirectory2, outputDirectory, stateInfo, saliency,
-               numProcesses, exitBool, diagnosticBool, numTrials, samplingSize, quiescentState, groupSize, partition):
+               numProcesses, exitBool, diagnosticBool, numTrials, samplingSize, quiescentState, groupSize, partition,
+               numSampledPairs, keepCountsBool, noCacheBool, backgroundFile, numPermutations, noDeltaTextBool):
     """
     Checks all the input flags are makes sure that there are not duplicates, required flags are present, and incompatible flags
     are not present together
@@ -351,6 +514,21 @@ def checkFlags(mode, commandLineBool, inputDirectory, inputDirectory1, inputDire
     elif mode[0] == "paired" and inputDirectory:
         print("ERROR: [-m, --mode] 'paired' not compatible with [-i, --input-directory] option")
         sys.exit()
+    elif mode[0] == "paired" and numSampledPairs[0] != 0:
+        print("ERROR: [-m, --mode] 'paired' not compatible with [-r, --sampled-pairs] option")
+        sys.exit()
+    elif mode[0] == "paired" and keepCountsBool:
+        print("ERROR: [-m, --mode] 'paired' not compatible with [-k, --keep-counts] flag")
+        sys.exit()
+    elif mode[0] == "single" and numPermutations[0] != 1:
+        print("ERROR: [-m, --mode] 'single' not compatible with [--num-permutations] option")
+        sys.exit()
+    elif mode[0] == "single" and noDeltaTextBool:
+        print("ERROR: [-m, --mode] 'single' not compatible with [--no-delta-text] flag")
+        sys.exit()
+    elif keepCountsBool and backgroundFile:
+        print("ERROR: [-k, --keep-counts] flag not compatible with [--background] option")
+        sys.exit()
     elif commandLineBool and exitBool:
         print("ERROR: [-l, --cli] flag not compatible with [-x, --exit] flag")
         sys.exit()
@@ -407,10 +585,28 @@ def checkFlags(mode, commandLineBool, inputDirectory, inputDirectory1, inputDire
     elif len(partition) > 1:
         print("ERROR: Too many [-p, --partition] arguments provided")
         sys.exit()
+    elif len(numSampledPairs) > 1:
+        print("ERROR: Too many [-r, --sampled-pairs] arguments provided")
+        sys.exit()
+    elif len(keepCountsBool) > 1:
+        print("ERROR: Too many [-k, --keep-counts] arguments provided")
+        sys.exit()
+    elif len(noCacheBool) > 1:
+        print("ERROR: Too many [--no-cache] arguments provided")
+        sys.exit()
+    elif len(backgroundFile) > 1:
+        print("ERROR: Too many [--background] arguments provided")
+        sys.exit()
+    elif len(numPermutations) > 1:
+        print("ERROR: Too many [--num-permutations] arguments provided")
+        sys.exit()
+    elif len(noDeltaTextBool) > 1:
+        print("ERROR: Too many [--no-delta-text] arguments provided")
+        sys.exit()
 
 
 def checkArguments(mode, saliency, inputDirPath, inputDirPath2, outputDirPath, numProcesses, numStates, quiescentState,
-                   groupSize):
+                   groupSize, numSampledPairs, keepCountsBool, numPermutations):
     """
     Checks whether user submitted arguments have valid values
 
@@ -424,6 +620,9 @@ def checkArguments(mode, saliency, inputDirPath, inputDirPath2, outputDirPath, n
     numStates -- The number of states in the state model
     quiescentState -- The state used to filter out quiescent bins
     groupSize -- The size of the null (shuffled) score arrays, -1 means inputed sizes
+    numSampledPairs -- The number of epigenome pairs sampled for approximate saliency 3, 0 means exact saliency 3
+    keepCountsBool -- Whether the state counts of each bin are kept between the background frequency and score calculations
+    numPermutations -- The number of shuffles of each pair of files the null distances are calculated for
     """
     # Check validity of saliency
     if mode == "single" and saliency != 1 and saliency != 2 and saliency != 3:
@@ -440,14 +639,14 @@ def checkArguments(mode, saliency, inputDirPath, inputDirPath2, outputDirPath, n
         raise FileNotFoundError("Given path does not exist: {}".format(str(inputDirPath)))
     if not inputDirPath.is_dir():
         raise NotADirectoryError("Given path is not a directory: {}".format(str(inputDirPath)))
-    if not list(inputDirPath.glob("*")):
+    if not list(listInputFiles(inputDirPath)):
         raise OSError(errno.ENOTEMPTY, "Ensure given directory is not empty:", str(inputDirPath))
     if mode == "paired":
         if not inputDirPath2.exists():
             raise FileNotFoundError("Given path does not exist: {}".format(str(inputDirPath2)))
         if not inputDirPath2.is_dir():
             raise NotADirectoryError("Given path is not a directory: {}".format(str(inputDirPath2)))
-        if not list(inputDirPath2.glob("*")):
+        if not list(listInputFiles(inputDirPath2)):
             raise OSError(errno.ENOTEMPTY, "Ensure given directory is not empty:", str(inputDirPath2))
     if not outputDirPath.exists():
         outputDirPath.mkdir(parents=True)
@@ -469,6 +668,62 @@ def checkArguments(mode, saliency, inputDirPath, inputDirPath2, outputDirPath, n
         print("ERROR: Group size value must be positive or -1 (-1 means use inputted group sizes)")
         sys.exit()
 
+    if numSampledPairs < 0:
+        print("ERROR: Number of sampled pairs must be positive or zero (0 means exact saliency 3)")
+        sys.exit()
+    elif numSampledPairs > 0 and saliency != 3:
+        print("ERROR: [-r, --sampled-pairs] is only supported with a saliency of 3")
+        sys.exit()
+
+    if keepCountsBool and saliency == 3:
+        print("ERROR: [-k, --keep-counts] is only supported with a saliency of 1 or 2")
+        sys.exit()
+
+    if numPermutations < 1:
+        print("ERROR: Number of permutations must be at least 1")
+        sys.exit()
+
+
+def checkBackground(backgroundPath, saliency, numStates, numSampledPairs, numCols):
+    """
+    Checks whether a user supplied background is an expected frequency array which can be used to score the input files
+
+    Input:
+    backgroundPath -- The path to the supplied expected frequency array
+    saliency -- The saliency metric input by the user
+    numStates -- The number of states in the state model
+    numSampledPairs -- The number of epigenome pairs sampled for approximate saliency 3, 0 means exact saliency 3
+    numCols -- The number of epigenomes in the input files (saliency 3 expected frequencies are per pair of epigenomes)
+    """
+    if not backgroundPath.exists():
+        print("ERROR: Background file not found: {}".format(backgroundPath))
+        sys.exit()
+
+    try:
+        backgroundArr = np.load(backgroundPath, mmap_mode="r", allow_pickle=False)
+    except ValueError:
+        print("ERROR: Background file is not a numpy array: {}".format(backgroundPath))
+        sys.exit()
+
+    if saliency == 1:
+        expectedShape = (numStates,)
+    elif saliency == 2:
+        expectedShape = (numStates, numStates)
+    else:
+        expectedShape = (len(getEpigenomePairs(numCols, numSampledPairs)[0]), numStates, numStates)
+
+    if backgroundArr.shape != expectedShape:
+        print("ERROR: Background shape {} does not match saliency {} with {} states".format(backgroundArr.shape, saliency,
+                                                                                            numStates) +
+              (" and {} epigenomes".format(numCols) if saliency == 3 else "") +
+              " (expected shape {})".format(expectedShape))
+        sys.exit()
+    elif not np.issubdtype(backgroundArr.dtype, np.floating) or not np.isclose(backgroundArr.sum(dtype=np.float64), 1,
+                                                                               atol=1e-3):
+        print("ERROR: Background is not a normalized expected frequency array (e.g. exp_freq_*.npy from 'epilogos " +
+              "expected'): {}".format(backgroundPath))
+        sys.exit()
+
 
 def submitSlurmJob(filename, jobPrefix, fileTag, outputDirPath, pythonCommand, saliency, partition, memory, dependency):
     """
@@ -530,7 +785,7 @@ def checkExit(mode, allJobIDs, expJobIDArr, scoreJobIDArr, outputDirPath, salien
     Input:
     mode -- 'single' or 'paired' depending on which version of epilogos we are running
     allJobIDs -- String of all the SLURM job IDs
-    expJobIDArr -- List of the SLURM job IDs for the expected frequency step
+    expJobIDArr -- List of the SLURM job IDs for the expected frequency step (empty if the background frequencies were cached)
     scoreJobIDArr -- List of the SLURM job IDs for the score calculation step
     outputDirPath -- Epilogos' output directory
     saliency -- The saliency metric epilogos is using
@@ -540,6 +795,8 @@ def checkExit(mode, allJobIDs, expJobIDArr, scoreJobIDArr, outputDirPath, salien
 
     completedJobs = []
     calculationStep = ""
+    # With cached background frequencies there are neither expected frequency nor combination jobs
+    numExpJobs = len(expJobIDArr) + 1 if expJobIDArr else 0
 
     # Every x seconds check what jobs are done and print accordingly
     while True:
@@ -548,7 +805,10 @@ def checkExit(mode, allJobIDs, expJobIDArr, scoreJobIDArr, outputDirPath, salien
         spLines = sp.stdout.split("\n")
 
         # Printing separate step headers
-        if len(completedJobs) == 0 and calculationStep == "":
+        if len(completedJobs) == 0 and calculationStep == "" and numExpJobs == 0:
+            print("\n Step 3: Score calculation\n{}\n{}\n{}".format("-" * 80, spLines[0], spLines[1]), flush=True)
+            calculationStep = "score"
+        elif len(completedJobs) == 0 and calculationStep == "":
             print("\n Step 1: Per data file background frequency calculation\n{}\n{}\n{}"
                   .format("-" * 80, spLines[0], spLines[1]), flush=True)
             calculationStep = "exp_calc"
@@ -556,14 +816,14 @@ def checkExit(mode, allJobIDs, expJobIDArr, scoreJobIDArr, outputDirPath, salien
             print("\n Step 2: Background frequency combination\n{}\n{}\n{}"
                   .format("-" * 80, spLines[0], spLines[1]), flush=True)
             calculationStep = "exp_comb"
-        elif len(completedJobs) >= (len(expJobIDArr) + 1) and calculationStep == "exp_comb":
+        elif len(completedJobs) >= numExpJobs and calculationStep == "exp_comb":
             print("\n Step 3: Score calculation\n{}\n{}\n{}".format("-" * 80, spLines[0], spLines[1]), flush=True)
             calculationStep = "score"
-        elif mode == "single" and len(completedJobs) >= (len(expJobIDArr) + 1 + len(scoreJobIDArr)) \
+        elif mode == "single" and len(completedJobs) >= (numExpJobs + len(scoreJobIDArr)) \
                               and calculationStep == "score":
             print("\n Step 4: Finding greatest hits\n{}\n{}\n{}".format("-" * 80, spLines[0], spLines[1]), flush=True)
             calculationStep = "hits"
-        elif mode == "paired" and len(completedJobs) >= (len(expJobIDArr) + 1 + len(scoreJobIDArr)) \
+        elif mode == "paired" and len(completedJobs) >= (numExpJobs + len(scoreJobIDArr)) \
                               and calculationStep == "score":
             print("\n Step 4: Generating p-values and figures\n{}\n{}\n{}"
                   .format("-" * 80, spLines[0], spLines[1]), flush=True)
@@ -1,19 +1,32 @@
 import numpy as np
 from sys import argv
 from pathlib import Path
-import pandas as pd
 from time import time
 import numpy.ma as ma
-from multiprocessing import cpu_count, Pool, RawArray
-from itertools import repeat, permutations
-from contextlib import closing
-from epilogos.helpers import strToBool, splitRows, readStates
+from os import remove
+from multiprocessing import cpu_count
+from epilogos.helpers import strToBool, readStateBlocks, readCountBlocks, getNumRows, getNumCols, getLocationInfo, \
+    countStates, printBlockProgress, getEpigenomePairs, splitTasks, batchFiles, describeBatch, createSharedStates, \
+    attachSharedStates, parseTasks, parseDependencies, freeSharedStates, createSharedArray, sharedArrayView, stagePool, \
+    runTasks
 import gzip
 
+# The maximum number of elements in a precalculated saliency 2 score table (see klTableS2())
+klTableMaxSize = 2 ** 22
+# The maximum number of elements in the saliency 2 pair score arrays calculated at once (see blockScoresS2())
+klChunkMaxSize = 2 ** 20
+# The maximum number of row/pair scores gathered at once for saliency 3 (see blockScoresS3())
+s3ChunkMaxSize = 2 ** 16
+# The maximum number of row/epigenome combinations in a panel of rows scored together for saliency 3 (see blockScoresS3())
+s3PanelMaxSize = 2 ** 24
+# The maximum size of the saliency 3 expected frequencies for which the score tiles are kept between blocks
+s3TileCacheMaxSize = 2 ** 24
 
-def main(file1, file2, numStates, saliency, outputDir, expFreqPath, fileTag, numProcesses, quiescentState, groupSize, verbose):
+
+def main(file1, file2, numStates, saliency, outputDir, expFreqPath, fileTag, numProcesses, quiescentState, groupSize, verbose,
+         pool=None, keepCounts=False, numPermutations=1, deltaText=True):
     """
-    Wrapper function which prepares inputs for the score calculation
+    Wrapper function which prepares inputs for the score calculation of a single file (or pair of files)
 
     Input:
     file1 -- The path of the only (single epilogos) or first (paired epilogos) file to read states from
@@ -27,32 +40,77 @@ def main(file1, file2, numStates, saliency, outputDir, expFreqPath, fileTag, num
     quiescentState -- The state used to filter out quiescent bins
     groupSize -- Size of the outputted null array
     verbose -- Boolean which if True, causes much more detailed prints
+    pool -- The multiprocessing pool to run on (see helpers.createPool()), if None a pool is created for this file
+    keepCounts -- If True, the file is scored from the state counts kept by the expected frequency calculation
+    numPermutations -- The number of shuffles of the pair of files to calculate null distances for (paired epilogos)
+    deltaText -- If True, the differences between the scores of the pair of files are written out to a gzipped text file
+                 (paired epilogos)
     """
-    if verbose: tTotal = time()
+    mainGenome([(file1, file2)], numStates, saliency, outputDir, expFreqPath, fileTag, numProcesses, quiescentState, groupSize,
+               verbose, pool, keepCounts=keepCounts, numPermutations=numPermutations, deltaText=deltaText)
 
-    file1Path = Path(file1)
-    file2Path = Path(file2)
-    outputDirPath = Path(outputDir)
 
-    filename = file1Path.name.split(".")[0]
+def mainGenome(filePairs, numStates, saliency, outputDir, expFreqPath, fileTag, numProcesses, quiescentState, groupSize,
+               verbose, pool=None, onFileScored=None, keepCounts=False, numPermutations=1, deltaText=True):
+    """
+    Wrapper function which prepares inputs for the score calculation of many files at once. The rows of all the files are
+    split into small tasks which share one work queue (see helpers.runTasks()), and the scores of each file are written out
+    by the processes while the next files are scored
+
+    Input:
+    filePairs -- List of tuples of the paths of the only (single epilogos) or first (paired epilogos) file and of the second
+                 file (paired epilogos, "null" otherwise) to read states from
+    numStates -- The number of states in the state model
+    saliency -- The saliency metric being used in the epilogos run
+    outputDir -- The path of the output directory
+    expFreqPath -- The path of the expected frequency array
+    fileTag -- A string which helps ensure outputed files are named similarly within an epilogos run
+    numProcesses -- The number of cores to run on
+    quiescentState -- The state used to filter out quiescent bins
+    groupSize -- Size of the outputted null array
+    verbose -- Boolean which if True, causes much more detailed prints
+    pool -- The multiprocessing pool to run on (see helpers.createPool()), if None a pool is created for each batch of files
+    onFileScored -- Function called with the path of the temporary scores of each file as soon as they are written (single
+                    epilogos only), e.g. to read them in for greatest hits while the next files are scored
+    keepCounts -- If True, the files are scored from the state counts kept by the expected frequency calculation (single
+                  epilogos saliency 1 and 2)
+    numPermutations -- The number of shuffles of each pair of files to calculate null distances for (paired epilogos)
+    deltaText -- If True, the differences between the scores of each pair of files are written out to gzipped text files
+                 (paired epilogos)
 
-    if not verbose: print("    {}\t".format(filename), end="", flush=True)
+    Output:
+    List of the results of onFileScored for each file (empty if onFileScored is None)
+    """
+    if verbose: tTotal = time()
+
+    filePairs = [(Path(file1), Path(file2)) for file1, file2 in filePairs]
+    outputDirPath = Path(outputDir)
+    fileScoredResults = []
 
     # If user doesn't want to choose number of cores use as many as available
     if numProcesses == 0:
         numProcesses = cpu_count()
 
-    # Determine which rows to assign to each core
-    rowList = splitRows(file1Path, numProcesses)
+    # Files are worked on in batches whose text inputs fit in shared memory together
+    dataFilePathsList = [[file1Path] if str(file2Path) == "null" else [file1Path, file2Path]
+                         for file1Path, file2Path in filePairs]
+    for batch in batchFiles(dataFilePathsList, numStates):
+        batchFilePairs = [filePairs[i] for i in batch]
+        if not verbose: print("    {}\t".format(describeBatch(batchFilePairs)), end="", flush=True)
+
+        if str(batchFilePairs[0][1]) == "null":
+            fileScoredResults += calculateScores(saliency, [file1Path for file1Path, _ in batchFilePairs], numStates,
+                                                 outputDirPath, expFreqPath, fileTag, numProcesses, verbose, pool,
+                                                 onFileScored, keepCounts)
+        else:
+            calculateScoresPairwise(saliency, batchFilePairs, numStates, outputDirPath, expFreqPath, fileTag, numProcesses,
+                                    quiescentState, groupSize, verbose, pool, numPermutations, deltaText)
 
-    if file2 == "null":
-        calculateScores(saliency, file1Path, rowList, numStates, outputDirPath, expFreqPath, fileTag, filename, numProcesses,
-                        verbose)
-    else:
-        calculateScoresPairwise(saliency, file1Path, file2Path, rowList, numStates, outputDirPath, expFreqPath, fileTag,
-                                filename, numProcesses, quiescentState, groupSize, verbose)
+        if not verbose: print("\t[Done]", flush=True)
 
-    print("Total Time:", time() - tTotal, flush=True) if verbose else print("\t[Done]", flush=True)
+    if verbose: print("Total Time:", time() - tTotal, flush=True)
+
+    return fileScoredResults
 
 
 def sharedToNumpy(sharedArr, numRows, numStates):
@@ -60,197 +118,419 @@ def sharedToNumpy(sharedArr, numRows, numStates):
     Helper for unflattening a shared array into a 2d numpy array
 
     Input:
-    sharedArr -- The shared array to shape
+    sharedArr -- The description of the shared array to shape (see helpers.createSharedArray())
     numRows -- The number of rows for the numpy array
     numStates -- The number of columns for the numpy array
     """
-    return np.frombuffer(sharedArr, dtype=np.float32).reshape((numRows, numStates))
+    return sharedArrayView(sharedArr).reshape((numRows, numStates))
 
 
-def _init(sharedArr_, expFreqPath_, verbose_):
+def _init(sharedArr_, sharedStatesInfo_, expFreqPath_, verbose_, sharedErrorArr_=None, countsPath_=None):
     """
-    Initializes global variables for multiprocessing in the single epilogos case
+    Initializes global variables for multiprocessing in the single epilogos case. Processes are initialized for the tasks of
+    each file in turn (see helpers.runTasks())
 
     Input:
     sharedArr_ -- A tuple containing relevant information about the shared score array
+    sharedStatesInfo_ -- List of tuples describing the shared state matrices (see helpers.createSharedStates())
     expFreqPath_ -- A pathlib path to the expected frequency array
     verbose_ -- A boolean which tells us the amount we need to print
+    sharedErrorArr_ -- The shared standard error array of approximate saliency 3 (None if the scores are exact)
+    countsPath_ -- The path of the state counts kept by the expected frequency calculation (None if the states are read)
     """
     global sharedArr
+    global sharedErrorArr
+    global countsPath
     global expFreqPath
     global verbose
+    global klTables
+    global scoreTiles
 
     sharedArr = sharedArr_
+    sharedErrorArr = sharedErrorArr_
+    countsPath = countsPath_
     expFreqPath = expFreqPath_
     verbose = verbose_
+    # Score tables (and saliency 3 score tiles) are kept between the tasks of a file
+    klTables = {}
+    scoreTiles = {}
+
+    attachSharedStates(sharedStatesInfo_)
 
 
-def _initPairwise(sharedArr1_, sharedArr2_, shuffledSharedArr1_, shuffledSharedArr2_, quiescenceSharedArr_, totalRows,
-                  numStates, quiescentState_, expFreqPath_, groupSize_, verbose_):
+def _initPairwise(diffSharedArr_, nullDistanceSharedArr_, quiescenceSharedArr_, sharedStatesInfo_, totalRows, numStates,
+                  quiescentState_, expFreqPath_, groupSize_, numPermutations_, verbose_):
     """
-    Initializes global variables for multiprocessing in the paired epilogos case
+    Initializes global variables for multiprocessing in the paired epilogos case. Processes are initialized for the tasks of
+    each pair of files in turn (see helpers.runTasks())
 
     Input:
-    sharedArr1_ -- The first shared score array
-    sharedArr2_ -- The second shared score array
-    shuffledSharedArr1_ -- The first shared null score array
-    shuffledSharedArr2_ -- The second shared null score array
-    quiescenceSharedArr_ -- Shared array containing T/F values for whether a bin is quiescent
+    diffSharedArr_ -- The shared array of the differences between the scores of the first and second files
+    nullDistanceSharedArr_ -- The shared array of the null distances of each permutation (see calculateScoresPairwise())
+    quiescenceSharedArr_ -- Shared array containing T/F values for whether a bin is quiescent (see helpers.createSharedArray())
+    sharedStatesInfo_ -- List of tuples describing the shared state matrices (see helpers.createSharedStates())
     totalRows -- The number of rows of the input files
     numStates -- The number of states in the state model
     quiescentState_ -- The state used to filter out quiescent bins
     expFreqPath_ -- A pathlib path to the expected frequency array
     groupSize_ -- Size of outputed null array
+    numPermutations_ -- The number of shuffles to calculate null distances for
     verbose_ -- A boolean which tells us the amount we need to print
     """
-    global sharedArr1
-    global sharedArr2
-    global shuffledSharedArr1
-    global shuffledSharedArr2
+    global diffSharedArr
+    global nullDistanceSharedArr
     global quiescenceSharedArr
     global quiescentState
     global expFreqPath
     global verbose
     global groupSize
+    global numPermutations
+    global klTables
 
-    sharedArr1 = (sharedArr1_, totalRows, numStates)
-    sharedArr2 = (sharedArr2_, totalRows, numStates)
-    shuffledSharedArr1 = (shuffledSharedArr1_, totalRows, numStates)
-    shuffledSharedArr2 = (shuffledSharedArr2_, totalRows, numStates)
+    diffSharedArr = (diffSharedArr_, totalRows, numStates)
+    nullDistanceSharedArr = (nullDistanceSharedArr_, numPermutations_, totalRows)
     quiescenceSharedArr = quiescenceSharedArr_
     quiescentState = quiescentState_
     expFreqPath = expFreqPath_
     verbose = verbose_
     groupSize = groupSize_
+    numPermutations = numPermutations_
+    # Score tables are kept between the tasks of a pair of files
+    klTables = {}
+
+    attachSharedStates(sharedStatesInfo_)
 
 
-def calculateScores(saliency, file1Path, rowList, numStates, outputDirPath, expFreqPath, fileTag, filename, numProcesses,
-                    verbose):
+def calculateScores(saliency, filePaths, numStates, outputDirPath, expFreqPath, fileTag, numProcesses, verbose, pool=None,
+                    onFileScored=None, keepCounts=False):
     """
     Function responsible for deploying the processes used to calculate the scores in the single epilogos case
 
     Input:
     saliency -- The saliency metric being used in the epilogos run
-    file1Path -- The path of the only file to read states from
-    rowList -- A list of tuples which contain the first and last rows for each core to use
+    filePaths -- List of the paths of the files to read states from
     numStates -- The number of states in the state model
     outputDirPath -- The path of the output directory
     expFreqPath -- The path to the expected frequency array
     fileTag -- A string which helps ensure outputed files are named similarly within an epilogos run
-    filename -- The name of the file for which we are calculating the expected frequencies
     numProcesses -- The number of cores to run on
     verbose -- Boolean which if True, causes much more detailed prints
+    pool -- The multiprocessing pool to run on (see helpers.createPool()), if None a pool is created for these files
+    onFileScored -- Function called with the path of the temporary scores of each file as soon as they are written
+    keepCounts -- If True, the files are scored from the state counts kept by the expected frequency calculation (see
+                  expected.calculateExpected()) rather than from their states, which are then not read at all
+
+    Output:
+    List of the results of onFileScored for each file (empty if onFileScored is None)
     """
 
     if verbose: print("\nNumber of Processes:", numProcesses, flush=True)
 
-    totalRows = rowList[-1][-1]
+    totalRowsList = [getNumRows(file1Path) for file1Path in filePaths]
+    countsPaths = [outputDirPath / "temp_counts_{}_{}.npy".format(fileTag, file1Path.name.split(".")[0]) if keepCounts
+                   else None for file1Path in filePaths]
 
-    # Shared arrays across the multiple processes for the scores
+    # Shared arrays across the multiple processes for the scores of each file
     # We avoid race conditions by writing to separate parts of the array in each process
-    sharedArr = RawArray(np.ctypeslib.as_ctypes_type(np.float32), totalRows * numStates)
+    scoreBlocks, sharedArrs, sharedErrorArrs = [], [], []
+    for file1Path, totalRows in zip(filePaths, totalRowsList):
+        scoreBlock, sharedArr = createSharedArray((totalRows * numStates,), np.float32)
+        scoreBlocks.append(scoreBlock)
+        sharedArrs.append(sharedArr)
+
+        # Approximate saliency 3 (expected frequencies for only a sample of the epigenome pairs) also reports a standard error
+        sharedErrorArr = None
+        if saliency == 3:
+            numCols = getNumCols(file1Path)
+            if np.load(expFreqPath, mmap_mode="r", allow_pickle=False).shape[0] < numCols * (numCols - 1) // 2:
+                errorBlock, sharedErrorArr = createSharedArray((totalRows,), np.float32)
+                scoreBlocks.append(errorBlock)
+        sharedErrorArrs.append(sharedErrorArr)
+
+    try:
+        # Shared memory for the parsed states, so that each file is parsed once and viewed by all processes (the states are not
+        # needed when the files are scored from their kept state counts)
+        sharedBlocks, sharedStatesInfo = [], []
+        if not keepCounts:
+            for file1Path, totalRows in zip(filePaths, totalRowsList):
+                fileSharedBlocks, fileSharedStatesInfo = createSharedStates([file1Path], totalRows, numStates)
+                sharedBlocks += fileSharedBlocks
+                sharedStatesInfo += fileSharedStatesInfo
 
-    # Start the processes
-    with closing(Pool(numProcesses, initializer=_init,
-                      initargs=((sharedArr, totalRows, numStates), expFreqPath, verbose))) as pool:
         if saliency == 1:
-            pool.starmap(s1Score, zip(repeat(file1Path), repeat(Path("null")), rowList))
+            scoreFunc = s1Score
         elif saliency == 2:
-            pool.starmap(s2Score, zip(repeat(file1Path), repeat(Path("null")), rowList))
+            scoreFunc = s2Score
+        elif saliency == 3 and keepCounts:
+            raise ValueError("State counts can only be kept for a saliency metric of 1 or 2")
         elif saliency == 3:
-            pool.starmap(s3Score, zip(repeat(file1Path), rowList))
+            scoreFunc = s3Score
         else:
             raise ValueError("Please ensure that saliency metric is either 1, 2, or 3")
-    pool.join()
 
-    chrName = pd.read_table(file1Path, nrows=1, header=None, sep="\t").iloc[0, 0]
-    locationArr = np.array([[chrName, 200*i, 200*i+200] for i in range(totalRows)])
+        # The text inputs are parsed by the first tasks, each scoring task waits only on the parsing of the rows it reads, and
+        # the scores of each file are written as soon as the file is scored
+        tasks, parseTaskRows = parseTasks(sharedStatesInfo, numStates, numProcesses)
+        dependencies = {}
+        scoreTaskIndices = [[] for _ in filePaths]
+        for fileIndex, rowsToCalc in splitTasks(totalRowsList, numProcesses):
+            dependencies[len(tasks)] = parseDependencies(parseTaskRows, [filePaths[fileIndex]], rowsToCalc)
+            scoreTaskIndices[fileIndex].append(len(tasks))
+            scoreArgs = (filePaths[fileIndex], rowsToCalc) if saliency == 3 else (filePaths[fileIndex], Path("null"),
+                                                                                  rowsToCalc)
+            tasks.append((fileIndex, _init, ((sharedArrs[fileIndex], totalRowsList[fileIndex], numStates), sharedStatesInfo,
+                                             expFreqPath, verbose, sharedErrorArrs[fileIndex], countsPaths[fileIndex]),
+                          scoreFunc, scoreArgs))
+        writeStart = len(tasks)
+        for file1Path, totalRows, sharedArr, sharedErrorArr, fileScoreTaskIndices \
+                in zip(filePaths, totalRowsList, sharedArrs, sharedErrorArrs, scoreTaskIndices):
+            dependencies[len(tasks)] = fileScoreTaskIndices
+            tasks.append((None, None, (), writeSharedScores, (file1Path, sharedArr, sharedErrorArr, totalRows, numStates,
+                                                               outputDirPath, fileTag)))
+        callbacks = {} if onFileScored is None else dict.fromkeys(range(writeStart, len(tasks)), onFileScored)
+
+        try:
+            with stagePool(pool, numProcesses) as pool:
+                results = runTasks(pool, tasks, numProcesses, verbose, dependencies, callbacks)
+        finally:
+            freeSharedStates(sharedBlocks)
+
+        if verbose and saliency != 1: printHitRate([results[taskIndex] for fileScoreTaskIndices in scoreTaskIndices
+                                                    for taskIndex in fileScoreTaskIndices])
+    finally:
+        freeSharedStates(scoreBlocks)
+
+    # The kept state counts are only needed until the files are scored
+    for fileCountsPath in countsPaths:
+        if fileCountsPath is not None:
+            remove(fileCountsPath)
+
+    return [] if onFileScored is None else results[writeStart:]
+
+
+def writeSharedScores(file1Path, sharedArr, sharedErrorArr, totalRows, numStates, outputDirPath, fileTag):
+    """
+    Writes the scores of a file in the single epilogos case from the shared score arrays (see writeFileScores()). Run by the
+    processes as soon as the file is scored, while the next files are scored
+
+    Input:
+    file1Path -- The path of the file the scores were calculated from
+    sharedArr -- The shared score array of the file (see helpers.createSharedArray())
+    sharedErrorArr -- The shared standard error array of the file (None if the scores are exact)
+    totalRows -- The number of rows of the file
+    numStates -- The number of states in the state model
+    outputDirPath -- The path of the output directory
+    fileTag -- A string which helps ensure outputed files are named similarly within an epilogos run
+
+    Output:
+    The path of the temporary scores used by greatest hits
+    """
+    return writeFileScores(file1Path, sharedToNumpy(sharedArr, totalRows, numStates),
+                           sharedToNumpy(sharedErrorArr, totalRows, 1) if sharedErrorArr is not None else None,
+                           outputDirPath, fileTag)
+
+
+def writeFileScores(file1Path, scoreArr, errorArr, outputDirPath, fileTag):
+    """
+    Writes the scores of a file in the single epilogos case, along with the temporary scores used by greatest hits
+
+    Input:
+    file1Path -- The path of the file the scores were calculated from
+    scoreArr -- 2d numpy array of the scores of each state in each row
+    errorArr -- 2d numpy array of the standard error of each row (None if the scores are exact)
+    outputDirPath -- The path of the output directory
+    fileTag -- A string which helps ensure outputed files are named similarly within an epilogos run
+
+    Output:
+    The path of the temporary scores used by greatest hits
+    """
+    filename = file1Path.name.split(".")[0]
+
+    chrName, binStart, binSize = getLocationInfo(file1Path)
+    locationArr = np.array([[chrName, binStart + binSize*i, binStart + binSize*(i+1)] for i in range(scoreArr.shape[0])])
 
     outputTxtPath = outputDirPath / "scores_{}_{}.txt.gz".format(fileTag, filename)
-    writeScores(sharedToNumpy(sharedArr, totalRows, numStates), outputTxtPath, locationArr)
+    writeScores(scoreArr, outputTxtPath, locationArr)
+    if errorArr is not None:
+        errorTxtPath = outputDirPath / "scoreErrors_{}_{}.txt.gz".format(fileTag, filename)
+        writeScores(errorArr, errorTxtPath, locationArr)
     # Temporary scores for greatest hits (np files are faster to read in)
     tempScoresPath = outputDirPath / "temp_scores_{}_{}.npz".format(fileTag, filename)
-    np.savez_compressed(tempScoresPath, chrName=np.array([chrName]), scoreArr=sharedToNumpy(sharedArr, totalRows, numStates),
-                        locationArr=locationArr)
+    np.savez_compressed(tempScoresPath, chrName=np.array([chrName]), scoreArr=scoreArr, locationArr=locationArr)
+
+    return tempScoresPath
 
 
-def calculateScoresPairwise(saliency, file1Path, file2Path, rowList, numStates, outputDirPath, expFreqPath, fileTag,
-                            filename, numProcesses, quiescentState, groupSize, verbose):
+def calculateScoresPairwise(saliency, filePairs, numStates, outputDirPath, expFreqPath, fileTag, numProcesses, quiescentState,
+                            groupSize, verbose, pool=None, numPermutations=1, deltaText=True):
     """
     Function responsible for deploying the processes used to calculate the scores in the paired epilogos case
 
     Input:
     saliency -- The saliency metric being used in the epilogos run
-    file1Path -- The path of the first file to read states from
-    file2Path -- The path of the second file to read states from
-    rowList -- A list of tuples which contain the first and last rows for each core to use
+    filePairs -- List of tuples of the paths of the first and second files to read states from
     numStates -- The number of states in the state model
     outputDirPath -- The path of the output directory
     expFreqPath -- The path to the expected frequency array
     fileTag -- A string which helps ensure outputed files are named similarly within an epilogos run
-    filename -- The name of the file for which we are calculating the expected frequencies
     numProcesses -- The number of cores to run on
     quiescentState -- The state used to filter out quiescent bins
     groupSize -- Size of the outputted null array
     verbose -- Boolean which if True, causes much more detailed prints
+    pool -- The multiprocessing pool to run on (see helpers.createPool()), if None a pool is created for these files
+    numPermutations -- The number of shuffles of each pair of files to calculate null distances for [default=1]
+    deltaText -- If True, the differences between the scores of each pair of files are written out to gzipped text files
+                 [default=True]
     """
     if verbose: print("\nNumber of Processes:", numProcesses, flush=True)
 
-    totalRows = rowList[-1][-1]
+    totalRowsList = [getNumRows(file1Path) for file1Path, _ in filePairs]
 
-    # Shared arrays across the multiple processes for the scores
+    # Shared arrays across the multiple processes for the scores of each pair of files
     # We avoid race conditions by writing to separate parts of the array in each process
-    sharedArr1 = RawArray(np.ctypeslib.as_ctypes_type(np.float32), totalRows * numStates)
-    sharedArr2 = RawArray(np.ctypeslib.as_ctypes_type(np.float32), totalRows * numStates)
-    shuffledSharedArr1 = RawArray(np.ctypeslib.as_ctypes_type(np.float32), totalRows * numStates)
-    shuffledSharedArr2 = RawArray(np.ctypeslib.as_ctypes_type(np.float32), totalRows * numStates)
-    quiescenceSharedArr = RawArray(np.ctypeslib.as_ctypes_type(np.bool_), totalRows)
-
-    # Start the processes
-    with closing(Pool(numProcesses, initializer=_initPairwise, initargs=(sharedArr1, sharedArr2, shuffledSharedArr1,
-                                                                         shuffledSharedArr2, quiescenceSharedArr, totalRows,
-                                                                         numStates, quiescentState, expFreqPath, groupSize,
-                                                                         verbose))) as pool:
+    # Only the differences between the real scores and the distances of the null scores are needed, so each process reduces
+    # the scores of its rows to those rather than storing the scores of each group
+    scoreBlocks = []
+    sharedArrsList = []
+    for totalRows in totalRowsList:
+        sharedArrs = []
+        for shape, dtype in [((totalRows * numStates,), np.float32), ((numPermutations * totalRows,), np.float32),
+                             ((totalRows,), np.bool_)]:
+            scoreBlock, sharedArrInfo = createSharedArray(shape, dtype)
+            scoreBlocks.append(scoreBlock)
+            sharedArrs.append(sharedArrInfo)
+        sharedArrsList.append(sharedArrs)
+
+    try:
+        # Shared memory for the parsed states, so that each file is parsed once and viewed by all processes
+        sharedBlocks, sharedStatesInfo = [], []
+        for filePair, totalRows in zip(filePairs, totalRowsList):
+            fileSharedBlocks, fileSharedStatesInfo = createSharedStates(list(filePair), totalRows, numStates)
+            sharedBlocks += fileSharedBlocks
+            sharedStatesInfo += fileSharedStatesInfo
+
         if saliency == 1:
-            pool.starmap(s1Score, zip(repeat(file1Path), repeat(file2Path), rowList))
+            scoreFunc = s1Score
         elif saliency == 2:
-            pool.starmap(s2Score, zip(repeat(file1Path), repeat(file2Path), rowList))
+            scoreFunc = s2Score
         else:
             raise ValueError("Please ensure that saliency metric is either 1 or 2 for Pairwise Epilogos")
-    pool.join()
-
-    # Calculate the differences between array 1 and 2 in both the real and null case
-    if verbose: print("Calculating Raw Differences...", flush=True); tDiff = time()
-    realDiffArr = sharedToNumpy(sharedArr1, totalRows, numStates) - sharedToNumpy(sharedArr2, totalRows, numStates)
-    nullDiffArr = sharedToNumpy(shuffledSharedArr1, totalRows, numStates) - \
-                  sharedToNumpy(shuffledSharedArr2, totalRows, numStates)
-    if verbose: print("    Time:", time() - tDiff, flush=True)
-
-    # Only calculate the distances for the null data in this step
-    if verbose: print("Calculating Squared Euclidean Distance and Maximum Contributing Difference...", flush=True); \
-        tDistance = time()
-    diffSign = np.sign(np.sum(nullDiffArr, axis=1))
-    nullDistancesArr = np.sum(np.square(nullDiffArr), axis=1) * diffSign
-    if verbose: print("    Time:", time() - tDistance, flush=True)
-
-    # If it's the real data, we will just write the delta and calculate metrics in computeEpilogosPairwiseVisual
-    # If it's the null data, we will just save the signed squared euclidean distances as a temporary npz file as we don't
-    # care about saving the data
-    # We also want to write the locations of any quiescent bins (where all states are in the quiescent state). This ensures
-    # that our eventual fit on the null data is more accurate.
+
+        # The text inputs are parsed by the first tasks, each scoring task waits only on the parsing of the rows it reads, and
+        # the differences of each pair of files are written as soon as the pair is scored
+        tasks, parseTaskRows = parseTasks(sharedStatesInfo, numStates, numProcesses)
+        dependencies = {}
+        scoreTaskIndices = [[] for _ in filePairs]
+        for fileIndex, rowsToCalc in splitTasks(totalRowsList, numProcesses):
+            dependencies[len(tasks)] = parseDependencies(parseTaskRows, filePairs[fileIndex], rowsToCalc)
+            scoreTaskIndices[fileIndex].append(len(tasks))
+            tasks.append((fileIndex, _initPairwise, (*sharedArrsList[fileIndex], sharedStatesInfo, totalRowsList[fileIndex],
+                                                     numStates, quiescentState, expFreqPath, groupSize, numPermutations,
+                                                     verbose),
+                          scoreFunc, (*filePairs[fileIndex], rowsToCalc)))
+        for (file1Path, _), totalRows, sharedArrs, fileScoreTaskIndices \
+                in zip(filePairs, totalRowsList, sharedArrsList, scoreTaskIndices):
+            dependencies[len(tasks)] = fileScoreTaskIndices
+            tasks.append((None, None, (), writeSharedScoresPairwise, (file1Path, sharedArrs, totalRows, numStates,
+                                                                       numPermutations, outputDirPath, fileTag, verbose,
+                                                                       deltaText)))
+
+        try:
+            with stagePool(pool, numProcesses) as pool:
+                results = runTasks(pool, tasks, numProcesses, verbose, dependencies)
+        finally:
+            freeSharedStates(sharedBlocks)
+
+        if verbose and saliency != 1: printHitRate([results[taskIndex] for fileScoreTaskIndices in scoreTaskIndices
+                                                    for taskIndex in fileScoreTaskIndices])
+    finally:
+        freeSharedStates(scoreBlocks)
+
+
+def writeSharedScoresPairwise(file1Path, sharedArrs, totalRows, numStates, numPermutations, outputDirPath, fileTag, verbose,
+                              deltaText):
+    """
+    Writes the differences between the scores of a pair of files in the paired epilogos case from the shared score arrays
+    (see writeFileScoresPairwise()). Run by the processes as soon as the pair of files is scored, while the next pairs are
+    scored
+
+    Input:
+    file1Path -- The path of the first file the scores were calculated from
+    sharedArrs -- List of the shared array of the differences between the scores of the files, the shared null distance
+                  array, and the shared array of the quiescent bins (see helpers.createSharedArray())
+    totalRows -- The number of rows of the files
+    numStates -- The number of states in the state model
+    numPermutations -- The number of shuffles the null distances were calculated for
+    outputDirPath -- The path of the output directory
+    fileTag -- A string which helps ensure outputed files are named similarly within an epilogos run
+    verbose -- Boolean which if True, causes much more detailed prints
+    deltaText -- If True, the differences are written out to a gzipped text file
+    """
+    diffSharedArr, nullDistanceSharedArr, quiescenceSharedArr = sharedArrs
+    writeFileScoresPairwise(file1Path, sharedToNumpy(diffSharedArr, totalRows, numStates),
+                            sharedToNumpy(nullDistanceSharedArr, numPermutations, totalRows),
+                            sharedArrayView(quiescenceSharedArr), outputDirPath, fileTag, verbose, deltaText)
+
+
+def writeFileScoresPairwise(file1Path, realDiffArr, nullDistancesArr, quiescenceArr, outputDirPath, fileTag, verbose,
+                            deltaText=True):
+    """
+    Writes the temporary real and null distances and quiescent bins of a pair of files used by pairwiseVisual in the paired
+    epilogos case, along with the differences between the scores of the files
+
+    Input:
+    file1Path -- The path of the first file the scores were calculated from
+    realDiffArr -- 2d numpy array of the differences between the scores of the first and second files
+    nullDistancesArr -- 2d numpy array of the null distance of each row (columns) for each permutation (rows)
+    quiescenceArr -- Numpy array containing T/F values for whether a bin is quiescent
+    outputDirPath -- The path of the output directory
+    fileTag -- A string which helps ensure outputed files are named similarly within an epilogos run
+    verbose -- Boolean which if True, causes much more detailed prints
+    deltaText -- If True, the differences are written out to a gzipped text file [default=True]
+    """
+    filename = file1Path.name.split(".")[0]
+
+    # If it's the real data, we reduce the delta to what pairwiseVisual needs to calculate the metrics (the signed squared
+    # euclidean distance and the state with the largest difference in each bin), which is saved as a temporary npz file along
+    # with the locations of the bins, and only write out the delta itself if it is asked for
+    # If it's the null data, we will just save the signed squared euclidean distances of each permutation as a temporary npz
+    # file as we don't care about saving the data
+    # We also want to write the locations of any quiescent bins (where all states are in the quiescent state). This
+    # ensures that our eventual fit on the null data is more accurate.
     if verbose: print("Writing output to disk...", flush=True); tWrite = time()
-    chrName = pd.read_table(file1Path, nrows=1, header=None, sep="\t").iloc[0, 0]
-    locationArr = np.array([[chrName, 200*i, 200*i+200] for i in range(totalRows)])
-    realOutputPath = outputDirPath / "pairwiseDelta_{}_{}.txt.gz".format(fileTag, filename)
-    writeScores(realDiffArr, realOutputPath, locationArr)
+    chrName, binStart, binSize = getLocationInfo(file1Path)
+    if deltaText:
+        locationArr = np.array([[chrName, binStart + binSize*i, binStart + binSize*(i+1)]
+                                for i in range(realDiffArr.shape[0])])
+        realOutputPath = outputDirPath / "pairwiseDelta_{}_{}.txt.gz".format(fileTag, filename)
+        writeScores(realDiffArr, realOutputPath, locationArr)
+    distanceArr = np.sum(np.square(realDiffArr), axis=1) * np.sign(np.sum(realDiffArr, axis=1))
+    # In the case of a tie, the higher number state wins (e.g. last state wins if all states are 0)
+    maxDiffArr = np.abs(np.argmax(np.abs(np.flip(realDiffArr, axis=1)), axis=1) - realDiffArr.shape[1]).astype(np.int32)
+    distanceOutputPath = outputDirPath / "temp_distances_{}_{}.npz".format(fileTag, filename)
+    np.savez(distanceOutputPath, chrName=np.array([chrName]), binStart=np.array([binStart]), binSize=np.array([binSize]),
+             distanceArr=distanceArr, maxDiffArr=maxDiffArr)
     nullOutputPath = outputDirPath / "temp_nullDistances_{}_{}.npz".format(fileTag, filename)
     np.savez_compressed(nullOutputPath, chrName=np.array([chrName]), nullDistances=nullDistancesArr)
     quiescentOutputPath = outputDirPath / "temp_quiescence_{}_{}.npz".format(fileTag, filename)
-    np.savez_compressed(quiescentOutputPath, chrName=np.array([chrName]),
-                        quiescenceArr=np.frombuffer(quiescenceSharedArr, dtype=np.bool_))
+    np.savez_compressed(quiescentOutputPath, chrName=np.array([chrName]), quiescenceArr=quiescenceArr)
     if verbose: print("    Time:", time() - tWrite, flush=True)
 
 
+def printHitRate(results):
+    """
+    Prints how many rows were scored by reusing the scores of another row with the same state counts (see blockScoresS2()) or
+    the same states (see blockScoresS3())
+
+    Input:
+    results -- List of tuples (numRowsScored, numEvaluations) returned by each process
+    """
+    numRowsScored = sum(result[0] for result in results)
+    numEvaluations = sum(result[1] for result in results)
+    print("Row deduplication: {} distinct rows scored out of {} rows (hit rate {:.2%})".format(numEvaluations,
+          numRowsScored, 1 - numEvaluations / numRowsScored if numRowsScored else 0), flush=True)
+
+
 def s1Score(file1Path, file2Path, rowsToCalc):
     """
     Function responsible for score calculation over a set of rows for a saliency metric of 1. Note that there are global
@@ -266,225 +546,516 @@ def s1Score(file1Path, file2Path, rowsToCalc):
 
     # Loading the data and creating the shared arrays for the scores
     if str(file2Path) == "null":
-        dataArr = readStates(file1Path=file1Path, file2Path=file2Path, rowsToCalc=rowsToCalc, expBool=False, verbose=verbose)
-
         numStates = sharedArr[2]
 
+        # Rows are either scored from the state counts kept by the expected frequency calculation or from their states
+        if countsPath is not None:
+            stateBlocks = readCountBlocks(countsPath, rowsToCalc)
+            numCols1 = getNumCols(file1Path)
+        else:
+            stateBlocks = readStateBlocks(file1Path=file1Path, file2Path=file2Path, rowsToCalc=rowsToCalc, expBool=False,
+                                          verbose=verbose, numStates=numStates)
+
         scoreArr = sharedToNumpy(*sharedArr)
     else:
-        file1Arr, file2Arr, shuffledFile1Arr, shuffledFile2Arr = readStates(file1Path=file1Path, file2Path=file2Path,
-                                                                            rowsToCalc=rowsToCalc, expBool=False,
-                                                                            verbose=verbose, groupSize=groupSize)
-
-        numStates = sharedArr1[2]
-
-        realScoreArr1 = sharedToNumpy(*sharedArr1)
-        realScoreArr2 = sharedToNumpy(*sharedArr2)
-        nullScoreArr1 = sharedToNumpy(*shuffledSharedArr1)
-        nullScoreArr2 = sharedToNumpy(*shuffledSharedArr2)
-        quiescenceArr = np.frombuffer(quiescenceSharedArr, dtype=np.bool_)
-
-        if quiescentState != -1:
-            # Figure out the quiescent bins
-            sortedArr1 = np.sort(file1Arr, axis=1)
-            sortedArr2 = np.sort(file2Arr, axis=1)
-            # If all values in a bin are equal to the quiescentState in both file1Arr and file2Arr, then the bin is quiescent
-            quiescenceArr[rowsToCalc[0]:rowsToCalc[1]][np.where((sortedArr1[:, 0] == quiescentState)
-                                                                & (sortedArr1[:, -1] == quiescentState)
-                                                                & (sortedArr2[:, 0] == quiescentState)
-                                                                & (sortedArr2[:, -1] == quiescentState))] = True
-
-    if verbose and rowsToCalc[0] == 0: print("Calculating Scores...", flush=True); tScore = time(); percentDone = 0
-    printCheckmarks = [int(rowsToCalc[1] * float(i / 10)) for i in range(1, 10)]
+        numStates = diffSharedArr[2]
 
-    # Calculate the observed frequencies and final scores for the designated rows
-    for obsRow, scoreRow in enumerate(range(rowsToCalc[0], rowsToCalc[1])):
+        stateBlocks = readStateBlocks(file1Path=file1Path, file2Path=file2Path, rowsToCalc=rowsToCalc, expBool=False,
+                                      verbose=verbose, groupSize=groupSize, numStates=numStates,
+                                      numPermutations=numPermutations)
 
-        if verbose and rowsToCalc[0] == 0 and obsRow in printCheckmarks: percentDone += 10; \
-            print("    {}% Completed".format(percentDone), flush=True)
-        if not verbose and rowsToCalc[0] == 0 and obsRow in printCheckmarks: print(".", end="", flush=True)
+        realDiffArr = sharedToNumpy(*diffSharedArr)
+        nullDistanceArr = sharedToNumpy(*nullDistanceSharedArr)
+        quiescenceArr = sharedArrayView(quiescenceSharedArr)
 
-        # Inputs to klScoreND are obsFreqArr and expFreqArr respectively
-        if str(file2Path) == "null":
-            scoreArr[scoreRow] = klScoreND(rowObsS1(dataArr, obsRow, numStates), expFreqArr)
+    if verbose and rowsToCalc[0] == 0: print("Calculating Scores...", flush=True); tScore = time()
+    printCheckmarks = [int(rowsToCalc[1] * float(i / 10)) for i in range(1, 10)]
+    percentDone = 0
+
+    # Calculate the observed frequencies and final scores for the designated rows, one block of rows at a time
+    for blockRows, blockArrs in stateBlocks:
+        if rowsToCalc[0] == 0: percentDone = printBlockProgress(blockRows, printCheckmarks, percentDone, verbose)
+
+        if str(file2Path) == "null" and countsPath is not None:
+            scoreArr[blockRows[0]:blockRows[1]] = countScoresS1(blockArrs, numCols1, expFreqArr, klTables)
+        elif str(file2Path) == "null":
+            scoreArr[blockRows[0]:blockRows[1]], = blockScoresS1((blockArrs,), numStates, expFreqArr, klTables)
         else:
-            realScoreArr1[scoreRow] = klScoreND(rowObsS1(file1Arr, obsRow, numStates), expFreqArr)
-            realScoreArr2[scoreRow] = klScoreND(rowObsS1(file2Arr, obsRow, numStates), expFreqArr)
-            nullScoreArr1[scoreRow] = klScoreND(rowObsS1(shuffledFile1Arr, obsRow, numStates), expFreqArr)
-            nullScoreArr2[scoreRow] = klScoreND(rowObsS1(shuffledFile2Arr, obsRow, numStates), expFreqArr)
+            file1Arr, file2Arr = blockArrs[:2]
+            if quiescentState != -1:
+                findQuiescentBins(file1Arr, file2Arr, quiescenceArr[blockRows[0]:blockRows[1]])
+
+            # The real and shuffled arrays are all scored together
+            blockScoreArrs = blockScoresS1(blockArrs, numStates, expFreqArr, klTables)
+            realDiffArr[blockRows[0]:blockRows[1]] = scoreDifference(*blockScoreArrs[:2])
+            nullDistanceArr[:, blockRows[0]:blockRows[1]] = nullDistances(blockScoreArrs[2:])
 
     if verbose and rowsToCalc[0] == 0: print("    Time:", time() - tScore, flush=True)
 
 
-def rowObsS1(dataArr, row, numStates):
+def blockScoresS1(dataArrs, numStates, expFreqArr, klTables):
     """
-    Calculates the observed counts for each state for a saliency metric of 1
+    Calculates the saliency 1 scores of every row of one or more blocks of states at once. The state counts of each row are
+    tallied for the whole block, and the score of each count is looked up in a precalculated table (see klTableS1())
 
     Input:
-    dataArr -- The numpy array which contains the states to count
-    row -- The row from which to calculate the observed counts
+    dataArrs -- Tuple of 2d numpy arrays containing the states of the blocks to score (these can have different widths)
     numStates -- The number of states in the state model
+    expFreqArr -- Numpy array of the expected frequencies
+    klTables -- Dictionary of the tables built so far, keyed by the number of epigenomes (updated in place)
+
+    Output:
+    List of 2d numpy arrays of the scores of each state in each row of each block
+    """
+    return [countScoresS1(countStates(dataArr, numStates), dataArr.shape[1], expFreqArr, klTables) for dataArr in dataArrs]
+
+
+def countScoresS1(countArr, numCols, expFreqArr, klTables):
+    """
+    Calculates the saliency 1 scores of a set of state count vectors by looking them up in a precalculated table (see
+    klTableS1())
+
+    Input:
+    countArr -- 2d numpy array of the count of each state (columns) in each row (rows)
+    numCols -- The number of epigenomes the states were counted over
+    expFreqArr -- Numpy array of the expected frequencies
+    klTables -- Dictionary of the tables built so far, keyed by the number of epigenomes (updated in place)
+
+    Output:
+    2d numpy array of the scores of each state in each row
+    """
+    if numCols not in klTables:
+        klTables[numCols] = klTableS1(numCols, expFreqArr)
+
+    return klTables[numCols][countArr, np.arange(countArr.shape[1])]
+
+
+def scoreDifference(scoreArr1, scoreArr2):
+    """
+    Calculates the differences between the scores of two groups at the precision the scores are written at
+
+    Input:
+    scoreArr1 -- 2d numpy array of the scores of the first group
+    scoreArr2 -- 2d numpy array of the scores of the second group
+
+    Output:
+    2d float32 numpy array of the differences between the scores of each state in each row
+    """
+    return scoreArr1.astype(np.float32) - scoreArr2.astype(np.float32)
+
+
+def nullDistances(nullScoreArrs):
+    """
+    Reduces the scores of each pair of shuffled groups to the signed squared euclidean distances between them
+
+    Input:
+    nullScoreArrs -- List of 2d numpy arrays of the scores of the first and second shuffled groups of each permutation in turn
+
+    Output:
+    2d numpy array of the null distance of each row (columns) for each permutation (rows)
+    """
+    nullDistanceArrs = []
+    for nullScoreArr1, nullScoreArr2 in zip(nullScoreArrs[::2], nullScoreArrs[1::2]):
+        nullDiffArr = scoreDifference(nullScoreArr1, nullScoreArr2)
+        nullDistanceArrs.append(np.sum(np.square(nullDiffArr), axis=1) * np.sign(np.sum(nullDiffArr, axis=1)))
+    return np.array(nullDistanceArrs)
+
+
+def findQuiescentBins(file1Arr, file2Arr, quiescenceArr):
+    """
+    Marks the quiescent bins of a block of rows in the shared quiescence array
+
+    Input:
+    file1Arr -- 2d numpy array of the states of the first file over the block of rows
+    file2Arr -- 2d numpy array of the states of the second file over the block of rows
+    quiescenceArr -- The section of the shared quiescence array covering the block of rows
+    """
+    # If all values in a bin are equal to the quiescentState in both file1Arr and file2Arr, then the bin is quiescent
+    # (compared directly rather than sorting, so no sorted copies of the state arrays are made)
+    quiescenceArr[:] = (file1Arr == quiescentState).all(axis=1) & (file2Arr == quiescentState).all(axis=1)
+
+
+def klTableS1(numCols, expFreqArr):
+    """
+    Precalculates the saliency 1 score of each state for every count it can have in a row. The observed frequency of a state
+    is the fraction of epigenomes in the row which are in that state (count / numCols), so there are only numCols + 1 possible
+    scores per state
+
+    Input:
+    numCols -- The number of epigenomes in a row
+    expFreqArr -- Numpy array of the expected frequencies
+
+    Output:
+    (numCols + 1) x numStates numpy array, where [count, state] is the score of the state when it appears count times
     """
-    rowObsArr = np.zeros(numStates)
-    # Count number of each state in row and return array
-    uniqueStates, stateCounts = np.unique(dataArr[row], return_counts=True)
-    for i, state in enumerate(uniqueStates):
-        rowObsArr[state] = stateCounts[i] / dataArr.shape[1]
-    return rowObsArr
+    return klScoreND(np.arange(numCols + 1)[:, np.newaxis] / numCols, expFreqArr)
 
 
 def s2Score(file1Path, file2Path, rowsToCalc):
     """
     Function responsible for score calculation over a set of rows for a saliency metric of 2. Note that there are global
-    variables used for the shared score array(s). There is no output as scores are put directly into the shared score array(s)
+    variables used for the shared score array(s). Scores are put directly into the shared score array(s)
 
     Input:
     file1Path -- The path of the only (single epilogos) or first (paired epilogos) file to read states from
     file2Path -- The path of the second file to read states from (paired epilogos)
     rowsToCalc -- The rows to count expected frequencies from the files
+
+    Output:
+    numRowsScored -- The number of rows scored (across all score arrays)
+    numEvaluations -- The number of distinct state counts which had to be scored (see blockScoresS2())
     """
     # Loading the expected frequency array
     expFreqArr = np.load(expFreqPath, allow_pickle=False)
 
     # Loading the data and creating the shared arrays for the scores
     if str(file2Path) == "null":
-        dataArr = readStates(file1Path=file1Path, file2Path=file2Path, rowsToCalc=rowsToCalc, expBool=False, verbose=verbose)
-
         numStates = sharedArr[2]
 
+        # Rows are either scored from the state counts kept by the expected frequency calculation or from their states
+        if countsPath is not None:
+            stateBlocks = readCountBlocks(countsPath, rowsToCalc)
+        else:
+            stateBlocks = readStateBlocks(file1Path=file1Path, file2Path=file2Path, rowsToCalc=rowsToCalc, expBool=False,
+                                          verbose=verbose, numStates=numStates)
+
         scoreArr = sharedToNumpy(*sharedArr)
 
-        # Need the permuations to effective count state pairs (see rowObsS2() for theory)
-        permutations = dataArr.shape[1] * (dataArr.shape[1] - 1)
+        # Need the permuations to effective count state pairs (see klTableS2() for theory)
+        numCols1 = getNumCols(file1Path)
+        permutations1 = numCols1 * (numCols1 - 1)
     else:
-        file1Arr, file2Arr, shuffledFile1Arr, shuffledFile2Arr = readStates(file1Path=file1Path, file2Path=file2Path,
-                                                                            rowsToCalc=rowsToCalc, expBool=False,
-                                                                            verbose=verbose, groupSize=groupSize)
-
-        numStates = sharedArr1[2]
-
-        realScoreArr1 = sharedToNumpy(*sharedArr1)
-        realScoreArr2 = sharedToNumpy(*sharedArr2)
-        nullScoreArr1 = sharedToNumpy(*shuffledSharedArr1)
-        nullScoreArr2 = sharedToNumpy(*shuffledSharedArr2)
-        quiescenceArr = np.frombuffer(quiescenceSharedArr, dtype=np.bool_)
-
-        if quiescentState != -1:
-            # Figure out the quiescent bins
-            sortedArr1 = np.sort(file1Arr, axis=1)
-            sortedArr2 = np.sort(file2Arr, axis=1)
-            # If all values in a bin are equal to the quiescentState in both file1Arr and file2Arr, then the bin is quiescent
-            quiescenceArr[rowsToCalc[0]:rowsToCalc[1]][np.where((sortedArr1[:, 0] == quiescentState)
-                                                                & (sortedArr1[:, -1] == quiescentState)
-                                                                & (sortedArr2[:, 0] == quiescentState)
-                                                                & (sortedArr2[:, -1] == quiescentState))] = True
-
-        # Need the permuations to effective count state pairs (see rowObsS2() for theory)
-        permutations1 = file1Arr.shape[1] * (file1Arr.shape[1] - 1)
-        permutations2 = file2Arr.shape[1] * (file2Arr.shape[1] - 1)
-
-    if verbose and rowsToCalc[0] == 0: print("Calculating Scores...", flush=True); tScore = time(); percentDone = 0
-    printCheckmarks = [int(rowsToCalc[1] * float(i / 10)) for i in range(1, 10)]
+        numStates = diffSharedArr[2]
 
-    # Find scores for each row that the core is responsible for
-    for obsRow, scoreRow in enumerate(range(rowsToCalc[0], rowsToCalc[1])):
+        stateBlocks = readStateBlocks(file1Path=file1Path, file2Path=file2Path, rowsToCalc=rowsToCalc, expBool=False,
+                                      verbose=verbose, groupSize=groupSize, numStates=numStates,
+                                      numPermutations=numPermutations)
 
-        if verbose and rowsToCalc[0] == 0 and obsRow in printCheckmarks: percentDone += 10; \
-            print("    {}% Completed".format(percentDone), flush=True)
-        if not verbose and rowsToCalc[0] == 0 and obsRow in printCheckmarks: print(".", end="", flush=True)
+        realDiffArr = sharedToNumpy(*diffSharedArr)
+        nullDistanceArr = sharedToNumpy(*nullDistanceSharedArr)
+        quiescenceArr = sharedArrayView(quiescenceSharedArr)
 
-        # Inputs to klScoreND are obsFreqArr and expFreqArr respectively
-        if str(file2Path) == "null":
-            scoreArr[scoreRow] = klScoreND(rowObsS2(dataArr, obsRow, permutations, numStates), expFreqArr).sum(axis=0)
+        # Need the permuations to effective count state pairs (see klTableS2() for theory)
+        numCols1, numCols2 = getNumCols(file1Path), getNumCols(file2Path)
+        permutations1 = numCols1 * (numCols1 - 1)
+        permutations2 = numCols2 * (numCols2 - 1)
+
+    numRowsScored, numEvaluations = 0, 0
+
+    if verbose and rowsToCalc[0] == 0: print("Calculating Scores...", flush=True); tScore = time()
+    printCheckmarks = [int(rowsToCalc[1] * float(i / 10)) for i in range(1, 10)]
+    percentDone = 0
+
+    # Find scores for each row that the core is responsible for, one block of rows at a time
+    for blockRows, blockArrs in stateBlocks:
+        if rowsToCalc[0] == 0: percentDone = printBlockProgress(blockRows, printCheckmarks, percentDone, verbose)
+
+        if str(file2Path) == "null" and countsPath is not None:
+            blockScoreArr, blockEvaluations = uniqueCountScoresS2(blockArrs, numCols1, permutations1, expFreqArr, klTables)
+            blockScoreArrs = [blockScoreArr]
+            scoreArr[blockRows[0]:blockRows[1]] = blockScoreArr
+        elif str(file2Path) == "null":
+            blockScoreArrs, blockEvaluations = blockScoresS2((blockArrs,), (permutations1,), numStates, expFreqArr, klTables)
+            scoreArr[blockRows[0]:blockRows[1]] = blockScoreArrs[0]
         else:
-            realScoreArr1[scoreRow] = klScoreND(rowObsS2(file1Arr, obsRow, permutations1, numStates), expFreqArr).sum(axis=0)
-            realScoreArr2[scoreRow] = klScoreND(rowObsS2(file2Arr, obsRow, permutations2, numStates), expFreqArr).sum(axis=0)
-            nullScoreArr1[scoreRow] = klScoreND(rowObsS2(shuffledFile1Arr, obsRow, permutations1, numStates),
-                                                expFreqArr).sum(axis=0)
-            nullScoreArr2[scoreRow] = klScoreND(rowObsS2(shuffledFile2Arr, obsRow, permutations2, numStates),
-                                                expFreqArr).sum(axis=0)
+            file1Arr, file2Arr = blockArrs[:2]
+            if quiescentState != -1:
+                findQuiescentBins(file1Arr, file2Arr, quiescenceArr[blockRows[0]:blockRows[1]])
+
+            # The real and shuffled arrays are all scored together (each null array is normalized by the permutations of
+            # the real array in the same position)
+            blockScoreArrs, blockEvaluations = blockScoresS2(blockArrs, (permutations1, permutations2) * (1 + numPermutations),
+                                                             numStates, expFreqArr, klTables)
+            realDiffArr[blockRows[0]:blockRows[1]] = scoreDifference(*blockScoreArrs[:2])
+            nullDistanceArr[:, blockRows[0]:blockRows[1]] = nullDistances(blockScoreArrs[2:])
+
+        numRowsScored += (blockRows[1] - blockRows[0]) * len(blockScoreArrs)
+        numEvaluations += blockEvaluations
 
     if verbose and rowsToCalc[0] == 0: print("    Time:", time() - tScore, flush=True)
 
+    return numRowsScored, numEvaluations
+
 
-def rowObsS2(dataArr, row, permutations, numStates):
+def blockScoresS2(dataArrs, permutationsList, numStates, expFreqArr, klTables):
     """
-    Calculates the observed counts for each pair of states for a saliency metric of 2
+    Calculates the saliency 2 scores of every row of one or more blocks of states at once. The scores of a row only depend on
+    its state counts, so each distinct vector of state counts within a block is only scored once
 
     Input:
-    dataArr -- The numpy array which contains the states to count
-    row -- The row from which to calculate the observed counts
-    permutations -- The number of permutations of epigenomes possible within the row of the dataArr
+    dataArrs -- Tuple of 2d numpy arrays containing the states of the blocks to score (these can have different widths)
+    permutationsList -- Tuple of the number of permutations used to normalize the pair counts of each block
     numStates -- The number of states in the state model
+    expFreqArr -- Numpy array of the expected frequencies
+    klTables -- Dictionary of the tables built so far, keyed by the number of epigenomes and permutations (updated in place)
+
+    Output:
+    blockScoreArrs -- List of 2d numpy arrays of the scores of each state in each row of each block
+    numEvaluations -- The number of distinct state counts which had to be scored
+    """
+    blockScoreArrs = []
+    numEvaluations = 0
+    for dataArr, permutations in zip(dataArrs, permutationsList):
+        blockScoreArr, blockEvaluations = uniqueCountScoresS2(countStates(dataArr, numStates), dataArr.shape[1], permutations,
+                                                              expFreqArr, klTables)
+        blockScoreArrs.append(blockScoreArr)
+        numEvaluations += blockEvaluations
+
+    return blockScoreArrs, numEvaluations
+
+
+def uniqueCountScoresS2(countArr, numCols, permutations, expFreqArr, klTables):
     """
-    # (Within a row, how many ways can you choose x and y to be together) / (how many ordered ways can you choose 2 states)
-    #  = Prob of choosing x and y
-    # Can choose x and y to be together x*y ways if different and n(n-1) ways if same
-    # (where n is the number of times that x/y shows up)
-    rowObsArr = np.zeros((numStates, numStates))
-    uniqueStates, stateCounts = np.unique(dataArr[row], return_counts=True)
-    for i, state1 in enumerate(uniqueStates):
-        for j, state2 in enumerate(uniqueStates):
-            if state1 == state2:
-                # Equates to statecounts[i] permute 2 / permutations
-                rowObsArr[state1, state2] = stateCounts[i] * (stateCounts[i] - 1) / permutations
-            else:  # state1 > state2 or state1 < state2
-                rowObsArr[state1, state2] = stateCounts[i] * stateCounts[j] / permutations
-    return rowObsArr
+    Calculates the saliency 2 scores of the state count vectors of a block of rows, scoring each distinct vector only once
+
+    Input:
+    countArr -- 2d numpy array of the count of each state (columns) in each row (rows)
+    numCols -- The number of epigenomes the states were counted over
+    permutations -- The number of permutations used to normalize the pair counts
+    expFreqArr -- Numpy array of the expected frequencies
+    klTables -- Dictionary of the tables built so far, keyed by the number of epigenomes and permutations (updated in place)
+
+    Output:
+    2d numpy array of the scores of each state in each row
+    The number of distinct state counts which had to be scored
+    """
+    numStates = countArr.shape[1]
+    uniqueCountArr, inverseArr = np.unique(countArr, axis=0, return_inverse=True)
+
+    # Score the distinct counts in chunks to bound the size of the numStates x numStates pair score arrays
+    uniqueScoreArr = np.empty((uniqueCountArr.shape[0], numStates))
+    chunkSize = max(klChunkMaxSize // numStates ** 2, 1)
+    for chunkStart in range(0, uniqueCountArr.shape[0], chunkSize):
+        uniqueScoreArr[chunkStart:chunkStart+chunkSize] = \
+            countScoresS2(uniqueCountArr[chunkStart:chunkStart+chunkSize], numCols, permutations, expFreqArr, klTables)
+
+    return uniqueScoreArr[inverseArr.reshape(-1)], uniqueCountArr.shape[0]
+
+
+def countScoresS2(countArr, numCols, permutations, expFreqArr, klTables):
+    """
+    Calculates the saliency 2 scores of a set of state count vectors. Within a row with state counts c, the number of ways of
+    choosing each ordered pair of states is c cT - diag(c). The scores of each pair are looked up in a precalculated table
+    when one fits within klTableMaxSize (see klTableS2()) and are otherwise calculated directly
+
+    Input:
+    countArr -- 2d numpy array of the count of each state (columns) in each row (rows)
+    numCols -- The number of epigenomes the states were counted over
+    permutations -- The number of permutations used to normalize the pair counts
+    expFreqArr -- Numpy array of the expected frequencies
+    klTables -- Dictionary of the tables built so far, keyed by the number of epigenomes and permutations (updated in place)
+
+    Output:
+    2d numpy array of the scores of each state in each row
+    """
+    numStates = countArr.shape[1]
+    stateRange = np.arange(numStates)
+
+    if (numCols, permutations) not in klTables:
+        klTables[(numCols, permutations)] = klTableS2(numCols, permutations, expFreqArr) \
+            if (numCols + 1) ** 2 * numStates ** 2 <= klTableMaxSize else None
+    klTable = klTables[(numCols, permutations)]
+
+    if klTable is not None:
+        klArr = klTable[countArr[:, :, np.newaxis], countArr[:, np.newaxis, :], stateRange[:, np.newaxis], stateRange]
+    else:
+        pairCountArr = countArr[:, :, np.newaxis] * countArr[:, np.newaxis, :]
+        pairCountArr[:, stateRange, stateRange] -= countArr
+        klArr = klScoreND(pairCountArr / permutations, expFreqArr)
+
+    # The score of each state is the sum of the scores of all pairs it is the second state of
+    return klArr.sum(axis=1)
+
+
+def klTableS2(numCols, permutations, expFreqArr):
+    """
+    Precalculates the saliency 2 score of each pair of states for every pair of counts they can have in a row. Observed
+    frequencies are the number of ways of choosing the pair within a row divided by the number of ordered ways of choosing 2
+    epigenomes (permutations). This is count1 * count2 for different states and count * (count - 1) for a state paired with
+    itself
+
+    Input:
+    numCols -- The number of epigenomes in a row
+    permutations -- The number of permutations used to normalize the pair counts
+    expFreqArr -- Numpy array of the expected frequencies
+
+    Output:
+    (numCols + 1) x (numCols + 1) x numStates x numStates numpy array, where [count1, count2, state1, state2] is the score of
+    state1 and state2 appearing together when they appear count1 and count2 times respectively
+    """
+    numStates = expFreqArr.shape[0]
+    counts = np.arange(numCols + 1)
+
+    obsFreqArr = np.empty((numCols + 1, numCols + 1, numStates, numStates))
+    obsFreqArr[:] = (np.multiply.outer(counts, counts) / permutations)[:, :, np.newaxis, np.newaxis]
+    obsFreqArr[:, :, np.arange(numStates), np.arange(numStates)] = (counts * (counts - 1) / permutations)[:, np.newaxis,
+                                                                                                           np.newaxis]
+
+    return klScoreND(obsFreqArr, expFreqArr)
 
 
 def s3Score(file1Path, rowsToCalc):
     """
     Function responsible for score calculation over a set of rows for a saliency metric of 3. Note that there are global
-    variables used for the shared score array(s). There is no output as scores are put directly into the shared score array(s)
+    variables used for the shared score array(s). Scores (and the standard errors of approximate saliency 3) are put directly
+    into the shared arrays
 
     Input:
     file1Path -- The path of the only file to read states from
     rowsToCalc -- The rows to count expected frequencies from the files
-    """
-    dataArr = readStates(file1Path=file1Path, rowsToCalc=rowsToCalc, verbose=verbose)
 
-    # Loading the expected frequency array
-    expFreqArr = np.load(expFreqPath, allow_pickle=False)
-
-    numCols = dataArr.shape[1]
+    Output:
+    numRowsScored -- The number of rows scored
+    numEvaluations -- The number of distinct rows which had to be scored
+    """
     numStates = sharedArr[2]
 
-    # Gives us everyway to combine the column numbers in numpy indexing form
-    basePermutationArr = np.array(list(permutations(range(numCols), 2)), dtype=np.int16).T
-
-    # Because each epigenome, epigenome, state, state combination only occurs once per row, we can precalculate all the
-    # scores assuming a frequency of 1/(numCols*(numCols-1))
-    # This saves a lot of time in the loop as we are just looking up references and not calculating
-    scoreArrOnes = klScoreND(np.ones((numCols, numCols, numStates, numStates), dtype=np.float32) / (numCols * (numCols - 1)),
-                             expFreqArr)
+    # Loading the expected frequency array (memory mapped as it holds numStates * numStates values per epigenome pair)
+    expFreqArr = np.load(expFreqPath, mmap_mode="r", allow_pickle=False)
 
-    if verbose and rowsToCalc[0] == 0: print("Calculating Scores...", flush=True); tScore = time(); percentDone = 0
+    if verbose and rowsToCalc[0] == 0: print("Calculating Scores...", flush=True); tScore = time()
     printCheckmarks = [int(rowsToCalc[1] * float(i / 10)) for i in range(1, 10)]
+    percentDone = 0
 
-    # Calculte the scores and store them in the shared array
+    # Calculte the scores and store them in the shared array, one block of rows at a time
     scoreArr = sharedToNumpy(*sharedArr)
-    rowScoreArr = np.zeros(numStates, dtype=np.float32)
-    for dataRow, scoreRow in enumerate(range(rowsToCalc[0], rowsToCalc[1])):
+    errorArr = sharedArrayView(sharedErrorArr) if sharedErrorArr is not None else None
+    numEvaluations = 0
+    for blockRows, dataArr in readStateBlocks(file1Path=file1Path, rowsToCalc=rowsToCalc, verbose=verbose,
+                                              numStates=numStates):
+        if rowsToCalc[0] == 0: percentDone = printBlockProgress(blockRows, printCheckmarks, percentDone, verbose)
+
+        scoreArr[blockRows[0]:blockRows[1]], blockErrorArr, blockEvaluations = \
+            blockScoresS3(dataArr, numStates, expFreqArr, scoreTiles)
+        if errorArr is not None:
+            errorArr[blockRows[0]:blockRows[1]] = blockErrorArr
+        numEvaluations += blockEvaluations
 
-        if verbose and rowsToCalc[0] == 0 and dataRow in printCheckmarks: percentDone += 10; \
-            print("    {}% Completed".format(percentDone), flush=True)
-        if not verbose and rowsToCalc[0] == 0 and dataRow in printCheckmarks: print(".", end="", flush=True)
+    if verbose and rowsToCalc[0] == 0: print("    Time:", time() - tScore, flush=True)
 
-        if dataRow < dataArr.shape[0]:
-            # Pull the scores from the precalculated score array add them to the correct index in the rowScoreArr
-            np.add.at(rowScoreArr, dataArr[dataRow, basePermutationArr[1]], scoreArrOnes[basePermutationArr[0],
-                                                                                    basePermutationArr[1],
-                                                                                    dataArr[dataRow, basePermutationArr[0]],
-                                                                                    dataArr[dataRow, basePermutationArr[1]]])
+    return rowsToCalc[1] - rowsToCalc[0], numEvaluations
 
-            # Store the scores in the shared score array
-            scoreArr[scoreRow] = rowScoreArr
 
-            # Reset the array so it doesn't carry over scores from other rows
-            rowScoreArr.fill(0)
+def blockScoresS3(dataArr, numStates, expFreqArr, scoreTiles):
+    """
+    Calculates the saliency 3 scores of every row of a block of states at once. Identical rows have identical scores, so each
+    distinct row within the block is only scored once
 
-    if verbose and rowsToCalc[0] == 0: print("    Time:", time() - tScore, flush=True)
+    The epigenome pairs are worked through in tiles, where a tile holds the pairs of one epigenome with every later epigenome
+    (see scoreTileS3()). The pair scores of a tile are gathered for a chunk of rows at a time and summed into a score per row
+    and epigenome, which is finally added to the state of that epigenome in that row with a single bincount
+
+    If the expected frequencies only cover a random sample of the epigenome pairs (see helpers.getEpigenomePairs()), the
+    scores are estimates of the full saliency 3 scores. As each sampled pair stands in for numPairs / numSampledPairs pairs,
+    the standard error of the total score of a row follows from the spread of its sampled pair scores
+
+    Input:
+    dataArr -- 2d numpy array containing the states of the block to score
+    numStates -- The number of states in the state model
+    expFreqArr -- Numpy array (or memory map) of the expected frequencies of each (sampled) epigenome pair
+    scoreTiles -- Dictionary of the score tiles kept so far, keyed by their first epigenome (updated in place)
+
+    Output:
+    blockScoreArr -- 2d numpy array of the scores of each state in each row of the block
+    blockErrorArr -- 1d numpy array of the standard error of the total score of each row (None if every pair is used)
+    numEvaluations -- The number of distinct rows which had to be scored
+    """
+    numCols = dataArr.shape[1]
+    numPairs = numCols * (numCols - 1) // 2
+    numSampledPairs = expFreqArr.shape[0]
+    firstCols, secondCols = getEpigenomePairs(numCols, numSampledPairs)
+
+    # The pairs of each epigenome with the later epigenomes are contiguous (see helpers.getEpigenomePairs())
+    tileStarts = np.searchsorted(firstCols, np.arange(numCols))
+    pairOffsets = np.arange(numCols - 1, dtype=np.int32)[:, np.newaxis] * numStates * numStates
+
+    uniqueArr, inverseArr = np.unique(dataArr, axis=0, return_inverse=True)
+    uniqueScoreArr = np.empty((uniqueArr.shape[0], numStates))
+    uniqueSquareArr = np.zeros(uniqueArr.shape[0]) if numSampledPairs < numPairs else None
+
+    # The distinct rows are scored in panels to bound the size of the per epigenome arrays
+    panelSize = max(s3PanelMaxSize // numCols, 1)
+    chunkSize = max(s3ChunkMaxSize // numCols, 1)
+    indexArr = np.empty((numCols - 1, chunkSize), dtype=np.int32)
+    pairScoreArr = np.empty((numCols - 1, chunkSize), dtype=np.float32)
+    for panelStart in range(0, uniqueArr.shape[0], panelSize):
+        stateArr = uniqueArr[panelStart:panelStart+panelSize].T.astype(np.int32)
+        numPanelRows = stateArr.shape[1]
+        firstStateArr = stateArr * numStates
+        colScoreArr = np.zeros((numCols, numPanelRows), dtype=np.float32)
+
+        for col in range(numCols - 1):
+            tileStart, tileEnd = tileStarts[col], tileStarts[col + 1]
+            numTilePairs = tileEnd - tileStart
+            if numTilePairs == 0:
+                continue
+            # Every later epigenome is paired with col unless the pairs are sampled
+            tileCols = slice(col + 1, None) if numTilePairs == numCols - 1 - col else secondCols[tileStart:tileEnd]
+
+            if col in scoreTiles:
+                scoreTile = scoreTiles[col]
+            else:
+                scoreTile = scoreTileS3(expFreqArr, tileStart, tileEnd)
+                # Tiles are only kept if all of them fit, otherwise they are streamed from the expected frequencies
+                if expFreqArr.size <= s3TileCacheMaxSize:
+                    scoreTiles[col] = scoreTile
+
+            for chunkStart in range(0, numPanelRows, chunkSize):
+                chunkEnd = min(chunkStart + chunkSize, numPanelRows)
+                chunkIndexArr = indexArr[:numTilePairs, :chunkEnd-chunkStart]
+                chunkPairScoreArr = pairScoreArr[:numTilePairs, :chunkEnd-chunkStart]
+
+                # Index of [pair, state of col, state of the later epigenome] into the flattened score tile
+                np.add(pairOffsets[:numTilePairs], firstStateArr[col, chunkStart:chunkEnd], out=chunkIndexArr)
+                chunkIndexArr += stateArr[tileCols, chunkStart:chunkEnd]
+                np.take(scoreTile, chunkIndexArr, out=chunkPairScoreArr)
+
+                # Each pair score goes to both of its epigenomes
+                colScoreArr[col, chunkStart:chunkEnd] += chunkPairScoreArr.sum(axis=0)
+                colScoreArr[tileCols, chunkStart:chunkEnd] += chunkPairScoreArr
+
+                if uniqueSquareArr is not None:
+                    uniqueSquareArr[panelStart+chunkStart:panelStart+chunkEnd] += \
+                        np.einsum("ij,ij->j", chunkPairScoreArr, chunkPairScoreArr, dtype=np.float64)
+
+        # Each row has its own numStates bins, so the bincount adds every epigenome score to the right row and state at once
+        rowOffsets = np.arange(numPanelRows) * numStates
+        uniqueScoreArr[panelStart:panelStart+numPanelRows] = \
+            np.bincount((stateArr + rowOffsets).ravel(), colScoreArr.ravel(), minlength=numPanelRows * numStates) \
+            .reshape(numPanelRows, numStates)
+
+    blockErrorArr = None
+    if uniqueSquareArr is not None:
+        # Each sampled pair adds twice its tile score to the total of a row. The variance of the total is that of a sum over a
+        # simple random sample without replacement of numSampledPairs out of numPairs pairs
+        totalArr = uniqueScoreArr.sum(axis=1)
+        pairVarianceArr = (4 * uniqueSquareArr - totalArr ** 2 / numSampledPairs) / max(numSampledPairs - 1, 1)
+        uniqueErrorArr = np.sqrt(np.maximum(numSampledPairs * (1 - numSampledPairs / numPairs) * pairVarianceArr, 0))
+        blockErrorArr = uniqueErrorArr[inverseArr.reshape(-1)]
+
+    return uniqueScoreArr[inverseArr.reshape(-1)], blockErrorArr, uniqueArr.shape[0]
+
+
+def scoreTileS3(expFreqArr, tileStart, tileEnd):
+    """
+    Precalculates the saliency 3 scores of a tile of epigenome pairs, reading only the tile from the expected frequencies.
+    Because each epigenome pair, state, state combination only occurs once per row, all the scores can be calculated assuming
+    a frequency of 1/numPairs. Each pair score is split evenly between the states of its two epigenomes
+
+    With sampled pairs, numPairs is the number of sampled pairs. The expected frequencies are then normalized over the sample
+    too, which scales each pair score by numPairs / numSampledPairs, so summing over the sample estimates the full score
+
+    Input:
+    expFreqArr -- Numpy array (or memory map) of the expected frequencies of each epigenome pair
+    tileStart -- The first epigenome pair of the tile
+    tileEnd -- The epigenome pair after the last one of the tile
+
+    Output:
+    Flattened numpy array of the scores, where [pair * numStates * numStates + state1 * numStates + state2] is the score of
+    the (tileStart + pair)th epigenome pair being in state1 and state2
+    """
+    expFreqTile = np.asarray(expFreqArr[tileStart:tileEnd])
+    return (klScoreND(np.ones(expFreqTile.shape, dtype=np.float32) / expFreqArr.shape[0], expFreqTile) / 2).ravel()
 
 
 def writeScores(dataArr, outputTxtPath, locationArr):
@@ -528,4 +1099,5 @@ def klScoreND(obs, exp):
 
 if __name__ == "__main__":
     main(argv[1], argv[2], int(argv[3]), int(argv[4]), argv[5], argv[6], argv[7], int(argv[8]), int(argv[9]), int(argv[10]),
-         strToBool(argv[11]))
\ No newline at end of file
+         strToBool(argv[11]), keepCounts=strToBool(argv[12]) if len(argv) > 12 else False,
+         numPermutations=int(argv[13]) if len(argv) > 13 else 1, deltaText=strToBool(argv[14]) if len(argv) > 14 else True)
\ No newline at end of file
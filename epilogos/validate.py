@@ -0,0 +1,100 @@
+import numpy as np
+import pandas as pd
+from sys import argv
+from pathlib import Path
+from time import time
+from contextlib import closing
+from tempfile import TemporaryDirectory
+from multiprocessing import cpu_count
+from epilogos.helpers import strToBool, getNumStates, getNumCols, createPool
+from epilogos.expected import main as expected
+from epilogos.expectedCombination import main as expectedCombination
+from epilogos.scores import main as scores
+
+
+def main(file, stateInfo, numSampledPairs, outputDirectory, numProcesses, verbose):
+    """
+    Measures the error of approximate saliency 3 against exact saliency 3 on a single (ideally small) chromosome file. Both are
+    run from scratch and the differences between their scores are compared to the reported standard errors. The outputs of
+    both runs are only kept until the comparison is done, and the report is written to
+    validation_s3_p{numSampledPairs}_{filename}.txt in the output directory
+
+    Input:
+    file -- The path of the state file to validate on
+    stateInfo -- State model info file
+    numSampledPairs -- The number of epigenome pairs sampled for approximate saliency 3
+    outputDirectory -- The path of the directory to write the report to
+    numProcesses -- The number of cores to run on
+    verbose -- Boolean which if True, causes much more detailed prints
+    """
+    filePath = Path(file)
+    outputDirPath = Path(outputDirectory)
+    if not outputDirPath.exists():
+        outputDirPath.mkdir(parents=True)
+
+    numStates = getNumStates(stateInfo)
+    numCols = getNumCols(filePath)
+    numPairs = numCols * (numCols - 1) // 2
+    if not 0 < numSampledPairs < numPairs:
+        raise ValueError("The number of sampled pairs must be between 1 and {} (the number of epigenome pairs in {})"
+                         .format(numPairs - 1, filePath.name))
+
+    filename = filePath.name.split(".")[0]
+    runTimes, scoreArrs = [], []
+    # The outputs of both runs are written to a temporary directory within the output directory, which is removed (along with
+    # everything in it) once the scores have been read back in
+    with TemporaryDirectory(prefix="temp_validate_", dir=outputDirPath) as runDirectory:
+        runDirPath = Path(runDirectory)
+
+        # Both runs share one pool of processes
+        with closing(createPool(numProcesses if numProcesses else cpu_count())) as pool:
+            for fileTag, runSampledPairs in (("validate_s3", 0),
+                                             ("validate_s3_p{}".format(numSampledPairs), numSampledPairs)):
+                print("\n{} saliency 3".format("Exact" if runSampledPairs == 0 else "Approximate ({} of {} pairs)"
+                                               .format(numSampledPairs, numPairs)), flush=True)
+                storedExpPath = runDirPath / "exp_freq_{}.npy".format(fileTag)
+
+                tRun = time()
+                expected(filePath, "null", numStates, 3, runDirPath, fileTag, numProcesses, verbose, runSampledPairs,
+                         pool=pool)
+                expectedCombination(runDirPath, storedExpPath, fileTag, verbose)
+                scores(filePath, "null", numStates, 3, runDirPath, storedExpPath, fileTag, numProcesses, -1, -1, verbose,
+                       pool)
+                runTimes.append(time() - tRun)
+
+                scoreArrs.append(np.load(runDirPath / "temp_scores_{}_{}.npz".format(fileTag, filename),
+                                         allow_pickle=False)["scoreArr"].astype(np.float64))
+
+        pool.join()
+
+        errorArr = pd.read_table(runDirPath / "scoreErrors_validate_s3_p{}_{}.txt.gz".format(numSampledPairs, filename),
+                                 header=None, sep="\t").values[:, 3].astype(np.float64)
+
+    exactArr, approxArr = scoreArrs
+
+    totalDiffArr = approxArr.sum(axis=1) - exactArr.sum(axis=1)
+    meanTotal = np.abs(exactArr.sum(axis=1)).mean()
+    withinError = np.abs(totalDiffArr) <= 2 * errorArr
+
+    reportLines = [
+        "Validation of approximate saliency 3 on {} ({} bins, {} epigenomes)".format(filePath.name, exactArr.shape[0],
+                                                                                     numCols),
+        "    Sampled pairs = {} of {} ({:.2%})".format(numSampledPairs, numPairs, numSampledPairs / numPairs),
+        "    Time (exact / approximate) = {:.1f}s / {:.1f}s".format(*runTimes),
+        "    Mean absolute error of the state scores = {:.5f}".format(np.abs(approxArr - exactArr).mean()),
+        "    Max absolute error of the state scores = {:.5f}".format(np.abs(approxArr - exactArr).max()),
+        "    Mean absolute error of the bin totals = {:.5f} ({:.2%} of the mean bin total)"
+        .format(np.abs(totalDiffArr).mean(), np.abs(totalDiffArr).mean() / meanTotal if meanTotal else 0),
+        "    Mean reported standard error = {:.5f}".format(errorArr.mean()),
+        "    Bins with a total within 2 standard errors = {:.2%}".format(withinError.mean())]
+
+    reportPath = outputDirPath / "validation_s3_p{}_{}.txt".format(numSampledPairs, filename)
+    with open(reportPath, "w") as f:
+        f.write("\n".join(reportLines) + "\n")
+
+    print("\n" + "\n".join(reportLines), flush=True)
+    print("    Report written to:", reportPath, flush=True)
+
+
+if __name__ == "__main__":
+    main(argv[1], argv[2], int(argv[3]), argv[4], int(argv[5]), strToBool(argv[6]))
@@ -26,6 +26,7 @@ setup(
     scripts=["bin/preprocess_data_ChromHMM.sh", "bin/download_example_data.sh"],
     include_package_data=True,
     install_requires=install_requirements,
+    python_requires=">=3.8",
     entry_points={
         "console_scripts": [
             "epilogos = epilogos.run:main",